@@ -1,31 +1,52 @@
-from flask import Flask, request, jsonify, render_template, current_app
+from flask import Flask, Response, request, jsonify, render_template, current_app, g
 import os
-from db_manager import db_exists, validate_sqlite_db, restore_from_backup, create_empty_db, calculate_db_hash, rotate_local_backups
-from drive_utils import download_latest_db_from_drive, perform_backup
-from utils import log_info, log_error, file_lock, get_sqlite_connection
+import json
+import base64
+import hashlib
+import html
+import sqlite3
+from contextlib import nullcontext
+from db_manager import db_exists, validate_sqlite_db, restore_from_backup, replace_db_file, create_empty_db, calculate_db_hash, store_chunks, snapshot_db, BACKUP_MODE, PENDING_SNAPSHOT, ChangeWatcher, JWT_LOGIN_DDL
+from drive_utils import download_latest_db_from_drive, perform_backup, transfer_stats
+from utils import (log_info, log_error, read_lock, write_lock, backup_lock, lock_stats, get_readonly_connection,
+                   LOG_FILE, LOG_TAIL_MAX_BYTES, tail_log, read_log)
+from db_pool import read_connection, write_connection, get_read_pool, close_pools, pool_stats, set_connection_factory, warm_pools
 import time
-import gzip
-import psutil
+import metrics
+from metrics import HostSampler
 import jwt
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import bcrypt
+from auth_cache import TokenCache, PasswordVerifier
 from db_shared import get_last_hash, set_last_hash, get_last_timestamp, set_last_timestamp
 import platform
 from dotenv import load_dotenv
-from threading import Thread
+from backup_scheduler import BackupScheduler
+from query_cache import ResultCache
+from write_queue import WriteQueue, StatementError, BatchRolledBack, no_transaction_control
+from profiler import QueryProfiler
+from startup import run_once_per_server
+from health import HealthChecker
+from replica import REPLICA_MODE, ReplicaSyncer
+import change_log
+import bulk
+import sql_classify
+from change_log import CHANGE_LOG_ENABLED
+from tenants import MULTI_TENANT, TenantRegistry, UnknownTenant
+from checkpointer import CheckpointManager
+from tuning import PROFILE
 load_dotenv()
 
 app = Flask(__name__)
 REQUIRED_TABLES = ['jwt_login']  # Set to a list of required tables if needed
 SCHEMA_SQL = None  # Optionally provide SQL schema for new DB
-tmp_PATH = os.path.join(os.path.dirname(__file__), 'temp') if platform.system() == 'Windows' else '/tmp/Drive_temp'
+tmp_PATH = os.getenv('RUNTIME_DIR') or (os.path.join(os.path.dirname(__file__), 'temp') if platform.system() == 'Windows' else '/tmp/Drive_temp')
 DB_PATH = os.path.join(tmp_PATH,'db_1.sqlite') 
 os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-# Compression helper
-def compress_file(src, dst):
-    with open(src, 'rb') as f_in, gzip.open(dst, 'wb') as f_out:
-        f_out.writelines(f_in)
-
+# A read replica only ever reads its copy; refreshes swap the whole file.
+replica_syncer = ReplicaSyncer(DB_PATH) if REPLICA_MODE else None
+if REPLICA_MODE:
+    set_connection_factory('read', get_readonly_connection)
 # Initialization logic
 def initialize_db():
     if not db_exists(DB_PATH):
@@ -63,6 +84,10 @@ def generate_jwt(payload):
     payload['exp'] = datetime.utcnow() + timedelta(seconds=JWT_EXP_DELTA_SECONDS)
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
+# Verified tokens are remembered until they expire; bcrypt runs on a bounded worker pool.
+token_cache = TokenCache()
+password_verifier = PasswordVerifier()
+
 def decode_jwt(token):
     try:
         return jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
@@ -71,6 +96,22 @@ def decode_jwt(token):
     except jwt.InvalidTokenError:
         return None
 
+# Tenant databases, each with its own users; the pools of the least recently used are closed.
+tenant_registry = TenantRegistry(required_tables=REQUIRED_TABLES)
+
+def open_tenant(name):
+    """(tenant, None), or (None, error response) when name cannot be served here."""
+    if not MULTI_TENANT:
+        return None, (jsonify({'error': 'Tenant databases are not enabled (MULTI_TENANT=1)'}), 400)
+    if REPLICA_MODE:
+        return None, (jsonify({'error': 'A read replica only serves the default database'}), 403)
+    try:
+        return tenant_registry.get(name), None
+    except ValueError as e:
+        return None, (jsonify({'error': str(e)}), 400)
+    except UnknownTenant:
+        return None, (jsonify({'error': f'Unknown tenant {name}'}), 404)
+
 # JWT login route
 @app.route('/login', methods=['POST'])
 def login():
@@ -79,17 +120,26 @@ def login():
     password = data.get('password')
     if not username or not password:
         return jsonify({'error': 'Missing username or password'}), 400
+    tenant_name = data.get('tenant') or request.headers.get('X-Tenant')
+    db_path, tenant = DB_PATH, None
+    if tenant_name:
+        tenant, error = open_tenant(tenant_name)
+        if error:
+            return error
+        db_path = tenant.db_path
     try:
-        with file_lock():
-            conn = get_sqlite_connection(DB_PATH)
+        # Tenant writers hold their own lock; WAL lets this read run alongside them.
+        with (read_lock() if tenant is None else nullcontext()), read_connection(db_path) as conn:
             cur = conn.execute('SELECT password FROM jwt_login WHERE username=?', (username,))
             row = cur.fetchone()
-            if row:
-                stored_hash = row[0]
-                if bcrypt.checkpw(password.encode('utf-8'), stored_hash.encode('utf-8')):
-                    token = generate_jwt({'username': username})
-                    return jsonify({'token': token})
-            return jsonify({'error': 'Invalid credentials'}), 401
+        # bcrypt is slow by design, so it runs after the lock and connection are released.
+        if row and password_verifier.verify(username, password, row[0]):
+            claims = {'username': username}
+            if tenant:
+                claims['tenant'] = tenant.name
+            token = generate_jwt(claims)
+            return jsonify({'token': token})
+        return jsonify({'error': 'Invalid credentials'}), 401
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -102,98 +152,618 @@ def require_jwt(func):
         if not auth or not auth.startswith('Bearer '):
             return jsonify({'error': 'Missing or invalid JWT'}), 401
         token = auth.split(' ', 1)[1]
-        payload = decode_jwt(token)
-        if not payload:
-            return jsonify({'error': 'Invalid or expired JWT'}), 401
+        payload = token_cache.get(token)
+        if payload is None:
+            payload = decode_jwt(token)
+            if not payload:
+                return jsonify({'error': 'Invalid or expired JWT'}), 401
+            token_cache.put(token, payload)
         request.jwt_payload = payload
         return func(*args, **kwargs)
     return wrapper
 
+def require_operator(func):
+    """Under require_jwt: endpoints for the default database and the server, not for tenant tokens."""
+    from functools import wraps
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if request.jwt_payload.get('tenant'):
+            return jsonify({'error': 'Not available to tenant tokens'}), 403
+        return func(*args, **kwargs)
+    return wrapper
+
+def request_tenant():
+    """(tenant, error response) for this request; (None, None) means the default database.
+
+    A tenant token is bound to its tenant. Operator tokens (no tenant claim) pick one with X-Tenant.
+    """
+    claimed = request.jwt_payload.get('tenant')
+    header = request.headers.get('X-Tenant')
+    if claimed and header and header != claimed:
+        return None, (jsonify({'error': 'Token is not valid for this tenant'}), 403)
+    name = claimed or header
+    if not name:
+        return None, None
+    return open_tenant(name)
+
 # API Endpoints
-from threading import Thread
+def run_scheduled_backup(key):
+    # The scheduler keys the default database as None and tenants by name.
+    if key is None:
+        return backup_and_sync_task(DB_PATH)
+    return tenant_registry.backup(key)
 
-# --- In app.py ---
+# Backups with no commit since the last one this process took skip the snapshot and the hash.
+backup_changes = ChangeWatcher()
 
 def backup_and_sync_task(db_path):
-    """A function to run all the slow backup tasks in the background."""
+    """Run all the slow backup tasks. Returns False when the database had not changed."""
     log_info("Background backup task started.")
-    with file_lock(): # Use the same lock to prevent race conditions
+    # One backup at a time per host. Readers never wait on it.
+    with backup_lock():
+        version = backup_changes.version(db_path)
+        if not backup_changes.changed(db_path, version):
+            log_info("No commits since the last backup. Skipping backup.")
+            return False
+        if CHANGE_LOG_ENABLED:
+            # Between bases only the logged changes are shipped, not the whole database.
+            with metrics.timed('drivesync_backup_phase_seconds', phase='ship_changes'):
+                shipped = change_log.ship(db_path)
+            if not change_log.base_due(db_path):
+                with metrics.timed('drivesync_backup_phase_seconds', phase='upload_changes'):
+                    change_log.upload_segments()
+                backup_changes.mark(db_path, version)
+                return bool(shipped)
+            change_log.start_base(db_path)
+        manifest = None
+        snapshot_path = None
+        if BACKUP_MODE == 'incremental':
+            # Chunking reads the file once and yields the whole-file hash as well.
+            # Writers wait while the file is read so the chunks match one state of it.
+            with read_lock(), metrics.timed('drivesync_backup_phase_seconds', phase='chunk'):
+                manifest = store_chunks(db_path)
+                if CHANGE_LOG_ENABLED:
+                    # Recorded with the chunks, so a point-in-time restore knows where this base is.
+                    manifest['change_log'] = change_log.current_state(db_path)
+            new_hash = manifest['sha256']
+        else:
+            # Hash the snapshot rather than the live file, which misses anything still in the WAL.
+            with metrics.timed('drivesync_backup_phase_seconds', phase='snapshot'):
+                snapshot_path = snapshot_db(db_path, PENDING_SNAPSHOT)
+            with metrics.timed('drivesync_backup_phase_seconds', phase='hash'):
+                new_hash = calculate_db_hash(snapshot_path)
+        last_hash = get_last_hash()
+
+        if new_hash == last_hash:
+            log_info("No database changes detected. Skipping backup.")
+            if snapshot_path:
+                os.remove(snapshot_path)
+            backup_changes.mark(db_path, version)
+            return False
+        log_info("Database has changed, proceeding with backup and sync.")
+        taken = time.time()
         try:
-            # Hash the database file
-            new_hash = calculate_db_hash(db_path)
-            last_hash = get_last_hash()
-
-            if new_hash != last_hash:
-                log_info("Database has changed, proceeding with backup and sync.")
-                set_last_hash(new_hash)
-                set_last_timestamp(time.time())
-
-                # Compress and upload
-                # compressed_path = db_path + '.gz'
-                # compress_file(db_path, compressed_path)
-                perform_backup(db_path) # This function handles local and Drive backups
-                # os.remove(compressed_path)
-                
-                log_info("Background backup and sync complete.")
-            else:
-                log_info("No database changes detected. Skipping backup.")
-        except Exception as e:
-            log_error(f"Error in background backup task: {e}")
+            perform_backup(db_path, manifest, snapshot_path, new_hash) # This function handles local and Drive backups
+        except Exception:
+            if CHANGE_LOG_ENABLED:
+                # The local copy is already rotated in, so ask for the base again explicitly.
+                change_log.request_base(db_path)
+            raise
+        # Recorded only once Drive has the copy, so a failed upload is retried rather than skipped.
+        set_last_hash(new_hash)
+        set_last_timestamp(taken)
+        if CHANGE_LOG_ENABLED:
+            with metrics.timed('drivesync_backup_phase_seconds', phase='upload_changes'):
+                change_log.upload_segments()
+        backup_changes.mark(db_path, version)
+        log_info("Background backup and sync complete.")
+        return True
+
+# Writes only mark the database dirty; bursts are coalesced into one backup per process.
+backup_scheduler = BackupScheduler(run_scheduled_backup)
+# Keeps the -wal files of written databases under the tuning profile's limit.
+wal_checkpointer = CheckpointManager()
+
+def is_write_sql(sql, params=(), analyzer=None):
+    # Compiled under an authorizer when possible; comments, WITH and PRAGMA arguments count.
+    return sql_classify.is_write(sql, params, analyzer)
+
+def parse_statements(data):
+    """Turn a /query body into a list of (sql, params, many) tuples.
+
+    Accepts {"sql": "...", "params": [...]} for one statement, where a list of lists (or dicts)
+    as params means executemany, or {"sql": [...]} with a list of SQL strings or
+    {"sql": ..., "params": ...} objects to run in one transaction.
+    """
+    sql = data.get('sql')
+    items = sql if isinstance(sql, list) else [{'sql': sql, 'params': data.get('params')}]
+    if not items:
+        raise ValueError('Missing SQL query')
+    statements = []
+    for item in items:
+        if isinstance(item, str):
+            item = {'sql': item}
+        if not isinstance(item, dict) or not isinstance(item.get('sql'), str) or not item['sql'].strip():
+            raise ValueError('Missing SQL query')
+        params = item.get('params')
+        if params is None:
+            params = ()
+        many = isinstance(params, list) and bool(params) and all(isinstance(p, (list, dict)) for p in params)
+        statements.append((item['sql'], params, many))
+    return statements
+
+def run_statement(conn, sql, params=(), many=False):
+    cur = conn.executemany(sql, params) if many else conn.execute(sql, params)
+    result = {'rowcount': cur.rowcount}
+    if cur.description is not None:
+        result['rows'] = cur.fetchall()
+    return result
+
+# Repeated reads are served from memory until a write touches one of the tables they read.
+result_cache = ResultCache(DB_PATH)
+
+def executed_params(params, many):
+    # A representative parameter set, enough to compile the statement.
+    return params[0] if many else params
+
+# Off unless QUERY_PROFILE is set; see /profile/queries.
+profiler = QueryProfiler()
+
+# Rows fetched from SQLite per step when streaming, and the largest page a client may ask for.
+STREAM_FETCH_SIZE = 500
+MAX_PAGE_SIZE = 10000
+
+def _query_fingerprint(sql, params):
+    return hashlib.sha256(json.dumps([sql, params], sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+
+def encode_cursor(sql, params, offset):
+    token = json.dumps({'o': offset, 'q': _query_fingerprint(sql, params)})
+    return base64.urlsafe_b64encode(token.encode('utf-8')).decode('ascii')
+
+def decode_cursor(token, sql, params):
+    """Offset a continuation token points at; it is only valid for the query that issued it."""
+    try:
+        state = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+        offset = int(state['o'])
+    except (ValueError, KeyError, TypeError):
+        raise ValueError('Invalid cursor')
+    if state.get('q') != _query_fingerprint(sql, params) or offset < 0:
+        raise ValueError('Cursor does not belong to this query')
+    return offset
+
+def paginate_sql(sql, limit, offset):
+    # Fetch one extra row to know whether another page exists. Both values are validated ints.
+    # The newline keeps the closing parenthesis out of a trailing -- comment.
+    return f"SELECT * FROM ({sql.strip().rstrip(';')}\n) LIMIT {limit + 1} OFFSET {offset}"
+
+def apply_writes(conn, statements, submitted=None, log_changes=CHANGE_LOG_ENABLED, cached=True):
+    """Write job run by the writer thread: returns (results, tables written, whether anything changed).
+
+    cached=False is for databases the result cache does not follow (tenants); tables is then None.
+    """
+    tables = None
+    if cached:
+        tables = result_cache.tables_written([(sql, executed_params(params, many)) for sql, params, many in statements])
+    # total_changes only counts rows, so anything else (DDL, PRAGMA, VACUUM) is taken as a change.
+    rows_only = sql_classify.only_changes_rows(sql for sql, _, _ in statements)
+    changes = conn.total_changes
+    results = []
+    # Time spent queued and waiting for the write lock, charged to the job's first statement.
+    lock_wait = time.perf_counter() - submitted if submitted is not None else 0.0
+    try:
+        for sql, params, many in statements:
+            start = time.perf_counter()
+            results.append(run_statement(conn, sql, params, many))
+            if profiler.enabled:
+                profiler.record(conn, sql, executed_params(params, many), time.perf_counter() - start,
+                                results[-1]['rowcount'], lock_wait, kind='write')
+                lock_wait = 0.0
+    except Exception as e:
+        raise StatementError(str(e), len(results)) from e
+    changed = not rows_only or conn.total_changes != changes
+    if log_changes and changed:
+        change_log.record(conn, statements)
+    return results, tables, changed
+
+def apply_alone(statements):
+    """Run a statement that cannot join the writer's batch (see sql_classify.runs_alone) by
+    itself, outside any transaction, between batches.
+
+    It is not in the change log: it changes settings or the connection rather than rows, and
+    the backup it triggers carries the result.
+    """
+    submitted = time.perf_counter()
+    with write_lock(), write_connection(DB_PATH) as conn:
+        result_cache.before_write()
+        results, _, changed = apply_writes(conn, statements, submitted, log_changes=False)
+        after_writes_commit([(results, None, changed)])
+    return results
+
+def apply_tenant_writes(tenant, statements, alone=False):
+    """Tenant writes run in the request under the tenant's own lock, one transaction per request
+    (none for a statement that runs alone)."""
+    submitted = time.perf_counter()
+    with tenant.write_lock(), write_connection(tenant.db_path) as conn:
+        if alone:
+            results, _, changed = apply_writes(conn, statements, submitted, log_changes=False, cached=False)
+        else:
+            conn.execute('BEGIN')
+            try:
+                with no_transaction_control(conn):
+                    results, _, changed = apply_writes(conn, statements, submitted, log_changes=False,
+                                                       cached=False)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+    if changed:
+        backup_scheduler.mark_dirty(tenant.name)
+        wal_checkpointer.note_write(tenant.db_path)
+    return results
+
+def after_writes_commit(job_results):
+    # Jobs that changed nothing (e.g. an UPDATE matching no rows) neither invalidate nor back up.
+    changed = [written for _, written, job_changed in job_results if job_changed]
+    if not changed:
+        return
+    tables = set()
+    for written in changed:
+        if written is None:
+            tables = None
+            break
+        tables |= written
+    result_cache.invalidate(tables)
+    backup_scheduler.mark_dirty()
+    wal_checkpointer.note_write(DB_PATH)
+
+write_queue = WriteQueue(DB_PATH, after_commit=after_writes_commit, before_batch=result_cache.before_write)
+
+def stream_query(sql, params, fmt, with_columns, db_path=DB_PATH):
+    """Stream a read as NDJSON (one row per line) or as one JSON document, fetchmany at a time."""
+    pool = get_read_pool(db_path)
+    checkout = time.perf_counter()
+    conn = pool.acquire()
+    start = time.perf_counter()
+    try:
+        # Execute before the response starts so SQL errors still get a proper status code.
+        cur = conn.execute(sql, params)
+    except Exception:
+        pool.release(conn)
+        raise
+    columns = [d[0] for d in cur.description] if cur.description else []
+
+    def generate():
+        # Time in SQLite only, not the time the client takes to read what was sent.
+        busy = time.perf_counter() - start
+        count = 0
+        try:
+            if fmt == 'json':
+                yield '{' + (f'"columns": {json.dumps(columns)}, ' if with_columns else '') + '"result": ['
+            elif with_columns:
+                yield json.dumps({'columns': columns}) + '\n'
+            first = True
+            while True:
+                fetch_start = time.perf_counter()
+                rows = cur.fetchmany(STREAM_FETCH_SIZE)
+                busy += time.perf_counter() - fetch_start
+                if not rows:
+                    break
+                count += len(rows)
+                if fmt == 'json':
+                    yield ('' if first else ',') + ','.join(json.dumps(row) for row in rows)
+                else:
+                    yield ''.join(json.dumps(row) + '\n' for row in rows)
+                first = False
+            if fmt == 'json':
+                yield ']}'
+            if profiler.enabled:
+                profiler.record(conn, sql, params, busy, count, start - checkout)
+        finally:
+            pool.release(conn)
+
+    mimetype = 'application/json' if fmt == 'json' else 'application/x-ndjson'
+    return Response(generate(), mimetype=mimetype)
 
 @app.route('/query', methods=['POST'])
 @require_jwt
 def query():
+    """Run one statement, or a list of them, on the database.
+
+    A read with "limit" returns one page and a "next_cursor" to send back for the next. The
+    cursor is an OFFSET: each page still steps over every row before it, and rows written
+    between pages can shift it, so a row may be skipped or returned twice. Order by a unique
+    key and filter on it (WHERE id > last seen) to page through large or changing tables.
+    """
     data = request.get_json()
-    sql = data.get('sql')
-    if not sql:
-        return jsonify({'error': 'Missing SQL query'}), 400
-    
-    is_write = sql.strip().split()[0].lower() in {'insert', 'update', 'delete', 'replace', 'create', 'drop', 'alter'}
-    
-    conn = None # Define conn outside try block
+    try:
+        statements = parse_statements(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    is_batch = isinstance(data.get('sql'), list)
+    tenant, error = request_tenant()
+    if error:
+        return error
+    if any(sql_classify.controls_transaction(sql) for sql, _, _ in statements):
+        return jsonify({'error': 'BEGIN, COMMIT, ROLLBACK, SAVEPOINT and RELEASE are not allowed; '
+                                 'send a list of statements to run them in one transaction'}), 400
+    alone = any(sql_classify.runs_alone(sql) for sql, _, _ in statements)
+    if alone and len(statements) > 1:
+        return jsonify({'error': 'VACUUM, ATTACH, DETACH, CREATE TEMP and PRAGMA assignments must be sent on their own'}), 400
+    analyzer = tenant.analyzer if tenant else result_cache.analyzer
+    is_write = any(is_write_sql(sql, executed_params(params, many), analyzer) for sql, params, many in statements)
+
+    if is_write and REPLICA_MODE:
+        return jsonify({'error': 'This node is a read-only replica'}), 403
+    db_path = tenant.db_path if tenant else DB_PATH
+    # The result cache and its invalidation only follow the default database.
+    cache = result_cache if tenant is None else None
+
     try:
         if is_write:
-            with file_lock():
-                conn = get_sqlite_connection(DB_PATH)
-                conn.execute('BEGIN')
+            # The request is one job on the writer; it commits together with other queued writes.
+            try:
+                submitted = time.perf_counter()
+                with metrics.timed('drivesync_query_seconds', kind='write'):
+                    if tenant:
+                        results = apply_tenant_writes(tenant, statements, alone)
+                    elif alone:
+                        results = apply_alone(statements)
+                    else:
+                        results, _, _ = write_queue.submit(lambda conn: apply_writes(conn, statements, submitted))
+            except StatementError as e:
+                log_error(f"Write failed: {e}")
+                error = {'error': str(e)}
+                if is_batch:
+                    error['statement'] = e.index
+                return jsonify(error), 400
+            except BatchRolledBack as e:
+                log_error(f"Write rolled back: {e}")
+                return jsonify({'error': f"{e}; nothing was written, send the request again"}), 503
+            response = {'status': 'success, write operation accepted'}
+            if is_batch:
+                response['results'] = results
+            else:
+                response['rowcount'] = results[0]['rowcount']
+            return jsonify(response)
+        elif is_batch:
+            checkout = time.perf_counter()
+            with metrics.timed('drivesync_query_seconds', kind='read'), read_connection(db_path) as conn:
+                lock_wait = time.perf_counter() - checkout
+                results = []
+                for sql, params, many in statements:
+                    start = time.perf_counter()
+                    results.append(run_statement(conn, sql, params, many).get('rows', []))
+                    if profiler.enabled:
+                        profiler.record(conn, sql, executed_params(params, many), time.perf_counter() - start,
+                                        len(results[-1]), lock_wait)
+                        lock_wait = 0.0
+            return jsonify({'results': results})
+        else:
+            sql, params, _ = statements[0]
+            with_columns = bool(data.get('columns'))
+            if data.get('stream'):
+                fmt = data.get('format', 'ndjson')
+                if fmt not in ('ndjson', 'json'):
+                    return jsonify({'error': "format must be 'ndjson' or 'json'"}), 400
+                return stream_query(sql, params, fmt, with_columns, db_path)
+            limit = data.get('limit')
+            offset = 0
+            if limit is not None:
+                if not isinstance(limit, int) or isinstance(limit, bool) or not 0 < limit <= MAX_PAGE_SIZE:
+                    return jsonify({'error': f'limit must be an integer between 1 and {MAX_PAGE_SIZE}'}), 400
                 try:
-                    conn.execute(sql)
-                    conn.commit()
-                    
-                    # Instead of running tasks here, start a background thread
-                    thread = Thread(target=backup_and_sync_task, args=(DB_PATH,))
-                    thread.start()
-                    
-                    return jsonify({'status': 'success, write operation accepted'})
-                except Exception as e:
-                    if conn:
-                        conn.rollback()
-                    log_error(f"Write failed: {e}")
+                    offset = decode_cursor(data['cursor'], sql, params) if data.get('cursor') else 0
+                except ValueError as e:
                     return jsonify({'error': str(e)}), 400
-        else:
-            # Read-only queries remain the same
-            conn = get_sqlite_connection(DB_PATH)
-            cur = conn.execute(sql)
-            rows = cur.fetchall()
-            return jsonify({'result': rows})
+                sql_to_run = paginate_sql(sql, limit, offset)
+            else:
+                sql_to_run = sql
+            cached = cache.get(sql_to_run, params) if cache else None
+            if cached:
+                rows, columns = cached
+            else:
+                generation = cache.generation() if cache else None
+                checkout = time.perf_counter()
+                with metrics.timed('drivesync_query_seconds', kind='read'), read_connection(db_path) as conn:
+                    start = time.perf_counter()
+                    cur = conn.execute(sql_to_run, params)
+                    rows = cur.fetchall()
+                    columns = [d[0] for d in cur.description] if cur.description else []
+                    if profiler.enabled:
+                        profiler.record(conn, sql_to_run, params, time.perf_counter() - start, len(rows), start - checkout)
+                if cache:
+                    cache.put(sql_to_run, params, rows, columns, generation)
+            response = {}
+            if limit is not None:
+                has_more = len(rows) > limit
+                rows = rows[:limit]
+                response['next_cursor'] = encode_cursor(sql, params, offset + limit) if has_more else None
+            response['result'] = rows
+            if with_columns:
+                response['columns'] = columns
+            return jsonify(response)
     except Exception as e:
         log_error(f"Query error: {e}")
         return jsonify({'error': str(e)}), 500
-    finally:
-        if conn:
-            conn.close()
+
+@app.route('/tables/<table>/import', methods=['POST'])
+@require_jwt
+def import_table(table):
+    """Load CSV or NDJSON rows from the request body into table, all in one transaction.
+
+    The body is parsed as it arrives into a staging file, with no lock held. The rows are then
+    inserted IMPORT_BATCH_SIZE per executemany under the write lock, so a slow upload does not
+    hold up other writers. ?fast=1 relaxes the pragmas for the load.
+    """
+    if REPLICA_MODE:
+        return jsonify({'error': 'This node is a read-only replica'}), 403
+    tenant, error = request_tenant()
+    if error:
+        return error
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in bulk.FORMATS:
+        return jsonify({'error': f"format must be one of {', '.join(bulk.FORMATS)}"}), 400
+    on_conflict = request.args.get('on_conflict', 'abort')
+    if on_conflict not in bulk.ON_CONFLICT:
+        return jsonify({'error': f"on_conflict must be one of {', '.join(bulk.ON_CONFLICT)}"}), 400
+    columns = request.args.get('columns')
+    columns = [c.strip() for c in columns.split(',')] if columns else None
+    fast = request.args.get('fast', '').lower() in ('1', 'true', 'yes')
+    db_path = tenant.db_path if tenant else DB_PATH
+    parse = bulk.csv_rows if fmt == 'csv' else bulk.ndjson_rows
+    start = time.perf_counter()
+    loaded = batches = 0
+    changed = False
+    try:
+        with read_connection(db_path) as conn:
+            known = bulk.table_columns(conn, table)
+        if known is None:
+            return jsonify({'error': f'No such table: {table}'}), 404
+        columns, rows = parse(request.stream, known, columns)
+        sql = bulk.insert_sql(table, columns, on_conflict)
+        # Placeholder values, only so the INSERT compiles.
+        tables = result_cache.tables_written([(sql, (None,) * len(columns))]) if tenant is None else None
+        # The whole body is read before the write lock is taken.
+        with bulk.staged_rows(rows, len(columns), tmp_PATH) as staged:
+            with (tenant.write_lock() if tenant else write_lock()), write_connection(db_path) as conn:
+                if tenant is None:
+                    result_cache.before_write()
+                changes = conn.total_changes
+                with bulk.fast_load(conn, fast):
+                    conn.execute('BEGIN')
+                    try:
+                        for batch in staged.batches():
+                            conn.executemany(sql, batch)
+                            if CHANGE_LOG_ENABLED and tenant is None:
+                                change_log.record(conn, [(sql, batch, True)])
+                            loaded += len(batch)
+                            batches += 1
+                        conn.commit()
+                    except Exception:
+                        conn.rollback()
+                        raise
+                # on_conflict=ignore may insert nothing.
+                changed = conn.total_changes != changes
+                if tenant is None and changed:
+                    result_cache.invalidate(tables)
+    except bulk.BulkImportError as e:
+        return jsonify({'error': str(e), 'line': e.line}), 400
+    except sqlite3.Error as e:
+        log_error(f"Import into {table} failed: {e}")
+        return jsonify({'error': str(e), 'batch': batches}), 400
+    except Exception as e:
+        log_error(f"Import into {table} failed: {e}")
+        return jsonify({'error': str(e)}), 500
+    # One backup for the whole load.
+    if changed:
+        backup_scheduler.mark_dirty(tenant.name if tenant else None)
+        wal_checkpointer.note_write(db_path)
+    seconds = time.perf_counter() - start
+    log_info(f"Imported {loaded} rows into {table} in {seconds:.2f}s ({batches} batches, fast={fast}).")
+    return jsonify({
+        'status': 'imported',
+        'table': table,
+        'rows': loaded,
+        'batches': batches,
+        'seconds': round(seconds, 3),
+        'rows_per_sec': round(loaded / seconds, 1) if seconds else None,
+    })
+
+@app.route('/tables/<table>/export', methods=['GET'])
+@require_jwt
+def export_table(table):
+    """Stream every row of a table or view as CSV or NDJSON, fetchmany at a time."""
+    tenant, error = request_tenant()
+    if error:
+        return error
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in bulk.FORMATS:
+        return jsonify({'error': f"format must be one of {', '.join(bulk.FORMATS)}"}), 400
+    pool = get_read_pool(tenant.db_path if tenant else DB_PATH)
+    conn = pool.acquire()
+    try:
+        if bulk.table_columns(conn, table, views=True) is None:
+            pool.release(conn)
+            return jsonify({'error': f'No such table: {table}'}), 404
+        # One statement reads one snapshot under WAL, however long the client takes.
+        cur = conn.execute(f'SELECT * FROM {bulk.quote_identifier(table)}')
+    except Exception as e:
+        pool.release(conn)
+        log_error(f"Export of {table} failed: {e}")
+        return jsonify({'error': str(e)}), 500
+
+    def generate():
+        try:
+            yield from bulk.export_chunks(cur, fmt)
+        finally:
+            pool.release(conn)
+
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    response = Response(generate(), mimetype=mimetype)
+    response.headers.set('Content-Disposition', 'attachment', filename=f'{table}.{fmt}')
+    return response
+
+@app.route('/profile/queries', methods=['GET', 'DELETE'])
+@require_jwt
+@require_operator
+def profile_queries():
+    """Statements by total time with their plans and index suggestions, and the recent slow ones."""
+    if request.method == 'DELETE':
+        profiler.reset()
+        return jsonify({'status': 'profile cleared'})
+    try:
+        limit = int(request.args.get('limit', 20))
+        statements = profiler.top(limit, request.args.get('order', 'total'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    suggested = []
+    for statement in statements:
+        suggested += [s for s in statement['suggested_indexes'] if s not in suggested]
+    return jsonify({
+        'enabled': profiler.enabled,
+        'slow_ms': profiler.slow_seconds * 1000,
+        'statements': statements,
+        'suggested_indexes': suggested,
+        'slow': profiler.slow(limit),
+    })
+
+# Probes read results kept up to date in the background instead of opening the database.
+health_checker = HealthChecker(DB_PATH, REQUIRED_TABLES)
+
+def health_response(result, error_status=503):
+    result['latency_ms'] = round((time.perf_counter() - g.request_start) * 1000, 3)
+    return jsonify(result), (error_status if result['status'] == 'error' else 200)
 
 @app.route('/health', methods=['GET'])
 def health():
-    if db_exists(DB_PATH) and validate_sqlite_db(DB_PATH, REQUIRED_TABLES):
-        return jsonify({'status': 'ok'})
-    return jsonify({'status': 'error'}), 500
+    return health_response(health_checker.ready(), 500)
+
+@app.route('/health/live', methods=['GET'])
+def health_live():
+    return health_response(health_checker.live())
+
+@app.route('/health/ready', methods=['GET'])
+def health_ready():
+    return health_response(health_checker.ready())
+
+@app.route('/health/deep', methods=['GET'])
+def health_deep():
+    return health_response(health_checker.deep())
 
 @app.route('/backup', methods=['POST'])
 @require_jwt
 def backup():
+    if REPLICA_MODE:
+        return jsonify({'error': 'This node is a read-only replica'}), 403
+    tenant, error = request_tenant()
+    if error:
+        return error
     try:
-        perform_backup(DB_PATH)
+        if tenant:
+            backed_up = tenant_registry.backup(tenant.name)
+            return jsonify({'status': 'backup complete' if backed_up else 'no changes since the last backup'})
+        with backup_lock():
+            perform_backup(DB_PATH)
         return jsonify({'status': 'backup complete'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -201,20 +771,72 @@ def backup():
 # Restore endpoint
 @app.route('/restore', methods=['POST'])
 @require_jwt
+@require_operator
 def restore():
+    if REPLICA_MODE:
+        return jsonify({'error': 'This node is a read-only replica'}), 403
+    data = request.get_json(silent=True) or {}
+    if data.get('timestamp') is not None:
+        return restore_to_time(data['timestamp'])
     try:
-        if restore_from_backup(DB_PATH):
+        with backup_lock(), write_lock():
+            # Pooled connections still point at the old file, drop them before swapping it out.
+            close_pools(DB_PATH)
+            restored = restore_from_backup(DB_PATH)
+            if restored and CHANGE_LOG_ENABLED:
+                with write_connection(DB_PATH) as conn:
+                    change_log.check_timeline(conn)
+            result_cache.invalidate(None)
+        if restored:
             set_last_hash(calculate_db_hash(DB_PATH))
             set_last_timestamp(time.time())
+            # A restore that moved to a new timeline needs a base for it.
+            backup_scheduler.mark_dirty()
             return jsonify({'status': 'restored from backup'})
         else:
             return jsonify({'error': 'No backup available'}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def parse_timestamp(value):
+    """Unix seconds, or an ISO 8601 string (UTC unless it has an offset)."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if isinstance(value, str):
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed.timestamp()
+    raise ValueError('timestamp must be unix seconds or an ISO 8601 string')
+
+def restore_to_time(value):
+    if not CHANGE_LOG_ENABLED:
+        return jsonify({'error': 'Point-in-time restore needs the change log (CHANGE_LOG=1)'}), 400
+    try:
+        target = parse_timestamp(value)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    staging = DB_PATH + '.pitr'
+    try:
+        with backup_lock(), write_lock():
+            result = change_log.restore_to(DB_PATH, target, staging)
+            if result is None:
+                return jsonify({'error': 'No base backup at or before that time'}), 404
+            close_pools(DB_PATH)
+            replace_db_file(staging, DB_PATH)
+            result_cache.invalidate(None)
+        # The restored state is backed up as the first base of its new timeline.
+        backup_scheduler.mark_dirty()
+        return jsonify(dict(result, status='restored to point in time'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 409
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 # Conflict check endpoint
 @app.route('/conflict', methods=['GET'])
 @require_jwt
+@require_operator
 def conflict():
     # For demo: just return last timestamp and hash
     return jsonify({
@@ -222,11 +844,100 @@ def conflict():
         'last_timestamp': get_last_timestamp()
     })
 
+@app.route('/tenants', methods=['GET', 'POST'])
+@require_jwt
+@require_operator
+def tenants():
+    """List the tenants on this host, or create one with its first user."""
+    if not MULTI_TENANT:
+        return jsonify({'error': 'Tenant databases are not enabled (MULTI_TENANT=1)'}), 400
+    if REPLICA_MODE:
+        return jsonify({'error': 'This node is a read-only replica'}), 403
+    if request.method == 'GET':
+        return jsonify({'tenants': tenant_registry.names(), 'open': tenant_registry.stats()})
+    data = request.get_json(silent=True) or {}
+    name, username, password = data.get('tenant'), data.get('username'), data.get('password')
+    if not name or not username or not password:
+        return jsonify({'error': 'Missing tenant, username or password'}), 400
+    password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    try:
+        tenant = tenant_registry.create(name, username, password_hash)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except FileExistsError as e:
+        return jsonify({'error': str(e)}), 409
+    backup_scheduler.mark_dirty(tenant.name)
+    return jsonify({'status': 'tenant created', 'tenant': tenant.name}), 201
+
+# psutil is sampled off the request path; /memstatus and the dashboard read the last sample.
+host_sampler = HostSampler(os.path.dirname(DB_PATH) or '.')
+
+metrics.describe('drivesync_http_request_duration_seconds', 'histogram', 'Time to handle an HTTP request, by route')
+metrics.describe('drivesync_query_seconds', 'histogram', 'Time to run /query statements, reads against the pool and writes through the write queue')
+
+@metrics.register_collector
+def _stats_samples():
+    """The stats the components already keep, as gauges and counters."""
+    samples = []
+
+    def add(name, metric_type, help_text, value, **labels):
+        if value is not None:
+            samples.append((name, metric_type, help_text, labels, value))
+
+    host = host_sampler.latest()
+    add('drivesync_host_cpu_percent', 'gauge', 'Host CPU use at the last sample', host['cpu'])
+    add('drivesync_host_memory_used_percent', 'gauge', 'Host memory use at the last sample', host['mem'].percent)
+    add('drivesync_host_disk_used_percent', 'gauge', 'Disk use of the database volume at the last sample', host['disk'].percent)
+    for db_path, kinds in pool_stats().items():
+        for kind, pool in kinds.items():
+            for state in ('open', 'in_use', 'idle'):
+                add('drivesync_pool_connections', 'gauge', 'Pooled SQLite connections by state', pool[state], db=db_path, kind=kind, state=state)
+            add('drivesync_pool_waits_total', 'counter', 'Checkouts that had to wait for a connection', pool['waits'], db=db_path, kind=kind)
+            add('drivesync_pool_timeouts_total', 'counter', 'Checkouts that gave up waiting', pool['timeouts'], db=db_path, kind=kind)
+    caches = {'query': result_cache.stats(), 'token': token_cache.stats(), 'login': password_verifier.stats()}
+    for cache, stats in caches.items():
+        add('drivesync_cache_hits_total', 'counter', 'Cache lookups that hit', stats['hits'], cache=cache)
+        add('drivesync_cache_misses_total', 'counter', 'Cache lookups that missed', stats['misses'], cache=cache)
+        add('drivesync_cache_entries', 'gauge', 'Entries held by the cache', stats['entries'], cache=cache)
+    add('drivesync_query_cache_bytes', 'gauge', 'Estimated size of the cached query results', caches['query']['bytes'])
+    scheduler = backup_scheduler.stats()
+    for outcome in ('run', 'skipped', 'failed'):
+        add('drivesync_backups_total', 'counter', 'Backups by outcome', scheduler['backups_' + outcome], outcome=outcome)
+    add('drivesync_backup_dirty', 'gauge', 'Whether writes are waiting for a backup', scheduler['dirty'])
+    add('drivesync_backup_dirty_databases', 'gauge', 'Databases with writes waiting for a backup', scheduler['dirty_databases'])
+    add('drivesync_backup_last_seconds', 'gauge', 'Duration of the last backup', scheduler['last_backup_seconds'])
+    checkpoints = wal_checkpointer.stats()
+    for db_path, size in checkpoints['wal_bytes'].items():
+        add('drivesync_wal_bytes', 'gauge', 'Size of the -wal file at the last check', size, db=db_path)
+    for outcome in ('truncations', 'busy'):
+        add('drivesync_wal_checkpoints_total', 'counter', 'Checkpoints run by the checkpoint manager, by whether the -wal file was reset',
+            checkpoints[outcome], outcome='truncated' if outcome == 'truncations' else 'busy')
+    if MULTI_TENANT:
+        open_tenants = tenant_registry.stats()
+        add('drivesync_tenants_open', 'gauge', 'Tenant databases with open connection pools', open_tenants['open'])
+        add('drivesync_tenants_evicted_total', 'counter', 'Tenants whose pools were closed to stay under TENANT_MAX_OPEN', open_tenants['evicted'])
+    writes = write_queue.stats()
+    add('drivesync_write_queue_depth', 'gauge', 'Write requests waiting for the writer', writes['queued'])
+    add('drivesync_write_jobs_total', 'counter', 'Write requests applied, failed or not', writes['jobs'])
+    add('drivesync_write_jobs_failed_total', 'counter', 'Write requests that failed', writes['jobs_failed'])
+    add('drivesync_write_batches_total', 'counter', 'Group commits run by the writer', writes['batches'])
+    ready, deep = health_checker.ready(), health_checker.deep()
+    add('drivesync_health_ready', 'gauge', 'Whether the cached readiness check passed', ready['status'] == 'ok')
+    add('drivesync_health_ready_check_seconds', 'gauge', 'Duration of the last readiness check', ready['check_ms'] / 1000)
+    if 'check_ms' in deep:
+        add('drivesync_health_deep_ok', 'gauge', 'Whether the last integrity check passed', deep['status'] == 'ok')
+        add('drivesync_health_deep_check_seconds', 'gauge', 'Duration of the last integrity check', deep['check_ms'] / 1000)
+        add('drivesync_health_deep_age_seconds', 'gauge', 'Time since the last integrity check', deep['age_seconds'])
+    if replica_syncer:
+        replica = replica_syncer.stats()
+        add('drivesync_replica_lag_seconds', 'gauge', 'How long the newest backup has waited to be applied', replica['lag_seconds'])
+        add('drivesync_replica_seconds_since_poll', 'gauge', 'Time since Drive was last polled successfully', replica['seconds_since_poll'])
+    return samples
+
 @app.route('/memstatus', methods=['GET'])
 def memstatus():
-    mem = psutil.virtual_memory()
-    cpu = psutil.cpu_percent(interval=0.5)
-    disk = psutil.disk_usage(os.path.dirname(DB_PATH) or '.')
+    host = host_sampler.latest()
+    mem, cpu, disk = host['mem'], host['cpu'], host['disk']
     return jsonify({
         'ram': {
             'total': mem.total,
@@ -236,37 +947,39 @@ def memstatus():
             'free': mem.free
         },
         'cpu': {
-            'percent': cpu
+            'percent': cpu,
+            'sampled_at': host['sampled_at']
         },
         'disk': {
             'total': disk.total,
             'used': disk.used,
             'free': disk.free,
             'percent': disk.percent
-        }
+        },
+        'db_pool': pool_stats(),
+        'locks': lock_stats(),
+        'backup_scheduler': backup_scheduler.stats(),
+        'write_queue': write_queue.stats(),
+        'sqlite': {'profile': PROFILE, 'wal_checkpoints': wal_checkpointer.stats()},
+        'tenants': tenant_registry.stats() if MULTI_TENANT else None,
+        'replica': replica_syncer.stats() if replica_syncer else None,
+        'change_log': change_log.current_state(DB_PATH) if CHANGE_LOG_ENABLED else None,
+        'drive': transfer_stats(),
+        'query_cache': result_cache.stats(),
+        'auth': {'tokens': token_cache.stats(), 'logins': password_verifier.stats()}
     })
 
 # Ensure at least one default user exists for JWT login
 def ensure_jwt_login_table():
-    with file_lock():
-        conn = get_sqlite_connection(DB_PATH)
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS jwt_login (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT NOT NULL UNIQUE,
-                password TEXT NOT NULL,
-                created_at TEXT DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+    with write_lock(), write_connection(DB_PATH) as conn:
+        conn.execute(JWT_LOGIN_DDL)
         conn.commit()
-        conn.close()
     return "table created"
 
 def ensure_default_user():
     default_username = os.getenv('JWT_ADMIN_USERNAME')
     default_password = os.getenv('JWT_ADMIN_PASSWORD')
-    with file_lock():
-        conn = get_sqlite_connection(DB_PATH)
+    with write_lock(), write_connection(DB_PATH) as conn:
         cur = conn.execute("SELECT * FROM jwt_login WHERE username=?", (default_username,))
         if not cur.fetchone():
             hashed_pw = bcrypt.hashpw(default_password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
@@ -275,14 +988,19 @@ def ensure_default_user():
                 (default_username, hashed_pw)
             )
             conn.commit()
-            conn.close()
             log_info(f"Default user created: {default_username}")
             return "Default created"
         else:
             log_info(f"Default user already exists: {default_username}")
-            conn.close()
             return "default already exist"
 
+def ensure_change_log():
+    with write_lock(), write_connection(DB_PATH) as conn:
+        change_log.ensure_tables(conn)
+        conn.commit()
+        # A database fetched from a backup may be behind changes already in the log.
+        change_log.check_timeline(conn)
+
 # Dashboard route (was blueprint, now direct route)
 @app.route("/")
 def dashboard():
@@ -293,12 +1011,11 @@ def dashboard():
     db_hash = get_last_hash() or "N/A"
     db_last_ts = get_last_timestamp() or "N/A"
     user_count = 0
-    with file_lock():
+    with read_lock():
         try:
-            conn = get_sqlite_connection(DB_PATH)
-            cur = conn.execute("SELECT COUNT(*) FROM jwt_login")
-            user_count = cur.fetchone()[0]
-            conn.close()
+            with read_connection(DB_PATH) as conn:
+                cur = conn.execute("SELECT COUNT(*) FROM jwt_login")
+                user_count = cur.fetchone()[0]
         except Exception:
             user_count = "N/A"
     backup_dir = os.path.join(os.path.dirname(db_file), "backups")
@@ -312,9 +1029,7 @@ def dashboard():
                     'size': round(os.path.getsize(path) / (1024 * 1024),2),
                     'mtime': time.ctime(os.path.getmtime(path))
                 })
-    mem = psutil.virtual_memory()
-    cpu = psutil.cpu_percent(interval=0.2)
-    disk = psutil.disk_usage(os.path.dirname(db_file) or '.')
+    host = host_sampler.latest()
     return render_template(
         "dashboard.html",
         db_file=db_file,
@@ -325,32 +1040,106 @@ def dashboard():
         db_last_ts=db_last_ts,
         user_count=user_count,
         backups=backups,
-        mem=mem,
-        cpu=cpu,
-        disk=disk
+        mem=host['mem'],
+        cpu=host['cpu'],
+        disk=host['disk']
     )
 
+# Lines /logs returns by default.
+LOG_TAIL_LINES = 200
+
 @app.route('/logs', methods=['GET'])
 def get_logs():
-    log_path = os.path.join(os.path.dirname(DB_PATH), 'app.log')
+    """The end of app.log, read backwards from the end of the file.
+
+    ?lines=N (default 200) or ?bytes=N pick how much. ?offset=N&file_id=M returns JSON with
+    what was written since offset, and the next offset and file id to ask with, for tailing;
+    ?format=json returns the tail as JSON with the offset and file id to continue from.
+    """
+    log_path = LOG_FILE
     if not os.path.exists(log_path):
         return jsonify({'error': 'Log file not found'}), 404
-    with open(log_path, 'r', encoding='utf-8', errors='ignore') as f:
-        content = f.read()
-    # Optionally, limit the log size returned
-    max_chars = 10000
-    if len(content) > max_chars:
-        content = content[-max_chars:]
-    return ('<pre>' + content + '</pre>')
+    try:
+        lines = int(request.args.get('lines', LOG_TAIL_LINES))
+        max_bytes = min(int(request.args.get('bytes', LOG_TAIL_MAX_BYTES)), LOG_TAIL_MAX_BYTES)
+        offset = int(request.args['offset']) if 'offset' in request.args else None
+        file_id = int(request.args['file_id']) if 'file_id' in request.args else None
+    except ValueError:
+        return jsonify({'error': 'lines, bytes, offset and file_id must be integers'}), 400
+    if lines < 0 or max_bytes < 0 or (offset is not None and offset < 0):
+        return jsonify({'error': 'lines, bytes and offset must not be negative'}), 400
+    if offset is not None:
+        content, next_offset, rotated, file_id = read_log(log_path, offset, max_bytes, file_id)
+        return jsonify({'content': content, 'next_offset': next_offset, 'file_id': file_id, 'rotated': rotated})
+    content, start, size, file_id = tail_log(log_path, None if 'bytes' in request.args else lines, max_bytes)
+    if request.args.get('format') == 'json':
+        return jsonify({'content': content, 'offset': start, 'next_offset': size, 'file_id': file_id})
+    return ('<pre>' + html.escape(content) + '</pre>')
 
 @app.route("/ping")
 def ping():
     return "Database is live"
 
-def startup_tasks():
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_duration(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        # The route pattern, not the path, so label values stay bounded.
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe('drivesync_http_request_duration_seconds', time.perf_counter() - start,
+                        route=route, method=request.method, status=response.status_code)
+    return response
+
+@app.before_request
+def start_replica_sync():
+    if replica_syncer:
+        replica_syncer.ensure_thread()
+
+def initialize_server():
+    """Everything the database needs before serving. Runs in one worker per server."""
     initialize_db()
     ensure_jwt_login_table()
     ensure_default_user()
+    if CHANGE_LOG_ENABLED:
+        ensure_change_log()
+
+def warm_up(kinds=('read', 'write')):
+    # Done in every worker, so its first requests do not pay for opening connections.
+    try:
+        opened = warm_pools(DB_PATH, kinds)
+        log_info(f"Warmed {opened} pooled connections.")
+    except Exception as e:
+        log_error(f"Connection pool warm-up failed: {e}")
+
+def startup_tasks():
+    if REPLICA_MODE:
+        # Users and schema come from the primary's backups; a replica never creates either.
+        try:
+            replica_syncer.refresh()
+        except Exception as e:
+            log_error(f"Initial replica sync failed: {e}")
+        if db_exists(DB_PATH):
+            warm_up(('read',))
+        else:
+            log_error("Replica has no database yet; reads fail until a backup is published.")
+        return "Replica started"
+    # What initialize_server() depends on; a change to any of it runs it again.
+    settings = {
+        'required_tables': REQUIRED_TABLES,
+        'schema_sql': SCHEMA_SQL,
+        'admin': os.getenv('JWT_ADMIN_USERNAME'),
+        'change_log': CHANGE_LOG_ENABLED,
+    }
+    run_once_per_server(DB_PATH, settings, initialize_server)
+    warm_up()
     return "DB_started"
 
 with app.app_context():
@@ -0,0 +1,186 @@
+"""asyncio (ASGI) serving mode for the same Flask app.
+
+    gunicorn -k uvicorn.workers.UvicornWorker -w 4 asgi:application
+
+Prefer gunicorn's uvicorn worker over `uvicorn --workers`: gunicorn sets TCP_NODELAY on
+the listening socket, without which every response stalls ~40ms on delayed ACKs.
+
+The event loop owns the client connections, so idle keep-alive connections cost no thread.
+Each request runs the Flask app on a bounded thread pool (ASGI_WORKER_THREADS), which is
+where all SQLite and Drive work happens. At most ASGI_MAX_PENDING further requests may wait
+for a thread; beyond that the server answers 503 at once instead of queueing without bound.
+Request bodies reach the app as it reads them, so a bulk import streams rather than being
+held in memory first.
+"""
+import asyncio
+import io
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from app import app, backup_scheduler
+from utils import log_info
+
+ASGI_WORKER_THREADS = int(os.getenv('ASGI_WORKER_THREADS', '16'))
+ASGI_MAX_PENDING = int(os.getenv('ASGI_MAX_PENDING', '256'))
+# Largest request body accepted; 0 for no limit, as under gunicorn's sync workers.
+ASGI_MAX_BODY_BYTES = int(os.getenv('ASGI_MAX_BODY_BYTES', '0'))
+
+class _BodyReader(io.RawIOBase):
+    """wsgi.input that pulls the request body off the ASGI receive channel as the app reads.
+
+    read() runs on an executor thread and waits on the event loop for the next message, so
+    the client is only read from as fast as the app consumes the body.
+    """
+
+    def __init__(self, receive, loop, limit=0):
+        self._receive = receive
+        self._loop = loop
+        self._limit = limit
+        self._chunk = b''
+        self._offset = 0
+        self._size = 0
+        self._done = False
+
+    def readable(self):
+        return True
+
+    def _next_chunk(self):
+        message = asyncio.run_coroutine_threadsafe(self._receive(), self._loop).result()
+        if message['type'] == 'http.disconnect':
+            raise IOError('Client disconnected')
+        self._chunk = message.get('body', b'')
+        self._offset = 0
+        self._size += len(self._chunk)
+        self._done = not message.get('more_body')
+        if self._limit and self._size > self._limit:
+            raise IOError('Request body too large')
+
+    def readinto(self, buffer):
+        while self._offset >= len(self._chunk) and not self._done:
+            self._next_chunk()
+        count = min(len(buffer), len(self._chunk) - self._offset)
+        buffer[:count] = self._chunk[self._offset:self._offset + count]
+        self._offset += count
+        return count
+
+class WSGIBridge:
+    """ASGI application that runs a WSGI app on a bounded executor, with backpressure."""
+
+    def __init__(self, wsgi_app, threads=ASGI_WORKER_THREADS, max_pending=ASGI_MAX_PENDING, max_body=ASGI_MAX_BODY_BYTES):
+        self.wsgi_app = wsgi_app
+        self.threads = threads
+        self.max_pending = max_pending
+        self.max_body = max_body
+        self._executor = None
+        self._slots = None
+        self.rejected = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                # Run any pending backup before the worker goes away.
+                await asyncio.get_running_loop().run_in_executor(None, backup_scheduler.flush)
+                if self._executor is not None:
+                    self._executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def _ensure_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='asgi')
+            self._slots = asyncio.Semaphore(self.threads + self.max_pending)
+
+    async def _simple_response(self, send, status, body):
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]})
+        await send({'type': 'http.response.body', 'body': body})
+
+    def _environ(self, scope, body):
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client')
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': str(server[0]),
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': client[0] if client else '',
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BufferedReader(body, buffer_size=64 * 1024),
+            # Without a Content-Length (chunked uploads) the app reads until the body ends.
+            'wsgi.input_terminated': True,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin-1').lower()
+            value = value.decode('latin-1')
+            if name == 'content-type':
+                environ['CONTENT_TYPE'] = value
+                continue
+            if name == 'content-length':
+                environ['CONTENT_LENGTH'] = value
+                continue
+            key = 'HTTP_' + name.upper().replace('-', '_')
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+
+    def _start(self, environ):
+        """Runs on the executor: call the app and pull the first body chunk."""
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+            return lambda data: None
+
+        body = self.wsgi_app(environ, start_response)
+        iterator = iter(body)
+        first = next(iterator, None)
+        return response, body, iterator, first
+
+    async def _http(self, scope, receive, send):
+        self._ensure_executor()
+        if self._slots.locked():
+            self.rejected += 1
+            await self._simple_response(send, 503, b'{"error": "Server busy, retry later"}')
+            return
+        async with self._slots:
+            length = dict(scope.get('headers', [])).get(b'content-length', b'')
+            if self.max_body and length.isdigit() and int(length) > self.max_body:
+                await self._simple_response(send, 413, b'{"error": "Request body too large"}')
+                return
+            loop = asyncio.get_running_loop()
+            body = _BodyReader(receive, loop, self.max_body)
+            response, wsgi_body, iterator, chunk = await loop.run_in_executor(
+                self._executor, self._start, self._environ(scope, body))
+            try:
+                await send({'type': 'http.response.start', 'status': response['status'], 'headers': response['headers']})
+                if chunk is None:
+                    await send({'type': 'http.response.body', 'body': b''})
+                # Later chunks may come from a generator that reads SQLite (streamed /query),
+                # so they are pulled on the executor too.
+                while chunk is not None:
+                    data = chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+                    chunk = await loop.run_in_executor(self._executor, next, iterator, None)
+                    await send({'type': 'http.response.body', 'body': data, 'more_body': chunk is not None})
+            finally:
+                if hasattr(wsgi_body, 'close'):
+                    await loop.run_in_executor(self._executor, wsgi_body.close)
+
+application = WSGIBridge(app.wsgi_app)
+log_info(f"ASGI mode: {ASGI_WORKER_THREADS} worker threads, {ASGI_MAX_PENDING} pending requests max.")
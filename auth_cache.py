@@ -0,0 +1,124 @@
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import bcrypt
+
+# Verified JWTs kept in memory (0 disables), and threads that run bcrypt (it releases the GIL).
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', '10000'))
+BCRYPT_WORKERS = int(os.getenv('BCRYPT_WORKERS', str(os.cpu_count() or 2)))
+# Remember successful logins for this many seconds (0, the default, always runs bcrypt).
+LOGIN_CACHE_TTL = float(os.getenv('LOGIN_CACHE_TTL', '0'))
+LOGIN_CACHE_SIZE = int(os.getenv('LOGIN_CACHE_SIZE', '1000'))
+
+class _ExpiringLRU:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[0]
+
+    def put(self, key, value, expires_at):
+        if self.max_size <= 0 or expires_at <= time.time():
+            return
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'entries': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / lookups, 3) if lookups else None,
+                'evictions': self._evictions,
+            }
+
+class TokenCache(_ExpiringLRU):
+    """Payloads of verified JWTs, keyed by token digest and kept until the token's own exp."""
+
+    def __init__(self, max_size=TOKEN_CACHE_SIZE):
+        super().__init__(max_size)
+
+    def _key(self, token):
+        return hashlib.sha256(token.encode('utf-8')).digest()
+
+    def get(self, token):
+        payload = super().get(self._key(token))
+        return dict(payload) if payload is not None else None
+
+    def put(self, token, payload):
+        # Tokens without an expiry are never cached; they would live until evicted.
+        if isinstance(payload.get('exp'), (int, float)):
+            super().put(self._key(token), dict(payload), payload['exp'])
+
+class PasswordVerifier:
+    """Runs bcrypt checks on a bounded worker pool, optionally remembering recent successes.
+
+    Cached successes are keyed by an HMAC (with a per-process random key) over the username,
+    the password and the stored hash, so neither is kept in memory in the clear and a
+    password change invalidates the entry.
+    """
+
+    def __init__(self, workers=BCRYPT_WORKERS, cache_ttl=LOGIN_CACHE_TTL, cache_size=LOGIN_CACHE_SIZE):
+        self.workers = workers
+        self.cache_ttl = cache_ttl
+        self._cache = _ExpiringLRU(cache_size if cache_ttl > 0 else 0)
+        self._key = os.urandom(32)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        # Worker threads do not survive a fork, so each gunicorn worker starts its own pool.
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='bcrypt')
+                self._pid = os.getpid()
+            return self._executor
+
+    def _digest(self, username, password, stored_hash):
+        message = '\x00'.join((username, password, stored_hash)).encode('utf-8')
+        return hmac.new(self._key, message, hashlib.sha256).digest()
+
+    def verify(self, username, password, stored_hash):
+        digest = self._digest(username, password, stored_hash)
+        if self._cache.get(digest):
+            return True
+        ok = self._pool().submit(bcrypt.checkpw, password.encode('utf-8'), stored_hash.encode('utf-8')).result()
+        if ok:
+            self._cache.put(digest, True, time.time() + self.cache_ttl)
+        return ok
+
+    def stats(self):
+        stats = self._cache.stats()
+        stats['workers'] = self.workers
+        stats['ttl_seconds'] = self.cache_ttl
+        return stats
@@ -0,0 +1,150 @@
+import atexit
+import os
+import threading
+import time
+from utils import log_info, log_error
+
+# Wait this long after the last write before backing up...
+BACKUP_DEBOUNCE_SECONDS = float(os.getenv('BACKUP_DEBOUNCE_SECONDS', '2'))
+# ...but never let a steady stream of writes hold a backup back longer than this.
+BACKUP_MAX_DELAY_SECONDS = float(os.getenv('BACKUP_MAX_DELAY_SECONDS', '30'))
+# A backup that failed (e.g. Drive unreachable) is tried again after this long.
+BACKUP_RETRY_SECONDS = float(os.getenv('BACKUP_RETRY_SECONDS', '30'))
+
+class BackupScheduler:
+    """Coalesces bursts of writes into one background backup per database.
+
+    Writers call mark_dirty(key); a single thread per process waits for each key's burst to
+    settle and then runs task(key). The default database uses key None. The task returns True
+    when it backed up and False when it found nothing to do (e.g. another worker on the host
+    already backed up the change). A key whose task raised is dirty again, due retry seconds
+    later (or sooner, if written to meanwhile).
+    """
+
+    def __init__(self, task, debounce=BACKUP_DEBOUNCE_SECONDS, max_delay=BACKUP_MAX_DELAY_SECONDS, retry=BACKUP_RETRY_SECONDS):
+        self._task = task
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.retry = retry
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pid = None
+        self._stopping = False
+        self._atexit_registered = False
+        # key -> [dirty_since, last_write]
+        self._pending = {}
+        self._writes = 0
+        self._writes_coalesced = 0
+        self._backups_run = 0
+        self._backups_skipped = 0
+        self._backups_failed = 0
+        self._last_backup_seconds = None
+
+    def mark_dirty(self, key=None):
+        with self._cond:
+            now = time.monotonic()
+            self._writes += 1
+            pending = self._pending.get(key)
+            if pending is None:
+                self._pending[key] = [now, now]
+            else:
+                self._writes_coalesced += 1
+                pending[1] = now
+            self._ensure_thread()
+            self._cond.notify()
+
+    def _ensure_thread(self):
+        # Threads do not survive a fork, so a gunicorn worker starts its own on first use.
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        self._pid = os.getpid()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name='backup-scheduler', daemon=True)
+        self._thread.start()
+        if not self._atexit_registered:
+            atexit.register(self.flush)
+            self._atexit_registered = True
+
+    def _due_at(self, pending):
+        dirty_since, last_write = pending
+        return min(last_write + self.debounce, dirty_since + self.max_delay)
+
+    def _take_due(self):
+        """Wait until some keys are due and remove them from pending; [] once stopped and drained."""
+        with self._cond:
+            while True:
+                if not self._pending:
+                    if self._stopping:
+                        return []
+                    self._cond.wait()
+                    continue
+                now = time.monotonic()
+                if self._stopping:
+                    due = list(self._pending)
+                else:
+                    due = [key for key, pending in self._pending.items() if self._due_at(pending) <= now]
+                if due:
+                    for key in due:
+                        del self._pending[key]
+                    return due
+                self._cond.wait(min(self._due_at(p) for p in self._pending.values()) - now)
+
+    def _run(self):
+        while True:
+            due = self._take_due()
+            if not due:
+                return
+            for key in due:
+                self._run_task(key)
+
+    def _run_task(self, key):
+        start = time.perf_counter()
+        try:
+            ran = self._task(key)
+        except Exception as e:
+            log_error(f"Error in background backup task{f' for {key}' if key else ''}: {e}")
+            with self._cond:
+                self._backups_failed += 1
+                # Not while shutting down, where pending keys are run until none are left.
+                if not self._stopping and key not in self._pending:
+                    retry_at = time.monotonic() + max(0.0, self.retry - self.debounce)
+                    self._pending[key] = [retry_at, retry_at]
+                    self._cond.notify()
+            return
+        with self._cond:
+            if ran:
+                self._backups_run += 1
+            else:
+                self._backups_skipped += 1
+            self._last_backup_seconds = round(time.perf_counter() - start, 3)
+
+    def flush(self, timeout=None):
+        """Run any pending backups now and stop the thread. Called on shutdown."""
+        with self._cond:
+            thread = self._thread if self._pid == os.getpid() else None
+            self._stopping = True
+            self._cond.notify()
+            pending = list(self._pending) if thread is None or not thread.is_alive() else []
+            for key in pending:
+                del self._pending[key]
+        if thread is not None and thread.is_alive():
+            thread.join(timeout)
+        for key in pending:
+            self._run_task(key)
+        log_info("Backup scheduler flushed.")
+
+    def stats(self):
+        with self._cond:
+            return {
+                'dirty': bool(self._pending),
+                'dirty_databases': len(self._pending),
+                'debounce_seconds': self.debounce,
+                'max_delay_seconds': self.max_delay,
+                'writes': self._writes,
+                'writes_coalesced': self._writes_coalesced,
+                'backups_run': self._backups_run,
+                'backups_skipped': self._backups_skipped,
+                'backups_failed': self._backups_failed,
+                'retry_seconds': self.retry,
+                'last_backup_seconds': self._last_backup_seconds,
+            }
@@ -0,0 +1,53 @@
+"""Login and JWT-auth throughput with the auth caches off ('baseline') and on ('cached').
+
+Each configuration runs in a fresh process, because the caches are configured from the
+environment at import time:
+
+    python benchmarks/bench_auth.py --threads 8 --seconds 5 --output auth.json
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import BENCH_ENV, run_concurrent, run_worker, write_results
+
+CONFIGS = {
+    # No token cache, no login cache, one bcrypt at a time.
+    'baseline': {'TOKEN_CACHE_SIZE': 0, 'LOGIN_CACHE_TTL': 0, 'BCRYPT_WORKERS': 1},
+    'cached': {'TOKEN_CACHE_SIZE': 10000, 'LOGIN_CACHE_TTL': 300, 'BCRYPT_WORKERS': os.cpu_count() or 2},
+}
+
+def worker(threads, seconds):
+    import app
+    username, password = BENCH_ENV['JWT_ADMIN_USERNAME'], BENCH_ENV['JWT_ADMIN_PASSWORD']
+    clients = [app.app.test_client() for _ in range(threads)]
+    token = clients[0].post('/login', json={'username': username, 'password': password}).get_json()['token']
+    headers = {'Authorization': f'Bearer {token}'}
+
+    def login(i):
+        return clients[i].post('/login', json={'username': username, 'password': password}).status_code == 200
+
+    def auth(i):
+        return clients[i].post('/query', json={'sql': 'SELECT 1'}, headers=headers).status_code == 200
+
+    return {'login': run_concurrent(login, threads, seconds), 'auth': run_concurrent(auth, threads, seconds)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--output')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        import json
+        print(json.dumps(worker(args.threads, args.seconds)))
+        return
+    results = {'threads': args.threads, 'seconds': args.seconds, 'configs': {}}
+    for name, env in CONFIGS.items():
+        results['configs'][name] = run_worker(__file__, ['--threads', args.threads, '--seconds', args.seconds], **env)
+    write_results(results, args.output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""Backup time and bytes against database size, for each backup mode, with the fake Drive.
+
+For every --sizes entry (e.g. 10MB,100MB,1GB,5GB) and every --modes entry (full,
+incremental) a fresh process builds a database of about that size and times
+backup_and_sync_task three times: the first backup, one right after with nothing changed,
+and one after updating the --changed-rows most recently inserted rows (as in an
+append-mostly workload; changes scattered over the file touch every chunk). Reported per
+backup: seconds, the time per phase, bytes uploaded (before and after compression) and
+what the local backups and the fake Drive hold afterwards:
+
+    python benchmarks/bench_backup.py --sizes 10MB,100MB,1GB --modes full,incremental --output backup.json
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import environment_info, run_worker, write_results
+
+UNITS = {'KB': 1 << 10, 'MB': 1 << 20, 'GB': 1 << 30}
+# Each row holds this many bytes of hex text (compressible about 2:1, like much real data).
+ROW_BYTES = 1024
+FILL_BATCH_ROWS = 50000
+
+def parse_size(text):
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)\s*(KB|MB|GB)?', text.strip().upper())
+    if not match:
+        raise ValueError(f'bad size: {text}')
+    return int(float(match.group(1)) * UNITS.get(match.group(2) or 'MB'))
+
+def dir_bytes(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+def phase_seconds():
+    """Total seconds per backup phase so far, read from the metrics registry."""
+    import metrics
+    totals = {}
+    for line in metrics.render().splitlines():
+        match = re.match(r'drivesync_backup_phase_seconds_sum\{phase="(\w+)"\} (\S+)', line)
+        if match:
+            totals[match.group(1)] = float(match.group(2))
+    return totals
+
+def timed_backup(app, drive):
+    import drive_utils
+    phases = phase_seconds()
+    uploaded = drive_utils.transfer_stats().get('upload', {})
+    calls, bytes_up = drive.stats['calls'], drive.stats['bytes_up']
+    start = time.perf_counter()
+    ran = app.backup_and_sync_task(app.DB_PATH)
+    elapsed = time.perf_counter() - start
+    after = drive_utils.transfer_stats().get('upload', {})
+    return {
+        'backed_up': ran,
+        'seconds': round(elapsed, 3),
+        'phases': {name: round(total - phases.get(name, 0.0), 3) for name, total in phase_seconds().items()
+                   if total - phases.get(name, 0.0) > 0},
+        'raw_bytes_uploaded': after.get('raw_bytes', 0) - uploaded.get('raw_bytes', 0),
+        'wire_bytes_uploaded': drive.stats['bytes_up'] - bytes_up,
+        'drive_calls': drive.stats['calls'] - calls,
+    }
+
+def fill(db_path, target_bytes):
+    """Add rows until the file is about target_bytes. Returns the number of rows."""
+    import sqlite3
+    conn = sqlite3.connect(db_path)
+    conn.execute('CREATE TABLE IF NOT EXISTS bench_data (id INTEGER PRIMARY KEY, payload TEXT)')
+    rows = conn.execute('SELECT count(*) FROM bench_data').fetchone()[0]
+    # The first batch is small, to learn how many bytes a row takes with page overhead.
+    batch = 1000
+    while os.path.getsize(db_path) < target_bytes:
+        conn.execute('INSERT INTO bench_data (payload) SELECT hex(randomblob(?)) FROM '
+                     '(WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < ?) SELECT i FROM n)',
+                     (ROW_BYTES // 2, batch))
+        conn.commit()
+        rows += batch
+        # Move the batch into the main file, so its size shows the progress.
+        conn.execute('PRAGMA wal_checkpoint(PASSIVE)')
+        size = os.path.getsize(db_path)
+        batch = max(1, min(FILL_BATCH_ROWS, int((target_bytes - size) / (size / rows)) + 1))
+    conn.close()
+    return rows
+
+def worker(size, changed_rows):
+    import fake_drive
+    drive = fake_drive.install()
+    import app
+    app.initialize_server()
+    start = time.perf_counter()
+    rows = fill(app.DB_PATH, size)
+    result = {
+        'db_bytes': os.path.getsize(app.DB_PATH),
+        'rows': rows,
+        'fill_seconds': round(time.perf_counter() - start, 3),
+        'first': timed_backup(app, drive),
+        'unchanged': timed_backup(app, drive),
+    }
+    import sqlite3
+    conn = sqlite3.connect(app.DB_PATH)
+    conn.execute('UPDATE bench_data SET payload = hex(randomblob(?)) WHERE id > ?',
+                 (ROW_BYTES // 2, max(0, rows - changed_rows)))
+    conn.commit()
+    conn.close()
+    result['changed'] = dict(timed_backup(app, drive), rows_changed=changed_rows)
+    result['local_backup_bytes'] = dir_bytes(os.path.join(app.tmp_PATH, 'backups'))
+    result['drive'] = drive.usage()
+    return result
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--worker':
+        print(json.dumps(worker(int(sys.argv[2]), int(sys.argv[3]))))
+        return
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='10MB,100MB')
+    parser.add_argument('--modes', default='full,incremental')
+    parser.add_argument('--changed-rows', type=int, default=100)
+    parser.add_argument('--timeout', type=float, default=7200)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+    results = {'environment': environment_info(), 'changed_rows': args.changed_rows, 'sizes': {}}
+    for size_text in args.sizes.split(','):
+        size = parse_size(size_text)
+        results['sizes'][size_text] = {}
+        for mode in args.modes.split(','):
+            results['sizes'][size_text][mode] = run_worker(__file__, [size, args.changed_rows],
+                                                           timeout=args.timeout, BACKUP_MODE=mode)
+    write_results(results, args.output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+"""Rows per second of bulk import and export, against /query executemany batches.
+
+Starts one gunicorn worker against a throwaway RUNTIME_DIR and the fake Drive. For each format (csv, ndjson)
+and each pragma setting (normal, fast) a fresh table is loaded with --rows generated rows.
+The body is written to a file before the clock starts and sent from it with chunked
+encoding, so the numbers are the server's rather than the generator's. The baseline loads
+--baseline-rows rows through POST /query in --query-batch row batches, the only way to load
+data before the import endpoint. Each loaded table is then exported:
+
+    python benchmarks/bench_bulk.py --rows 1000000 --output bulk.json
+"""
+import argparse
+import http.client
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import BENCH_ENV, gunicorn_server, write_results
+
+TABLE_SQL = 'CREATE TABLE {} (id INTEGER PRIMARY KEY, name TEXT, value REAL, created INTEGER)'
+COLUMNS = ('id', 'name', 'value', 'created')
+
+def make_row(i):
+    return (i, f'name-{i}', i * 0.5, 1700000000 + i)
+
+def body_chunks(fmt, rows, rows_per_chunk=5000):
+    """The import body, generated a chunk at a time."""
+    if fmt == 'csv':
+        yield (','.join(COLUMNS) + '\n').encode()
+    for start in range(0, rows, rows_per_chunk):
+        chunk = [make_row(i) for i in range(start, min(rows, start + rows_per_chunk))]
+        if fmt == 'csv':
+            yield ''.join(f'{i},{name},{value},{created}\n' for i, name, value, created in chunk).encode()
+        else:
+            yield ''.join(json.dumps(dict(zip(COLUMNS, row))) + '\n' for row in chunk).encode()
+
+def write_body(path, fmt, rows):
+    with open(path, 'wb') as f:
+        for chunk in body_chunks(fmt, rows):
+            f.write(chunk)
+
+def file_chunks(path, size=1 << 20):
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(size)
+            if not block:
+                return
+            yield block
+
+class Client:
+    def __init__(self, port):
+        self.port = port
+        self.headers = {}
+        status, data = self.request('POST', '/login', json.dumps({
+            'username': BENCH_ENV['JWT_ADMIN_USERNAME'], 'password': BENCH_ENV['JWT_ADMIN_PASSWORD']}))
+        self.headers = {'Authorization': f"Bearer {json.loads(data)['token']}"}
+
+    def request(self, method, path, body=None, content_type='application/json', chunked=False):
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=3600)
+        try:
+            conn.request(method, path, body, dict(self.headers, **{'Content-Type': content_type}), encode_chunked=chunked)
+            response = conn.getresponse()
+            return response.status, response.read()
+        finally:
+            conn.close()
+
+    def query(self, sql, params=None):
+        status, data = self.request('POST', '/query', json.dumps({'sql': sql, 'params': params or []}))
+        if status != 200:
+            raise RuntimeError(f"/query failed ({status}): {data[:200]!r}")
+        return json.loads(data)
+
+def fresh_table(client, name):
+    client.query(f'DROP TABLE IF EXISTS {name}')
+    client.query(TABLE_SQL.format(name))
+
+def run_import(client, table, fmt, body_path, fast):
+    fresh_table(client, table)
+    content_type = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    start = time.perf_counter()
+    status, data = client.request('POST', f"/tables/{table}/import?format={fmt}&fast={int(fast)}",
+                                  file_chunks(body_path), content_type, chunked=True)
+    elapsed = time.perf_counter() - start
+    if status != 200:
+        raise RuntimeError(f"import failed ({status}): {data[:200]!r}")
+    result = json.loads(data)
+    return {
+        'rows': result['rows'],
+        'seconds': round(elapsed, 3),
+        'rows_per_sec': round(result['rows'] / elapsed, 1),
+        'server_rows_per_sec': result['rows_per_sec'],
+    }
+
+def run_baseline(client, table, rows, batch):
+    fresh_table(client, table)
+    sql = f'INSERT INTO {table} ({", ".join(COLUMNS)}) VALUES (?, ?, ?, ?)'
+    start = time.perf_counter()
+    for first in range(0, rows, batch):
+        client.query(sql, [list(make_row(i)) for i in range(first, min(rows, first + batch))])
+    elapsed = time.perf_counter() - start
+    return {'rows': rows, 'seconds': round(elapsed, 3), 'rows_per_sec': round(rows / elapsed, 1)}
+
+def run_export(client, table, fmt):
+    conn = http.client.HTTPConnection('127.0.0.1', client.port, timeout=3600)
+    start = time.perf_counter()
+    conn.request('GET', f'/tables/{table}/export?format={fmt}', headers=client.headers)
+    response = conn.getresponse()
+    lines = 0
+    first_byte = None
+    # Read as it streams; only the line count is kept.
+    while True:
+        block = response.read(1 << 20)
+        if not block:
+            break
+        if first_byte is None:
+            first_byte = time.perf_counter() - start
+        lines += block.count(b'\n')
+    elapsed = time.perf_counter() - start
+    conn.close()
+    rows = lines - 1 if fmt == 'csv' else lines
+    return {
+        'rows': rows,
+        'seconds': round(elapsed, 3),
+        'rows_per_sec': round(rows / elapsed, 1),
+        'first_byte_ms': round(first_byte * 1000, 1) if first_byte is not None else None,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--baseline-rows', type=int, default=100000)
+    parser.add_argument('--query-batch', type=int, default=1000)
+    parser.add_argument('--batch-size', type=int, help='IMPORT_BATCH_SIZE for the server')
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    runtime_dir = tempfile.mkdtemp(prefix='drivesync-bench-')
+    overrides = {'IMPORT_BATCH_SIZE': args.batch_size} if args.batch_size else {}
+    results = {'rows': args.rows, 'import': {}, 'export': {}}
+    try:
+        with gunicorn_server(runtime_dir, 1, extra=('-t', '3600'), **overrides) as port:
+            client = Client(port)
+            results['baseline_query_executemany'] = dict(
+                run_baseline(client, 'bench_baseline', args.baseline_rows, args.query_batch), batch=args.query_batch)
+            for fmt in ('csv', 'ndjson'):
+                body_path = os.path.join(runtime_dir, f'body.{fmt}')
+                write_body(body_path, fmt, args.rows)
+                for fast in (False, True):
+                    table = f"bench_{fmt}_{'fast' if fast else 'normal'}"
+                    results['import'][table] = run_import(client, table, fmt, body_path, fast)
+                os.remove(body_path)
+            for fmt in ('csv', 'ndjson'):
+                results['export'][fmt] = run_export(client, 'bench_csv_fast', fmt)
+    finally:
+        shutil.rmtree(runtime_dir, ignore_errors=True)
+    write_results(results, args.output)
+
+if __name__ == '__main__':
+    main()
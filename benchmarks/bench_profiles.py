@@ -0,0 +1,123 @@
+"""Memory and latency of each SQLite tuning profile (SQLITE_PROFILE), with the WAL under load.
+
+Each --profiles entry runs in a fresh process against a database of --rows rows (about 1 KB
+each) and the fake Drive, with the query result cache off so reads reach SQLite. Reads go
+through /query on the Flask test client: point lookups and 1000-row range scans, from
+--threads threads. First for --seconds on their own ('read'), then for --seconds next to one
+thread inserting 100-row batches ('mixed_read', 'mixed_write'). Reported per profile: its
+settings, process RSS before the load and at peak, latency percentiles, and how large the
+-wal file got and how the checkpoint manager kept it in bounds:
+
+    python benchmarks/bench_profiles.py --profiles low-memory,balanced,read-heavy --output profiles.json
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import BENCH_ENV, environment_info, run_concurrent, run_worker, write_results
+
+PAYLOAD_BYTES = 1000
+RANGE_ROWS = 1000
+WRITE_BATCH = 100
+
+def fill(db_path, rows):
+    import sqlite3
+    conn = sqlite3.connect(db_path)
+    conn.execute('CREATE TABLE IF NOT EXISTS bench_items (id INTEGER PRIMARY KEY, grp INTEGER, payload TEXT)')
+    conn.executemany('INSERT INTO bench_items (id, grp, payload) VALUES (?, ?, ?)',
+                     ((i, i % 100, os.urandom(PAYLOAD_BYTES // 2).hex()) for i in range(rows)))
+    conn.commit()
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    conn.close()
+
+def rss_mb():
+    import psutil
+    return round(psutil.Process().memory_info().rss / (1 << 20), 1)
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux.
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+def worker(threads, seconds, rows):
+    import fake_drive
+    fake_drive.install()
+    import app
+    import checkpointer
+    app.initialize_server()
+    fill(app.DB_PATH, rows)
+    credentials = {'username': BENCH_ENV['JWT_ADMIN_USERNAME'], 'password': BENCH_ENV['JWT_ADMIN_PASSWORD']}
+    client = app.app.test_client()
+    headers = {'Authorization': f"Bearer {client.post('/login', json=credentials).get_json()['token']}"}
+    clients = [app.app.test_client() for _ in range(threads + 1)]
+
+    def read(i):
+        if random.random() < 0.9:
+            body = {'sql': 'SELECT id, grp, payload FROM bench_items WHERE id = ?', 'params': [random.randrange(rows)]}
+        else:
+            first = random.randrange(max(1, rows - RANGE_ROWS))
+            body = {'sql': 'SELECT grp, count(*), sum(length(payload)) FROM bench_items WHERE id BETWEEN ? AND ? GROUP BY grp',
+                    'params': [first, first + RANGE_ROWS]}
+        return clients[i].post('/query', json=body, headers=headers).status_code == 200
+
+    def write(i):
+        body = {'sql': 'INSERT INTO bench_items (grp, payload) VALUES (?, ?)',
+                'params': [[random.randrange(100), os.urandom(PAYLOAD_BYTES // 2).hex()] for _ in range(WRITE_BATCH)]}
+        return clients[threads].post('/query', json=body, headers=headers).status_code == 200
+
+    result = {'profile': app.PROFILE, 'rows': rows, 'db_bytes': os.path.getsize(app.DB_PATH), 'rss_before_mb': rss_mb()}
+    result['read'] = run_concurrent(read, threads, seconds)
+    result['rss_after_read_mb'] = rss_mb()
+
+    wal = {'max': 0}
+    stop = threading.Event()
+
+    def sample_wal():
+        while not stop.is_set():
+            wal['max'] = max(wal['max'], checkpointer.wal_size(app.DB_PATH))
+            time.sleep(0.05)
+    sampler = threading.Thread(target=sample_wal, daemon=True)
+    sampler.start()
+    writes = {}
+    writer = threading.Thread(target=lambda: writes.update(run_concurrent(write, 1, seconds)))
+    writer.start()
+    result['mixed_read'] = run_concurrent(read, threads, seconds)
+    writer.join()
+    # Give the checkpoint manager one more look once the writes stop.
+    time.sleep(app.wal_checkpointer.interval * 2)
+    stop.set()
+    sampler.join()
+    result['mixed_write'] = dict(writes, rows_per_sec=round(writes['ops_per_sec'] * WRITE_BATCH, 1) if writes.get('ops_per_sec') else None)
+    result['rss_peak_mb'] = peak_rss_mb()
+    result['wal'] = {
+        'max_bytes_seen': wal['max'],
+        'bytes_at_end': checkpointer.wal_size(app.DB_PATH),
+        'checkpoints': {k: v for k, v in app.wal_checkpointer.stats().items() if k != 'wal_bytes'},
+    }
+    return result
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--worker':
+        print(json.dumps(worker(int(sys.argv[2]), float(sys.argv[3]), int(sys.argv[4]))))
+        return
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--profiles', default='low-memory,balanced,read-heavy')
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+    results = {'environment': environment_info(), 'threads': args.threads, 'seconds': args.seconds, 'profiles': {}}
+    for profile in args.profiles.split(','):
+        # Checked every second so the run shows the manager at work.
+        results['profiles'][profile] = run_worker(__file__, [args.threads, args.seconds, args.rows],
+                                                  SQLITE_PROFILE=profile, QUERY_CACHE_MAX_BYTES=0, WAL_CHECK_SECONDS=1)
+    write_results(results, args.output)
+
+if __name__ == '__main__':
+    main()
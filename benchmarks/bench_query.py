@@ -0,0 +1,160 @@
+"""QPS and latency percentiles of /query reads and writes and of /login, under concurrency.
+
+Every operation runs at each --concurrency level for --seconds, against two targets: the
+Flask test client in one process ('test_client') and a real gunicorn with --workers sync
+workers over keep-alive HTTP ('gunicorn'). Reads fetch one random row by primary key out
+of --rows seeded rows; writes insert one row; logins run bcrypt. Both targets back up to
+the fake Drive. --no-cache turns the query result cache off, so reads reach SQLite:
+
+    python benchmarks/bench_query.py --concurrency 1,8,32 --seconds 5 --output query.json
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import sys
+import tempfile
+import shutil
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import BENCH_ENV, gunicorn_server, run_concurrent, run_worker, write_results
+
+OPS = ('read', 'write', 'login')
+SEED_BATCH = 1000
+
+def seed(post, rows):
+    """Create and fill the table the reads use. post(path, body) returns (status, json)."""
+    post('/query', {'sql': 'CREATE TABLE IF NOT EXISTS bench_items (id INTEGER PRIMARY KEY, name TEXT, value REAL)'})
+    for first in range(0, rows, SEED_BATCH):
+        status, _ = post('/query', {
+            'sql': 'INSERT INTO bench_items (id, name, value) VALUES (?, ?, ?)',
+            'params': [[i, f'item-{i}', i * 0.5] for i in range(first, min(rows, first + SEED_BATCH))],
+        })
+        if status != 200:
+            raise RuntimeError(f'seeding failed with {status}')
+
+def bodies(op, rows):
+    """A function returning (path, body) for each call of op."""
+    if op == 'read':
+        return lambda: ('/query', {'sql': 'SELECT id, name, value FROM bench_items WHERE id = ?', 'params': [random.randrange(rows)]})
+    if op == 'write':
+        return lambda: ('/query', {'sql': 'INSERT INTO bench_items (name, value) VALUES (?, ?)', 'params': ['written', random.random()]})
+    credentials = {'username': BENCH_ENV['JWT_ADMIN_USERNAME'], 'password': BENCH_ENV['JWT_ADMIN_PASSWORD']}
+    return lambda: ('/login', credentials)
+
+def measure(make_post, levels, seconds, rows):
+    """{op: {concurrency: summary}}; make_post(threads) returns post(thread index, path, body) -> status."""
+    results = {}
+    for op in OPS:
+        make_body = bodies(op, rows)
+        results[op] = {}
+        for threads in levels:
+            post = make_post(threads)
+
+            def call(i):
+                path, body = make_body()
+                return post(i, path, body) == 200
+            results[op][threads] = run_concurrent(call, threads, seconds)
+    return results
+
+def worker(levels, seconds, rows):
+    import fake_drive
+    fake_drive.install()
+    import app
+    credentials = {'username': BENCH_ENV['JWT_ADMIN_USERNAME'], 'password': BENCH_ENV['JWT_ADMIN_PASSWORD']}
+    client = app.app.test_client()
+    headers = {'Authorization': f"Bearer {client.post('/login', json=credentials).get_json()['token']}"}
+
+    def seed_post(path, body):
+        response = client.post(path, json=body, headers=headers)
+        return response.status_code, response.get_json()
+    seed(seed_post, rows)
+
+    def make_post(threads):
+        clients = [app.app.test_client() for _ in range(threads)]
+        return lambda i, path, body: clients[i].post(path, json=body, headers=headers).status_code
+    return measure(make_post, levels, seconds, rows)
+
+class HttpPoster:
+    """Keep-alive connections to one server, one per benchmark thread."""
+
+    def __init__(self, port, threads, headers):
+        self.port = port
+        self.headers = headers
+        self.conns = [None] * threads
+
+    def __call__(self, i, path, body):
+        try:
+            if self.conns[i] is None:
+                self.conns[i] = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+            self.conns[i].request('POST', path, json.dumps(body), self.headers)
+            response = self.conns[i].getresponse()
+            response.read()
+            return response.status
+        except (OSError, http.client.HTTPException):
+            self.conns[i] = None
+            return None
+
+    def close(self):
+        for conn in self.conns:
+            if conn is not None:
+                conn.close()
+
+def run_gunicorn(levels, seconds, rows, workers, env):
+    runtime_dir = tempfile.mkdtemp(prefix='drivesync-bench-')
+    try:
+        with gunicorn_server(runtime_dir, workers, **env) as port:
+            json_headers = {'Content-Type': 'application/json'}
+            login = HttpPoster(port, 1, json_headers)
+            credentials = {'username': BENCH_ENV['JWT_ADMIN_USERNAME'], 'password': BENCH_ENV['JWT_ADMIN_PASSWORD']}
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+            conn.request('POST', '/login', json.dumps(credentials), json_headers)
+            token = json.loads(conn.getresponse().read())['token']
+            conn.close()
+            login.close()
+            headers = dict(json_headers, Authorization=f'Bearer {token}')
+            seeder = HttpPoster(port, 1, headers)
+            seed(lambda path, body: (seeder(0, path, body), None), rows)
+            seeder.close()
+            posters = []
+
+            def make_post(threads):
+                poster = HttpPoster(port, threads, headers)
+                posters.append(poster)
+                return poster
+            try:
+                return measure(make_post, levels, seconds, rows)
+            finally:
+                for poster in posters:
+                    poster.close()
+    finally:
+        shutil.rmtree(runtime_dir, ignore_errors=True)
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--worker':
+        levels = [int(n) for n in sys.argv[2].split(',')]
+        print(json.dumps(worker(levels, float(sys.argv[3]), int(sys.argv[4]))))
+        return
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--concurrency', default='1,8,32')
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--targets', default='test_client,gunicorn')
+    parser.add_argument('--no-cache', action='store_true')
+    parser.add_argument('--output')
+    args = parser.parse_args()
+    levels = [int(n) for n in args.concurrency.split(',')]
+    env = {'QUERY_CACHE_MAX_BYTES': 0} if args.no_cache else {}
+    results = {'seconds': args.seconds, 'rows': args.rows, 'result_cache': not args.no_cache, 'targets': {}}
+    targets = args.targets.split(',')
+    if 'test_client' in targets:
+        results['targets']['test_client'] = run_worker(__file__, [args.concurrency, args.seconds, args.rows], **env)
+    if 'gunicorn' in targets:
+        results['gunicorn_workers'] = args.workers
+        results['targets']['gunicorn'] = run_gunicorn(levels, args.seconds, args.rows, args.workers, env)
+    write_results(results, args.output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""Load test of the two serving modes: gunicorn sync workers ('sync') and asgi.py ('asgi').
+
+Each server is started against its own throwaway RUNTIME_DIR. The benchmark first opens
+--idle connections that never finish sending a request (slow or idle clients), checks
+whether a real request still gets through, then measures keep-alive POST /query throughput:
+
+    python benchmarks/bench_serving.py --workers 2 --threads 32 --idle 500 --output serving.json
+"""
+import argparse
+import http.client
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import BENCH_ENV, REPO_DIR, bench_env, free_port, run_concurrent, wait_ready, write_results
+
+def server_command(mode, port, workers):
+    command = [sys.executable, '-m', 'gunicorn', '-w', str(workers), '-b', f'127.0.0.1:{port}']
+    if mode == 'asgi':
+        return command + ['-k', 'uvicorn.workers.UvicornWorker', 'asgi:application']
+    return command + ['app:app']
+
+def login(port):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    body = json.dumps({'username': BENCH_ENV['JWT_ADMIN_USERNAME'], 'password': BENCH_ENV['JWT_ADMIN_PASSWORD']})
+    conn.request('POST', '/login', body, {'Content-Type': 'application/json'})
+    token = json.loads(conn.getresponse().read())['token']
+    conn.close()
+    return token
+
+def idle_probe(port, idle, timeout):
+    """Open `idle` half-sent requests, then time one real request next to them."""
+    sockets = []
+    try:
+        for _ in range(idle):
+            s = socket.create_connection(('127.0.0.1', port))
+            s.sendall(b'GET /ping HTTP/1.1\r\nHost: localhost\r\n')
+            sockets.append(s)
+        time.sleep(0.5)
+        start = time.perf_counter()
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+            conn.request('GET', '/ping')
+            served = conn.getresponse().status == 200
+            conn.close()
+        except OSError:
+            served = False
+        return {
+            'idle_connections': len(sockets),
+            'served': served,
+            'latency_ms': round((time.perf_counter() - start) * 1000, 3) if served else None,
+        }
+    finally:
+        for s in sockets:
+            s.close()
+
+def run_mode(mode, args):
+    runtime_dir = tempfile.mkdtemp(prefix='drivesync-bench-')
+    port = free_port()
+    proc = subprocess.Popen(server_command(mode, port, args.workers), cwd=REPO_DIR,
+                            env=bench_env(runtime_dir), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_ready(port)
+        token = login(port)
+        result = {'idle': idle_probe(port, args.idle, args.probe_timeout)}
+        body = json.dumps({'sql': 'SELECT 1'})
+        headers = {'Content-Type': 'application/json', 'Authorization': f'Bearer {token}'}
+        conns = [None] * args.threads
+
+        def query(i):
+            try:
+                if conns[i] is None:
+                    conns[i] = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+                conns[i].request('POST', '/query', body, headers)
+                response = conns[i].getresponse()
+                response.read()
+                return response.status == 200
+            except (OSError, http.client.HTTPException):
+                conns[i] = None
+                return False
+
+        result['query'] = run_concurrent(query, args.threads, args.seconds)
+        for conn in conns:
+            if conn is not None:
+                conn.close()
+        return result
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        shutil.rmtree(runtime_dir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--modes', default='sync,asgi')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--idle', type=int, default=200)
+    parser.add_argument('--probe-timeout', type=float, default=5)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+    results = {'workers': args.workers, 'threads': args.threads, 'seconds': args.seconds, 'modes': {}}
+    for mode in args.modes.split(','):
+        results['modes'][mode] = run_mode(mode, args)
+    write_results(results, args.output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""Time from launching gunicorn with N workers until it serves requests.
+
+For each worker count the server is started twice against one throwaway RUNTIME_DIR: 'cold'
+(no database yet) and 'warm' (the database the cold run left behind, as after a restart).
+Reported per run: first /ping, first authenticated /query, every worker serving (seen via the
+pid in /metrics), and how many workers initialized the database rather than skipping it:
+
+    python benchmarks/bench_startup.py --workers 1,2,4,8 --output startup.json
+"""
+import argparse
+import http.client
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import BENCH_ENV, REPO_DIR, bench_env, free_port, gunicorn_command, write_results
+
+def poll(fn, timeout, interval=0.01):
+    """Call fn() until it returns something truthy; returns it, or None on timeout."""
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            result = fn()
+            if result:
+                return result
+        except (OSError, http.client.HTTPException):
+            pass
+        time.sleep(interval)
+    return None
+
+def request(port, method, path, body=None, headers=None):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+    try:
+        conn.request(method, path, body, headers or {})
+        response = conn.getresponse()
+        return response.status, response.read()
+    finally:
+        conn.close()
+
+def first_query(port):
+    body = json.dumps({'username': BENCH_ENV['JWT_ADMIN_USERNAME'], 'password': BENCH_ENV['JWT_ADMIN_PASSWORD']})
+    status, data = request(port, 'POST', '/login', body, {'Content-Type': 'application/json'})
+    if status != 200:
+        return False
+    headers = {'Content-Type': 'application/json', 'Authorization': f"Bearer {json.loads(data)['token']}"}
+    status, _ = request(port, 'POST', '/query', json.dumps({'sql': 'SELECT 1'}), headers)
+    return status == 200
+
+def worker_pids(port, seen):
+    # Each new connection may land on another worker; /metrics names the one that answered.
+    status, data = request(port, 'GET', '/metrics')
+    if status == 200:
+        seen.update(re.findall(r'drivesync_process_info\{pid="(\d+)"\}', data.decode()))
+    return seen
+
+def run_server(runtime_dir, workers, timeout):
+    port = free_port()
+    log_path = os.path.join(runtime_dir, 'app.log')
+    log_start = os.path.getsize(log_path) if os.path.exists(log_path) else 0
+    start = time.perf_counter()
+    proc = subprocess.Popen(gunicorn_command(port, workers),
+                            cwd=REPO_DIR, env=bench_env(runtime_dir), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def since_start(ok):
+        return round((time.perf_counter() - start) * 1000, 1) if ok else None
+
+    try:
+        result = {'first_ping_ms': since_start(poll(lambda: request(port, 'GET', '/ping')[0] == 200, timeout))}
+        result['first_query_ms'] = since_start(poll(lambda: first_query(port), timeout))
+        seen = set()
+        result['all_workers_ms'] = since_start(poll(lambda: len(worker_pids(port, seen)) >= workers, timeout))
+        result['workers_seen'] = len(seen)
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+    with open(log_path, encoding='utf-8', errors='ignore') as f:
+        f.seek(log_start)
+        log = f.read()
+    result['workers_initialized'] = log.count('Startup: database initialized')
+    result['workers_skipped'] = log.count('Startup: database already initialized')
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', default='1,2,4')
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+    results = {}
+    for workers in [int(n) for n in args.workers.split(',')]:
+        runtime_dir = tempfile.mkdtemp(prefix='drivesync-bench-')
+        try:
+            results[workers] = {
+                'cold': run_server(runtime_dir, workers, args.timeout),
+                'warm': run_server(runtime_dir, workers, args.timeout),
+            }
+        finally:
+            shutil.rmtree(runtime_dir, ignore_errors=True)
+    write_results(results, args.output)
+
+if __name__ == '__main__':
+    main()
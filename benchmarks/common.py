@@ -0,0 +1,175 @@
+"""Helpers shared by the benchmark scripts.
+
+Benchmarks run the app against a throwaway RUNTIME_DIR, so they never touch the real
+database or its backups, and with Google credentials removed. Servers started with
+gunicorn_command() and in-process runs that call fake_drive.install() back up to a local
+fake Drive (see fake_drive.py) instead.
+"""
+import http.client
+import json
+import os
+import platform
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+# The app as gunicorn serves it in the benchmarks, backing up to the fake Drive.
+BENCH_APP = 'fake_drive_app:app'
+
+BENCH_ENV = {
+    'JWT_SECRET': 'benchmark-secret-benchmark-secret-0123',
+    'JWT_ADMIN_USERNAME': 'bench',
+    'JWT_ADMIN_PASSWORD': 'bench-password',
+    # Keep background backups out of the measurements unless a benchmark asks for them.
+    'BACKUP_DEBOUNCE_SECONDS': '3600',
+    'BACKUP_MAX_DELAY_SECONDS': '3600',
+}
+
+def bench_env(runtime_dir, **overrides):
+    env = {k: v for k, v in os.environ.items() if not k.startswith('GOOGLE_')}
+    env.update(BENCH_ENV)
+    env['RUNTIME_DIR'] = runtime_dir
+    env['FAKE_DRIVE_DIR'] = os.path.join(runtime_dir, 'fake_drive')
+    env['PYTHONPATH'] = os.pathsep.join([REPO_DIR, BENCH_DIR, env.get('PYTHONPATH', '')])
+    env.update({k: str(v) for k, v in overrides.items()})
+    return env
+
+def run_worker(script, args, runtime_dir=None, timeout=None, **env_overrides):
+    """Run `script --worker args...` in a fresh process and return the JSON object it prints last."""
+    own_dir = runtime_dir is None
+    runtime_dir = runtime_dir or tempfile.mkdtemp(prefix='drivesync-bench-')
+    try:
+        proc = subprocess.run(
+            [sys.executable, script, '--worker'] + [str(a) for a in args],
+            env=bench_env(runtime_dir, **env_overrides), cwd=REPO_DIR,
+            capture_output=True, text=True, timeout=timeout)
+        if proc.returncode != 0:
+            raise RuntimeError(f"{script} worker failed:\n{proc.stderr[-4000:]}")
+        # The app's background threads may log to stdout after the result, even on its line.
+        decoder = json.JSONDecoder()
+        for line in reversed(proc.stdout.strip().splitlines()):
+            if line.startswith('{'):
+                try:
+                    return decoder.raw_decode(line)[0]
+                except ValueError:
+                    pass
+        raise RuntimeError(f"{script} worker printed no result:\n{proc.stdout[-4000:]}")
+    finally:
+        if own_dir:
+            shutil.rmtree(runtime_dir, ignore_errors=True)
+
+def percentile(samples, pct):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+def summarize(latencies, errors, elapsed):
+    return {
+        'ops': len(latencies),
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'ops_per_sec': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3) if latencies else None,
+        'max_ms': round(max(latencies) * 1000, 3) if latencies else None,
+    }
+
+def run_concurrent(op, threads, seconds):
+    """Call op(thread_index) from `threads` threads for `seconds`; op returns True on success."""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def loop(index):
+        local, failed = [], 0
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            ok = op(index)
+            if ok:
+                local.append(time.perf_counter() - start)
+            else:
+                failed += 1
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=loop, args=(i,)) for i in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return summarize(latencies, errors[0], time.perf_counter() - started)
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def wait_ready(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/ping')
+            if conn.getresponse().status == 200:
+                conn.close()
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"server on port {port} did not come up")
+
+def gunicorn_command(port, workers, app=BENCH_APP, extra=()):
+    return [sys.executable, '-m', 'gunicorn', '-w', str(workers), '-b', f'127.0.0.1:{port}', *extra, app]
+
+@contextmanager
+def gunicorn_server(runtime_dir, workers=1, app=BENCH_APP, extra=(), **env_overrides):
+    """Run gunicorn on a free port until the block ends; yields the port once /ping answers."""
+    port = free_port()
+    proc = subprocess.Popen(gunicorn_command(port, workers, app, extra), cwd=REPO_DIR,
+                            env=bench_env(runtime_dir, **env_overrides),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_ready(port)
+        yield port
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def environment_info():
+    """What a result was measured on, so runs can be compared."""
+    return {
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+    }
+
+def write_results(results, output):
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
@@ -0,0 +1,217 @@
+"""A Drive v3 stand-in backed by a local directory, for benchmarks.
+
+It implements only what drive_utils calls: files().list/create/update/delete/get_media and
+batch requests. Each file is stored as <id> (content) and <id>.json (name, appProperties)
+under FAKE_DRIVE_DIR, so every gunicorn worker sees the same Drive. Uploads are read through
+the real CompressedFileUpload and downloads go through MediaIoBaseDownload, so compression and
+chunking are part of what is measured. FAKE_DRIVE_LATENCY_MS adds a delay to every call, as a
+stand-in for the network round trip.
+
+install() replaces drive_utils.build_drive_service with it; fake_drive_app.py does that for
+gunicorn.
+"""
+import json
+import os
+import re
+import threading
+import time
+import uuid
+
+import httplib2
+
+DEFAULT_ROOT = os.path.join(os.getenv('RUNTIME_DIR') or '/tmp/Drive_temp', 'fake_drive')
+
+_NAME_EQUALS = re.compile(r"name\s*=\s*'((?:[^'\\]|\\.)*)'")
+_NAME_CONTAINS = re.compile(r"name\s+contains\s+'((?:[^'\\]|\\.)*)'")
+
+class _Request:
+    def __init__(self, drive, fn):
+        self._drive = drive
+        self._fn = fn
+
+    def execute(self, num_retries=0, http=None):
+        self._drive.calls_made(1)
+        return self._fn()
+
+class _MediaRequest:
+    """What MediaIoBaseDownload needs from a get_media request: uri, headers and http."""
+
+    def __init__(self, drive, file_id):
+        self.uri = f'fake-drive://{file_id}'
+        self.headers = {}
+        self.http = _Http(drive, file_id)
+
+class _Http:
+    def __init__(self, drive, file_id):
+        self._drive = drive
+        self._file_id = file_id
+
+    def request(self, uri, method='GET', headers=None, **kwargs):
+        self._drive.calls_made(1)
+        path = self._drive._content_path(self._file_id)
+        if not os.path.exists(path):
+            return httplib2.Response({'status': 404}), b''
+        size = os.path.getsize(path)
+        first, last = 0, size - 1
+        match = re.match(r'bytes=(\d+)-(\d+)', (headers or {}).get('range', ''))
+        if match:
+            first, last = int(match.group(1)), min(int(match.group(2)), size - 1)
+        if size == 0:
+            return httplib2.Response({'status': 200, 'content-length': '0'}), b''
+        with open(path, 'rb') as f:
+            f.seek(first)
+            content = f.read(last - first + 1)
+        self._drive.bytes_down(len(content))
+        return httplib2.Response({'status': 206, 'content-range': f'bytes {first}-{last}/{size}'}), content
+
+class _Batch:
+    def __init__(self, drive, callback):
+        self._drive = drive
+        self._callback = callback
+        self._requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        self._requests.append((request_id or str(len(self._requests)), request, callback or self._callback))
+
+    def execute(self, http=None):
+        # One round trip for the whole batch, as on the real API.
+        self._drive.calls_made(1)
+        for request_id, request, callback in self._requests:
+            try:
+                response, error = request._fn(), None
+            except Exception as e:
+                response, error = None, e
+            if callback is not None:
+                callback(request_id, response, error)
+
+class _Files:
+    def __init__(self, drive):
+        self._drive = drive
+
+    def list(self, q='', pageSize=None, pageToken=None, **kwargs):
+        return _Request(self._drive, lambda: {'files': self._drive.find(q)})
+
+    def create(self, body=None, media_body=None, fields=None, **kwargs):
+        return _Request(self._drive, lambda: {'id': self._drive.store(body or {}, media_body)})
+
+    def update(self, fileId, body=None, **kwargs):
+        return _Request(self._drive, lambda: self._drive.update(fileId, body or {}))
+
+    def delete(self, fileId, **kwargs):
+        return _Request(self._drive, lambda: self._drive.delete(fileId))
+
+    def get_media(self, fileId, **kwargs):
+        return _MediaRequest(self._drive, fileId)
+
+class FakeDrive:
+    def __init__(self, root=None, latency_ms=None):
+        self.root = root or os.getenv('FAKE_DRIVE_DIR') or DEFAULT_ROOT
+        self.latency = float(os.getenv('FAKE_DRIVE_LATENCY_MS', '0') if latency_ms is None else latency_ms) / 1000
+        os.makedirs(self.root, exist_ok=True)
+        self._lock = threading.Lock()
+        self.stats = {'calls': 0, 'bytes_up': 0, 'bytes_down': 0}
+
+    def calls_made(self, n):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.stats['calls'] += n
+
+    def bytes_down(self, n):
+        with self._lock:
+            self.stats['bytes_down'] += n
+
+    def _content_path(self, file_id):
+        return os.path.join(self.root, file_id)
+
+    def _meta_path(self, file_id):
+        return os.path.join(self.root, file_id + '.json')
+
+    def _write_meta(self, file_id, meta):
+        tmp = self._meta_path(file_id) + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, self._meta_path(file_id))
+
+    def _read_meta(self, file_id):
+        try:
+            with open(self._meta_path(file_id)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def files(self):
+        return _Files(self)
+
+    def new_batch_http_request(self, callback=None):
+        return _Batch(self, callback)
+
+    def find(self, q):
+        names = set(_NAME_EQUALS.findall(q))
+        contains = _NAME_CONTAINS.findall(q)
+        found = []
+        for entry in sorted(os.listdir(self.root)):
+            if not entry.endswith('.json'):
+                continue
+            file_id = entry[:-5]
+            meta = self._read_meta(file_id)
+            if meta is None:
+                continue
+            if names and meta['name'] not in names:
+                continue
+            if contains and not any(c in meta['name'] for c in contains):
+                continue
+            found.append({'id': file_id, 'name': meta['name'], 'appProperties': meta.get('appProperties', {}),
+                          'createdTime': meta.get('createdTime', '')})
+        return found
+
+    def store(self, body, media):
+        file_id = uuid.uuid4().hex
+        tmp = self._content_path(file_id) + '.tmp'
+        written = 0
+        with open(tmp, 'wb') as f:
+            if media is not None:
+                # Read the upload chunk by chunk, as the resumable protocol would.
+                while True:
+                    data = media.getbytes(written, media.chunksize())
+                    f.write(data)
+                    written += len(data)
+                    size = media.size()
+                    if size is not None and written >= size:
+                        break
+                    self.calls_made(1)
+        os.replace(tmp, self._content_path(file_id))
+        with self._lock:
+            self.stats['bytes_up'] += written
+        created = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime()) + f'.{time.time_ns() // 1000 % 1000000:06d}Z'
+        self._write_meta(file_id, {'name': body.get('name'), 'appProperties': body.get('appProperties') or {},
+                                   'createdTime': created})
+        return file_id
+
+    def update(self, file_id, body):
+        meta = self._read_meta(file_id)
+        if meta is None:
+            raise KeyError(f'no such file: {file_id}')
+        meta.update({k: v for k, v in body.items() if k in ('name', 'appProperties')})
+        self._write_meta(file_id, meta)
+        return {'id': file_id}
+
+    def delete(self, file_id):
+        if self._read_meta(file_id) is None:
+            raise KeyError(f'no such file: {file_id}')
+        os.remove(self._meta_path(file_id))
+        os.remove(self._content_path(file_id))
+        return {}
+
+    def usage(self):
+        """Files and bytes stored."""
+        files = [e for e in os.listdir(self.root) if not e.endswith(('.json', '.tmp'))]
+        return {'files': len(files), 'bytes': sum(os.path.getsize(os.path.join(self.root, e)) for e in files)}
+
+def install(root=None, latency_ms=None):
+    """Make drive_utils talk to a FakeDrive. Returns it."""
+    import drive_utils
+    drive = FakeDrive(root, latency_ms)
+    drive_utils.build_drive_service = lambda: drive
+    drive_utils.invalidate_drive_cache()
+    return drive
@@ -0,0 +1,6 @@
+"""gunicorn entry point for the benchmarks: the app, with Drive replaced by fake_drive."""
+import fake_drive
+
+fake_drive.install()
+
+from app import app  # noqa: E402
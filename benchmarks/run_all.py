@@ -0,0 +1,110 @@
+"""Run the benchmark suite and write one JSON report, optionally compared with an earlier one.
+
+Each benchmark runs as its own process with the arguments below (--quick makes every run
+short, for a smoke test). The report holds the environment and each benchmark's results.
+With --baseline, every throughput (*_per_sec) and latency or duration (*_ms but max_ms, seconds) found
+at the same place in both reports is compared; changes for the worse beyond --threshold are
+listed and the exit status is 1:
+
+    python benchmarks/run_all.py --output run.json
+    python benchmarks/run_all.py --baseline run.json --output new.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import BENCH_DIR, REPO_DIR, environment_info, write_results
+
+# name: (script, arguments, quick arguments)
+SUITES = {
+    'query': ('bench_query.py', ['--concurrency', '1,8,32', '--seconds', '5'],
+              ['--concurrency', '1,4', '--seconds', '1', '--rows', '1000']),
+    'backup': ('bench_backup.py', ['--sizes', '10MB,100MB,1GB'], ['--sizes', '10MB']),
+    'bulk': ('bench_bulk.py', [], ['--rows', '20000', '--baseline-rows', '2000']),
+    'startup': ('bench_startup.py', [], ['--workers', '1,2']),
+    'auth': ('bench_auth.py', [], ['--seconds', '1']),
+    'serving': ('bench_serving.py', [], ['--threads', '4', '--seconds', '1', '--idle', '20']),
+    'profiles': ('bench_profiles.py', [], ['--seconds', '1', '--rows', '10000']),
+}
+
+def run_suite(name, quick, timeout):
+    script, args, quick_args = SUITES[name]
+    fd, output = tempfile.mkstemp(prefix=f'bench-{name}-', suffix='.json')
+    os.close(fd)
+    try:
+        proc = subprocess.run([sys.executable, os.path.join(BENCH_DIR, script), *(quick_args if quick else args),
+                               '--output', output], cwd=REPO_DIR, capture_output=True, text=True, timeout=timeout)
+        if proc.returncode != 0:
+            return {'error': proc.stderr[-4000:] or f'exit status {proc.returncode}'}
+        with open(output) as f:
+            return json.load(f)
+    except subprocess.TimeoutExpired:
+        return {'error': f'timed out after {timeout}s'}
+    finally:
+        os.remove(output)
+
+def direction(key):
+    """1 when a larger value is better, -1 when smaller is, None when the key is not compared."""
+    if key.endswith('per_sec'):
+        return 1
+    # max_ms is one sample, too noisy to compare.
+    if (key.endswith('_ms') and key != 'max_ms') or key == 'seconds':
+        return -1
+    return None
+
+def numbers(tree, path=()):
+    if isinstance(tree, dict):
+        for key, value in tree.items():
+            if key != 'environment':
+                yield from numbers(value, path + (str(key),))
+    elif isinstance(tree, (int, float)) and not isinstance(tree, bool) and path:
+        yield path, tree
+
+def compare(baseline, current, threshold):
+    """Regressions beyond threshold (a fraction), worst first."""
+    old = dict(numbers(baseline.get('suites', {})))
+    found = []
+    for path, value in numbers(current.get('suites', {})):
+        sign = direction(path[-1])
+        before = old.get(path)
+        if sign is None or not before:
+            continue
+        change = (value - before) / before
+        if change * sign < -threshold:
+            found.append({'metric': '.'.join(path), 'baseline': before, 'current': value,
+                          'change_pct': round(change * 100, 1)})
+    found.sort(key=lambda r: -abs(r['change_pct']))
+    return found
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--suites', default=','.join(SUITES))
+    parser.add_argument('--quick', action='store_true')
+    parser.add_argument('--timeout', type=float, default=7200, help='seconds allowed per benchmark')
+    parser.add_argument('--baseline')
+    parser.add_argument('--threshold', type=float, default=0.2, help='fraction; 0.2 flags changes worse than 20%%')
+    parser.add_argument('--output')
+    args = parser.parse_args()
+    report = {'environment': environment_info(), 'quick': args.quick, 'suites': {}}
+    for name in args.suites.split(','):
+        print(f'Running {name}...', file=sys.stderr)
+        report['suites'][name] = run_suite(name, args.quick, args.timeout)
+    failed = [name for name, result in report['suites'].items() if 'error' in result]
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        report['baseline'] = {'commit': baseline.get('environment', {}).get('commit'), 'threshold': args.threshold}
+        report['regressions'] = compare(baseline, report, args.threshold)
+    write_results(report, args.output)
+    for name in failed:
+        print(f'{name} failed: {report["suites"][name]["error"]}', file=sys.stderr)
+    for r in report.get('regressions', []):
+        print(f"Regression: {r['metric']} {r['baseline']} -> {r['current']} ({r['change_pct']:+}%)", file=sys.stderr)
+    sys.exit(1 if failed or report.get('regressions') else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,308 @@
+import base64
+import csv
+import io
+import json
+import os
+import queue
+import sqlite3
+import tempfile
+import threading
+from itertools import islice
+
+# Rows per executemany call during an import; the whole import is still one transaction.
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', '10000'))
+# Page cache used while a fast import runs, in KiB (the connection default is 64 MB).
+IMPORT_CACHE_KB = int(os.getenv('IMPORT_CACHE_KB', str(256 * 1024)))
+# Bytes read from the request body at a time during an import.
+READ_BUFFER_SIZE = 256 * 1024
+# Rows fetched from SQLite per step when exporting.
+EXPORT_FETCH_SIZE = 1000
+
+FORMATS = ('csv', 'ndjson')
+ON_CONFLICT = {'abort': 'INSERT', 'replace': 'INSERT OR REPLACE', 'ignore': 'INSERT OR IGNORE'}
+
+class BulkImportError(ValueError):
+    """A row that cannot be imported; line is its 1-based line in the body."""
+
+    def __init__(self, message, line=None):
+        super().__init__(message)
+        self.line = line
+
+def quote_identifier(name):
+    return '"' + name.replace('"', '""') + '"'
+
+def table_columns(conn, table, views=False):
+    """Column names of table, or None if there is no such table (or view, when views is set)."""
+    kinds = "('table', 'view')" if views else "('table')"
+    row = conn.execute(f"SELECT type FROM sqlite_master WHERE name = ? AND type IN {kinds}", (table,)).fetchone()
+    if row is None:
+        return None
+    return [r[1] for r in conn.execute(f'PRAGMA table_info({quote_identifier(table)})')]
+
+def check_columns(columns, known):
+    if not columns:
+        raise BulkImportError('No columns given', 1)
+    unknown = [c for c in columns if c not in known]
+    if unknown:
+        raise BulkImportError(f"Unknown columns: {', '.join(unknown)}", 1)
+    if len(set(columns)) != len(columns):
+        raise BulkImportError('Columns are repeated', 1)
+    return columns
+
+class _RawReader(io.RawIOBase):
+    # WSGI input only promises read(n); chunked bodies reach us as the server's raw object.
+    def __init__(self, stream):
+        self.stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.stream.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+def text_stream(stream):
+    # The body is decoded as it is read, never held in memory as a whole.
+    return io.TextIOWrapper(io.BufferedReader(_RawReader(stream), READ_BUFFER_SIZE), encoding='utf-8', newline='')
+
+def csv_rows(stream, known, columns=None):
+    """(columns, rows) for a CSV body. The first line names the columns unless columns are given."""
+    reader = csv.reader(text_stream(stream))
+    if columns is None:
+        columns = next(reader, None)
+    columns = check_columns(columns, known)
+
+    def rows():
+        width = len(columns)
+        for row in reader:
+            if len(row) != width:
+                if not row:
+                    continue
+                raise BulkImportError(f'Expected {width} fields, got {len(row)}', reader.line_num)
+            yield row
+    return columns, rows()
+
+def _parse_block(lines, numbers):
+    """json.loads of many lines at once; one call is far cheaper than one per line."""
+    try:
+        return json.loads('[' + ','.join(lines) + ']')
+    except ValueError:
+        # Parse line by line only to find the one at fault.
+        for number, line in zip(numbers, lines):
+            try:
+                json.loads(line)
+            except ValueError as e:
+                raise BulkImportError(f'Invalid JSON: {e}', number)
+        raise BulkImportError('Invalid JSON', numbers[0])
+
+def _json_blocks(stream, size=IMPORT_BATCH_SIZE):
+    """(line number of each value, values) for the non-blank lines, size lines at a time."""
+    numbers, lines = [], []
+    for number, line in enumerate(text_stream(stream), 1):
+        line = line.strip()
+        if line:
+            numbers.append(number)
+            lines.append(line)
+            if len(lines) >= size:
+                yield numbers, _parse_block(lines, numbers)
+                numbers, lines = [], []
+    if lines:
+        yield numbers, _parse_block(lines, numbers)
+
+def ndjson_rows(stream, known, columns=None):
+    """(columns, rows) for an NDJSON body of objects, or of arrays when columns are given.
+
+    Without columns, the keys of the first object are the columns; later objects may leave
+    some out (they get NULL) but may not add others.
+    """
+    blocks = _json_blocks(stream)
+    first = next(blocks, None)
+    if first is None:
+        return check_columns(columns or [], known), iter(())
+    if columns is None:
+        if not isinstance(first[1][0], dict):
+            raise BulkImportError('Rows must be JSON objects unless columns are given', first[0][0])
+        columns = list(first[1][0])
+    columns = check_columns(columns, known)
+    width = len(columns)
+    allowed = set(columns)
+
+    def convert(number, value):
+        if isinstance(value, dict):
+            if not allowed.issuperset(value):
+                raise BulkImportError(f"Unknown keys: {', '.join(sorted(set(value) - allowed))}", number)
+            return tuple(map(value.get, columns))
+        if isinstance(value, list) and len(value) == width:
+            return value
+        raise BulkImportError(f'Expected an object or an array of {width} values', number)
+
+    def rows():
+        yield from (convert(number, value) for number, value in zip(*first))
+        for numbers, values in blocks:
+            yield from (convert(number, value) for number, value in zip(numbers, values))
+    return columns, rows()
+
+def insert_sql(table, columns, on_conflict='abort'):
+    return (f"{ON_CONFLICT[on_conflict]} INTO {quote_identifier(table)} "
+            f"({', '.join(quote_identifier(c) for c in columns)}) VALUES ({', '.join('?' * len(columns))})")
+
+def batches(rows, size=IMPORT_BATCH_SIZE):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+def prefetch(iterable, depth=2):
+    """Iterate on a background thread, up to depth items ahead.
+
+    An import parses the next batch while SQLite, which releases the GIL, inserts the current one.
+    Exceptions raised by the iterable are raised here.
+    """
+    items = queue.Queue(maxsize=depth)
+    done = object()
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in iterable:
+                if stop.is_set():
+                    return
+                items.put((item, None))
+            items.put((done, None))
+        except BaseException as e:
+            items.put((done, e))
+
+    thread = threading.Thread(target=produce, name='bulk-prefetch', daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        # On an early exit, unblock the producer so it can see stop and end.
+        stop.set()
+        while thread.is_alive():
+            try:
+                items.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+class staged_rows:
+    """Rows of an import written to a temporary SQLite file in directory before any lock is taken.
+
+    A slow client then only holds up its own request: the load reads the rows back with
+    batches() at disk speed. Columns are untyped, so values come back as they were parsed.
+    """
+
+    def __init__(self, rows, width, directory=None):
+        self.rows = rows
+        self.width = width
+        self.directory = directory
+        self.count = 0
+        self.path = None
+        self._conn = None
+
+    def __enter__(self):
+        fd, self.path = tempfile.mkstemp(prefix='import_', suffix='.sqlite', dir=self.directory)
+        os.close(fd)
+        try:
+            self._conn = sqlite3.connect(self.path)
+            # Thrown away after the load, so it need not survive a crash.
+            self._conn.execute('PRAGMA journal_mode = OFF')
+            self._conn.execute('PRAGMA synchronous = OFF')
+            self._conn.execute(f"CREATE TABLE rows ({', '.join(f'c{i}' for i in range(self.width))})")
+            sql = f"INSERT INTO rows VALUES ({', '.join('?' * self.width)})"
+            for batch in prefetch(batches(self.rows)):
+                self._conn.executemany(sql, batch)
+                self.count += len(batch)
+            self._conn.commit()
+        except BaseException:
+            self.__exit__()
+            raise
+        return self
+
+    def batches(self, size=IMPORT_BATCH_SIZE):
+        cur = self._conn.execute('SELECT * FROM rows ORDER BY rowid')
+        while True:
+            batch = cur.fetchmany(size)
+            if not batch:
+                return
+            yield batch
+
+    def __exit__(self, *exc):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+        return False
+
+class fast_load:
+    """Relaxed pragmas for the duration of a load on conn: no fsync and a larger page cache.
+
+    Set outside the load's transaction and put back afterwards, as the connection is pooled.
+    A crash during the load can lose it, but the database file stays consistent under WAL.
+    """
+
+    def __init__(self, conn, enabled=True, cache_kb=IMPORT_CACHE_KB):
+        self.conn = conn
+        self.enabled = enabled
+        self.cache_kb = cache_kb
+        self._saved = None
+
+    def __enter__(self):
+        if self.enabled:
+            self._saved = (self.conn.execute('PRAGMA synchronous').fetchone()[0],
+                           self.conn.execute('PRAGMA cache_size').fetchone()[0])
+            self.conn.execute('PRAGMA synchronous = OFF')
+            self.conn.execute(f'PRAGMA cache_size = {-abs(self.cache_kb)}')
+        return self
+
+    def __exit__(self, *exc):
+        if self._saved is not None:
+            synchronous, cache_size = self._saved
+            try:
+                self.conn.execute(f'PRAGMA synchronous = {int(synchronous)}')
+                self.conn.execute(f'PRAGMA cache_size = {int(cache_size)}')
+            except sqlite3.Error:
+                pass
+        return False
+
+def _blob_to_text(value):
+    # BLOBs are exported as base64 text.
+    return base64.b64encode(value).decode('ascii') if isinstance(value, bytes) else value
+
+def _json_default(value):
+    if isinstance(value, bytes):
+        return _blob_to_text(value)
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+def export_chunks(cur, fmt):
+    """Yield the rows of cur as CSV (with a header line) or NDJSON, EXPORT_FETCH_SIZE at a time."""
+    columns = [d[0] for d in cur.description]
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        writer.writerow(columns)
+        while True:
+            rows = cur.fetchmany(EXPORT_FETCH_SIZE)
+            if not rows:
+                break
+            writer.writerows([_blob_to_text(v) for v in row] for row in rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+        return
+    while True:
+        rows = cur.fetchmany(EXPORT_FETCH_SIZE)
+        if not rows:
+            return
+        yield ''.join(json.dumps(dict(zip(columns, row)), default=_json_default) + '\n' for row in rows)
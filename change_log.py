@@ -0,0 +1,312 @@
+"""Logical change log for point-in-time recovery.
+
+Every write job appends its statements to the _change_log table in the same transaction,
+numbered by a log sequence number (LSN). Backups move those rows into segment files under
+backups/changes (compressed on the way to Drive), and only take a full base backup every
+CHANGE_LOG_BASE_INTERVAL seconds. Restoring to a time picks the newest base that contains
+no later change and replays the logged statements up to that time.
+
+A restore starts a new timeline, so the history it abandoned is still there for restores
+to earlier times. Statements are replayed as written: anything that depends on the clock
+or on randomness (CURRENT_TIMESTAMP, random()) gets a new value on replay.
+"""
+import json
+import os
+import re
+import shutil
+import sqlite3
+import time
+from db_manager import BACKUP_DIR, MAX_BACKUPS, load_manifest, restore_from_manifest
+from db_pool import read_connection, write_connection
+from utils import log_info, log_error, write_lock
+
+CHANGE_LOG_ENABLED = os.getenv('CHANGE_LOG', '').lower() in ('1', 'true', 'yes')
+# With the log on, a base backup is taken this often; in between only new changes are shipped.
+CHANGE_LOG_BASE_INTERVAL = float(os.getenv('CHANGE_LOG_BASE_INTERVAL', '3600'))
+SEGMENT_DIR = os.path.join(BACKUP_DIR, 'changes')
+SEGMENT_PREFIX = 'changes_'
+_SEGMENT_NAME = re.compile(r'^changes_(\d+)_(\d+)_(\d+)\.jsonl$')
+
+def ensure_tables(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS _change_log (
+            lsn INTEGER PRIMARY KEY,
+            ts REAL NOT NULL,
+            statements TEXT NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS _change_log_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            timeline INTEGER NOT NULL,
+            timeline_start REAL NOT NULL,
+            lsn INTEGER NOT NULL,
+            lsn_ts REAL,
+            needs_base INTEGER NOT NULL
+        )
+    ''')
+    # The first backup after the log is switched on is a base.
+    conn.execute('INSERT OR IGNORE INTO _change_log_state VALUES (1, 1, 0, 0, NULL, 1)')
+
+def read_state(conn):
+    try:
+        row = conn.execute('SELECT timeline, timeline_start, lsn, lsn_ts, needs_base FROM _change_log_state WHERE id = 1').fetchone()
+    except sqlite3.OperationalError:
+        return None
+    if row is None:
+        return None
+    return {'timeline': row[0], 'timeline_start': row[1], 'lsn': row[2], 'lsn_ts': row[3] or 0.0, 'needs_base': bool(row[4])}
+
+def record(conn, statements):
+    """Log a write job's [(sql, params, many), ...]; call inside the job's transaction."""
+    ts = time.time()
+    conn.execute('UPDATE _change_log_state SET lsn = lsn + 1, lsn_ts = ? WHERE id = 1', (ts,))
+    conn.execute('INSERT INTO _change_log (lsn, ts, statements) SELECT lsn, ?, ? FROM _change_log_state WHERE id = 1',
+                 (ts, json.dumps([list(s) for s in statements])))
+
+def segment_name(timeline, first, last):
+    return f"{SEGMENT_PREFIX}{timeline:04d}_{first:012d}_{last:012d}.jsonl"
+
+def parse_segment_name(name):
+    m = _SEGMENT_NAME.match(name)
+    return tuple(int(g) for g in m.groups()) if m else None
+
+def ship(db_path):
+    """Move logged changes from the database into a local segment file. Returns its name or None."""
+    with write_lock(), write_connection(db_path) as conn:
+        state = read_state(conn)
+        rows = conn.execute('SELECT lsn, ts, statements FROM _change_log ORDER BY lsn').fetchall() if state else []
+        if not rows:
+            return None
+        os.makedirs(SEGMENT_DIR, exist_ok=True)
+        name = segment_name(state['timeline'], rows[0][0], rows[-1][0])
+        tmp_path = os.path.join(SEGMENT_DIR, name + '.tmp')
+        with open(tmp_path, 'w') as f:
+            for lsn, ts, statements in rows:
+                f.write(json.dumps({'lsn': lsn, 'ts': ts, 'statements': json.loads(statements)}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, os.path.join(SEGMENT_DIR, name))
+        # The rows only leave the database once the segment is safely on disk.
+        conn.execute('DELETE FROM _change_log WHERE lsn <= ?', (rows[-1][0],))
+        conn.commit()
+    log_info(f"Shipped {len(rows)} changes to {name}")
+    return name
+
+def _base_state(kind, path):
+    if kind == 'manifest':
+        manifest = load_manifest(path)
+        return manifest.get('change_log') if manifest else None
+    try:
+        # immutable: read the copy as it is, without locks or a WAL index.
+        conn = sqlite3.connect(f"file:{path}?mode=ro&immutable=1", uri=True)
+        try:
+            return read_state(conn)
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+
+def local_bases():
+    """Local backups as [{'kind', 'path', 'time', 'state'}], newest first."""
+    bases = []
+    for i in range(1, MAX_BACKUPS + 1):
+        manifest_path = os.path.join(BACKUP_DIR, f"manifest_{i}.json")
+        manifest = load_manifest(manifest_path)
+        if manifest:
+            bases.append({'kind': 'manifest', 'path': manifest_path, 'time': manifest['created']})
+        full_path = os.path.join(BACKUP_DIR, f"db_{i}.sqlite")
+        if os.path.exists(full_path):
+            bases.append({'kind': 'full', 'path': full_path, 'time': os.path.getmtime(full_path)})
+    for base in bases:
+        base['state'] = _base_state(base['kind'], base['path'])
+    bases.sort(key=lambda b: b['time'], reverse=True)
+    return bases
+
+def base_due(db_path):
+    with read_connection(db_path) as conn:
+        state = read_state(conn)
+    if state is None or state['needs_base']:
+        return True
+    bases = local_bases()
+    return not bases or time.time() - bases[0]['time'] >= CHANGE_LOG_BASE_INTERVAL
+
+def start_base(db_path):
+    """Clear the needs_base flag before the base backup is taken, so the base has it cleared."""
+    with write_lock(), write_connection(db_path) as conn:
+        conn.execute('UPDATE _change_log_state SET needs_base = 0 WHERE id = 1 AND needs_base != 0')
+        conn.commit()
+
+def request_base(db_path):
+    """Set the needs_base flag again, after the base backup start_base() cleared it for failed."""
+    with write_lock(), write_connection(db_path) as conn:
+        conn.execute('UPDATE _change_log_state SET needs_base = 1 WHERE id = 1')
+        conn.commit()
+
+def current_state(db_path):
+    with read_connection(db_path) as conn:
+        return read_state(conn)
+
+def _prunable(name, oldest):
+    """Segments no retained base can need: older timelines, and changes the oldest base has."""
+    parsed = parse_segment_name(name)
+    if parsed is None or oldest is None:
+        return False
+    timeline, _, last = parsed
+    return timeline < oldest['timeline'] or (timeline == oldest['timeline'] and last <= oldest['lsn'])
+
+def _oldest_base_state():
+    bases = [b for b in local_bases() if b['state']]
+    return bases[-1]['state'] if len(bases) >= MAX_BACKUPS else None
+
+def upload_segments():
+    """Upload local segments Drive does not have yet, and drop segments no base needs any more."""
+    from drive_utils import get_drive_service, list_drive_files, upload_to_drive, execute_batch, invalidate_drive_cache, _cache_file_id
+    local = sorted(_local_segments())
+    oldest = _oldest_base_state()
+    for name in local:
+        if _prunable(name, oldest):
+            os.remove(os.path.join(SEGMENT_DIR, name))
+    service = get_drive_service()
+    try:
+        # Listed afresh: other workers ship and prune segments too.
+        on_drive = {f['name']: f['id'] for f in list_drive_files(service, SEGMENT_PREFIX, fresh=True)}
+        uploaded = 0
+        for name in local:
+            if name not in on_drive and not _prunable(name, oldest):
+                upload_to_drive(service, os.path.join(SEGMENT_DIR, name), name)
+                uploaded += 1
+        stale = [name for name in on_drive if _prunable(name, oldest)]
+        execute_batch(service, [service.files().delete(fileId=on_drive[name]) for name in stale])
+        for name in stale:
+            _cache_file_id(name, None)
+        if uploaded or stale:
+            log_info(f"☁️ Uploaded {uploaded} change segments, deleted {len(stale)} old ones.")
+    except Exception:
+        invalidate_drive_cache()
+        raise
+
+def _drive_segments():
+    from drive_utils import get_drive_service, list_drive_files
+    try:
+        return {f['name']: f['id'] for f in list_drive_files(get_drive_service(), SEGMENT_PREFIX, fresh=True)}
+    except Exception as e:
+        log_error(f"Could not list change segments on Drive, using local ones only: {e}")
+        return {}
+
+def _local_segments():
+    return {n for n in os.listdir(SEGMENT_DIR) if parse_segment_name(n)} if os.path.isdir(SEGMENT_DIR) else set()
+
+def _start_timeline(conn, known_timelines, lsn=None, lsn_ts=None):
+    state = read_state(conn)
+    timeline = max(list(known_timelines) + [state['timeline']]) + 1
+    conn.execute('DELETE FROM _change_log')
+    conn.execute('UPDATE _change_log_state SET timeline = ?, timeline_start = ?, lsn = COALESCE(?, lsn), '
+                 'lsn_ts = COALESCE(?, lsn_ts), needs_base = 1 WHERE id = 1', (timeline, time.time(), lsn, lsn_ts))
+    return timeline
+
+def check_timeline(conn):
+    """Move to a new timeline if this database is behind changes already shipped for its own.
+
+    That happens when it was replaced by an older copy (a restore, or a fresh host pulling the
+    last backup); carrying on would hand out LSNs the log already uses. Commits if it moves.
+    """
+    state = read_state(conn)
+    names = _local_segments() | set(_drive_segments())
+    parsed = [parse_segment_name(n) for n in names]
+    if any(p[0] == state['timeline'] and p[2] > state['lsn'] for p in parsed):
+        known_timelines = [p[0] for p in parsed] + [b['state']['timeline'] for b in local_bases() if b['state']]
+        timeline = _start_timeline(conn, known_timelines)
+        conn.commit()
+        log_info(f"Database is behind its change log; continuing on timeline {timeline}.")
+
+def _segment_entries(timeline, after_lsn):
+    """Logged changes of a timeline after an LSN, from local segments and any only on Drive."""
+    names = _local_segments()
+    missing = {n: i for n, i in _drive_segments().items() if n not in names}
+    if missing:
+        from drive_utils import get_drive_service, download_drive_file
+        service = get_drive_service()
+        os.makedirs(SEGMENT_DIR, exist_ok=True)
+        for name, file_id in missing.items():
+            seg_timeline, _, last = parse_segment_name(name)
+            if seg_timeline == timeline and last > after_lsn:
+                tmp_path = os.path.join(SEGMENT_DIR, name + '.tmp')
+                with open(tmp_path, 'wb') as out:
+                    download_drive_file(service, file_id, out)
+                os.replace(tmp_path, os.path.join(SEGMENT_DIR, name))
+                names.add(name)
+    entries = {}
+    for name in names:
+        seg_timeline, _, last = parse_segment_name(name)
+        if seg_timeline != timeline or last <= after_lsn:
+            continue
+        with open(os.path.join(SEGMENT_DIR, name)) as f:
+            for line in f:
+                entry = json.loads(line)
+                if entry['lsn'] > after_lsn:
+                    entries[entry['lsn']] = entry
+    return entries
+
+def _materialize(base, path):
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    if base['kind'] == 'manifest':
+        return restore_from_manifest(load_manifest(base['path']), path)
+    shutil.copy2(base['path'], path)
+    return True
+
+def restore_to(db_path, target_ts, staging_path):
+    """Rebuild the database as of target_ts into staging_path.
+
+    Returns a summary dict, or None if no base backup is old enough. Raises ValueError when
+    the log has a gap. Call with the write lock held, so the unshipped rows read here are final.
+    """
+    candidates = [b for b in local_bases() if b['state']
+                  and b['state']['timeline_start'] <= target_ts and b['state']['lsn_ts'] <= target_ts]
+    if not candidates:
+        return None
+    # The latest timeline wins: it is the history that was current at target_ts.
+    base = max(candidates, key=lambda b: (b['state']['timeline'], b['state']['lsn']))
+    state = base['state']
+    entries = _segment_entries(state['timeline'], state['lsn'])
+    with read_connection(db_path) as conn:
+        live = read_state(conn)
+        if live and live['timeline'] == state['timeline']:
+            for lsn, ts, statements in conn.execute('SELECT lsn, ts, statements FROM _change_log WHERE lsn > ?', (state['lsn'],)):
+                entries[lsn] = {'lsn': lsn, 'ts': ts, 'statements': json.loads(statements)}
+    known_timelines = [live['timeline'] if live else 0] + [parse_segment_name(n)[0] for n in _local_segments()]
+    known_timelines += [b['state']['timeline'] for b in local_bases() if b['state']]
+
+    if not _materialize(base, staging_path):
+        raise ValueError(f"Base backup {os.path.basename(base['path'])} could not be restored")
+    conn = sqlite3.connect(staging_path)
+    try:
+        lsn, lsn_ts, replayed = state['lsn'], state['lsn_ts'], 0
+        conn.execute('BEGIN')
+        while lsn + 1 in entries and entries[lsn + 1]['ts'] <= target_ts:
+            entry = entries[lsn + 1]
+            for sql, params, many in entry['statements']:
+                if many:
+                    conn.executemany(sql, params)
+                else:
+                    conn.execute(sql, params)
+            lsn, lsn_ts = entry['lsn'], entry['ts']
+            replayed += 1
+        later = [n for n in entries if n > lsn + 1]
+        if lsn + 1 not in entries and later:
+            raise ValueError(f"Change log has a gap after LSN {lsn}")
+        # The restored database continues on a new timeline and needs a base of its own.
+        timeline = _start_timeline(conn, known_timelines, lsn, lsn_ts)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        conn.close()
+        os.remove(staging_path)
+        raise
+    conn.close()
+    log_info(f"Rebuilt DB as of {time.ctime(target_ts)} from {os.path.basename(base['path'])} "
+             f"plus {replayed} changes (LSN {lsn}), now on timeline {timeline}.")
+    return {'base': os.path.basename(base['path']), 'replayed': replayed, 'lsn': lsn,
+            'restored_to': lsn_ts, 'timeline': timeline}
@@ -0,0 +1,136 @@
+import os
+import sqlite3
+import threading
+import time
+from utils import log_info, log_error
+from tuning import PROFILE
+
+# How often the -wal files of recently written databases are looked at.
+WAL_CHECK_SECONDS = float(os.getenv('WAL_CHECK_SECONDS', '5'))
+# A -wal file over this many bytes is checkpointed, then cut back to nothing when no reader needs it.
+WAL_CHECKPOINT_BYTES = int(os.getenv('WAL_CHECKPOINT_BYTES', str(PROFILE['wal_checkpoint_bytes'])))
+# How long the truncating checkpoint may wait for readers; writers wait on it meanwhile.
+WAL_TRUNCATE_TIMEOUT = float(os.getenv('WAL_TRUNCATE_TIMEOUT', '0.5'))
+# A database nobody wrote to for this long is no longer watched.
+WAL_IDLE_SECONDS = 300
+
+def wal_size(db_path):
+    try:
+        return os.path.getsize(db_path + '-wal')
+    except OSError:
+        return 0
+
+class CheckpointManager:
+    """Keeps -wal files bounded under sustained writes.
+
+    SQLite's auto-checkpoint runs inside a commit and gives up whenever a reader is still on
+    an older snapshot, so with steady reads the -wal file only grows. Writers call
+    note_write(db_path); a thread per process then checks the databases written to. A -wal
+    file over max_bytes gets a PASSIVE checkpoint, which never blocks anyone, and once every
+    frame is in the database a TRUNCATE checkpoint resets the file, waiting at most
+    truncate_timeout for readers to move on.
+    """
+
+    def __init__(self, max_bytes=WAL_CHECKPOINT_BYTES, interval=WAL_CHECK_SECONDS, truncate_timeout=WAL_TRUNCATE_TIMEOUT):
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.truncate_timeout = truncate_timeout
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        # db_path -> time of the last write noted
+        self._written = {}
+        self._checks = 0
+        self._checkpoints = 0
+        self._truncations = 0
+        self._busy = 0
+        self._failures = 0
+        self._largest_wal = 0
+        self._last_wal = {}
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def note_write(self, db_path):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._written[db_path] = time.monotonic()
+        self._ensure_thread()
+
+    def _ensure_thread(self):
+        # Threads do not survive a fork, so a gunicorn worker starts its own on first use.
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='wal-checkpointer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                paths = list(self._written.items())
+            for db_path, last_write in paths:
+                try:
+                    size = self.check(db_path)
+                except Exception as e:
+                    with self._lock:
+                        self._failures += 1
+                    log_error(f"WAL checkpoint of {db_path} failed: {e}")
+                    continue
+                if size <= self.max_bytes and time.monotonic() - last_write > WAL_IDLE_SECONDS:
+                    with self._lock:
+                        if self._written.get(db_path) == last_write:
+                            del self._written[db_path]
+                            self._last_wal.pop(db_path, None)
+
+    def check(self, db_path):
+        """Checkpoint db_path if its -wal file is over max_bytes. Returns the -wal size after."""
+        size = wal_size(db_path)
+        with self._lock:
+            self._checks += 1
+            self._largest_wal = max(self._largest_wal, size)
+        if size <= self.max_bytes or not os.path.exists(db_path):
+            with self._lock:
+                self._last_wal[db_path] = size
+            return size
+        conn = sqlite3.connect(db_path, timeout=self.truncate_timeout)
+        try:
+            busy, frames, done = conn.execute('PRAGMA wal_checkpoint(PASSIVE);').fetchone()
+            with self._lock:
+                self._checkpoints += 1
+            truncated = False
+            if not busy and frames == done:
+                # Every frame is in the database: start the -wal file over, unless readers hold it.
+                busy = conn.execute('PRAGMA wal_checkpoint(TRUNCATE);').fetchone()[0]
+                truncated = not busy
+            after = wal_size(db_path)
+            with self._lock:
+                self._last_wal[db_path] = after
+                if truncated:
+                    self._truncations += 1
+                else:
+                    self._busy += 1
+            if truncated:
+                log_info(f"WAL checkpoint: {os.path.basename(db_path)}-wal {size} -> {after} bytes.")
+            return after
+        finally:
+            conn.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'max_bytes': self.max_bytes,
+                'interval_seconds': self.interval,
+                'watched': len(self._written) if self._pid == os.getpid() else 0,
+                'checks': self._checks,
+                'checkpoints': self._checkpoints,
+                'truncations': self._truncations,
+                'busy': self._busy,
+                'failures': self._failures,
+                'largest_wal_bytes': self._largest_wal,
+                'wal_bytes': dict(self._last_wal),
+            }
@@ -1,15 +1,42 @@
 import os
 import sqlite3
 import shutil
+import json
+import hashlib
+import time
+import threading
+from collections import OrderedDict
 from utils import log_info, log_error
 import platform
 
-tmp_PATH = os.path.join(os.path.dirname(__file__), 'temp') if platform.system() == 'Windows' else '/tmp/Drive_temp'
+tmp_PATH = os.getenv('RUNTIME_DIR') or (os.path.join(os.path.dirname(__file__), 'temp') if platform.system() == 'Windows' else '/tmp/Drive_temp')
 
 BACKUP_DIR = os.path.join(tmp_PATH,"backups")
 MAX_BACKUPS = 3
+# 'full' keeps whole-file copies, 'incremental' keeps a manifest of chunk hashes plus a chunk store.
+BACKUP_MODE = os.getenv('BACKUP_MODE', 'full')
+# Multiple of the SQLite page size so a changed page only ever dirties one chunk.
+CHUNK_SIZE = int(os.getenv('BACKUP_CHUNK_SIZE', str(4 * 1024 * 1024)))
+CHUNK_DIR = os.path.join(BACKUP_DIR, 'chunks')
+# Snapshots use SQLite's online backup API ('backup') or VACUUM INTO ('vacuum').
+SNAPSHOT_METHOD = os.getenv('SNAPSHOT_METHOD', 'backup')
+SNAPSHOT_PAGES_PER_STEP = int(os.getenv('SNAPSHOT_PAGES_PER_STEP', '1024'))
+SNAPSHOT_STEP_SLEEP = float(os.getenv('SNAPSHOT_STEP_SLEEP', '0.005'))
+# A stepped copy restarts whenever another connection writes; after this many restarts copy in one step.
+SNAPSHOT_MAX_RESTARTS = 3
+PENDING_SNAPSHOT = os.path.join(BACKUP_DIR, "db_pending.sqlite")
 os.makedirs(BACKUP_DIR,exist_ok=True)
 
+# Login table of the default database and of every tenant database.
+JWT_LOGIN_DDL = '''
+    CREATE TABLE IF NOT EXISTS jwt_login (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT NOT NULL UNIQUE,
+        password TEXT NOT NULL,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
 def db_exists(db_path):
     return os.path.exists(db_path)
 
@@ -36,31 +63,211 @@ def validate_sqlite_db(path, required_tables=['jwt_login']):
         if 'conn' in locals():
             conn.close()
 
-def rotate_local_backups(db_path):
-    os.makedirs(BACKUP_DIR, exist_ok=True)
-    oldest = os.path.join(BACKUP_DIR, f"db_{MAX_BACKUPS}.sqlite")
-    if os.path.exists(oldest):
-        os.remove(oldest)
+class _SnapshotRestarted(Exception):
+    pass
+
+def _copy_with_backup_api(src, tmp_path, pages, sleep):
+    restarts = [0]
+    last_remaining = [None]
+
+    def progress(status, remaining, total):
+        if last_remaining[0] is not None and remaining > last_remaining[0]:
+            restarts[0] += 1
+            if restarts[0] > SNAPSHOT_MAX_RESTARTS:
+                raise _SnapshotRestarted()
+        last_remaining[0] = remaining
+
+    dst = sqlite3.connect(tmp_path)
+    try:
+        try:
+            src.backup(dst, pages=pages, sleep=sleep, progress=progress)
+        except _SnapshotRestarted:
+            # Writers keep invalidating the stepped copy; one step holds a single read
+            # transaction, which in WAL mode does not block them.
+            log_info("Snapshot kept restarting under writes, copying in a single step.")
+            src.backup(dst, pages=-1)
+    finally:
+        dst.close()
+
+def snapshot_db(db_path, dest_path, pages=SNAPSHOT_PAGES_PER_STEP, sleep=SNAPSHOT_STEP_SLEEP, method=SNAPSHOT_METHOD):
+    """Write a consistent copy of the live database (WAL contents included) to dest_path."""
+    tmp_path = dest_path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    src = sqlite3.connect(db_path, timeout=10)
+    try:
+        # PASSIVE never waits on readers or writers; it just keeps the WAL from growing.
+        src.execute('PRAGMA wal_checkpoint(PASSIVE);')
+        if method == 'vacuum':
+            src.execute('VACUUM INTO ?', (tmp_path,))
+        else:
+            _copy_with_backup_api(src, tmp_path, pages, sleep)
+    finally:
+        src.close()
+    os.replace(tmp_path, dest_path)
+    return dest_path
+
+def rotate_local_backups(db_path, snapshot_path=None, backup_dir=BACKUP_DIR):
+    os.makedirs(backup_dir, exist_ok=True)
+    if snapshot_path is None:
+        snapshot_path = snapshot_db(db_path, os.path.join(backup_dir, "db_pending.sqlite"))
+    # Older backups only move down a slot, so renaming is enough.
     for i in reversed(range(1, MAX_BACKUPS)):
-        src = os.path.join(BACKUP_DIR, f"db_{i}.sqlite")
-        dst = os.path.join(BACKUP_DIR, f"db_{i+1}.sqlite")
+        src = os.path.join(backup_dir, f"db_{i}.sqlite")
         if os.path.exists(src):
-            shutil.copy2(src, dst)
-    # Copy current db as db_1
-    shutil.copy2(db_path, os.path.join(BACKUP_DIR, "db_1.sqlite"))
+            os.replace(src, os.path.join(backup_dir, f"db_{i+1}.sqlite"))
+    os.replace(snapshot_path, os.path.join(backup_dir, "db_1.sqlite"))
     log_info("Local backup rotation complete.")
 
-def restore_from_backup(db_path):
-    # Try to restore from the most recent backup
+def replace_db_file(src, db_path):
+    """Move a complete database file into place, dropping WAL state that belongs to the old file."""
+    for suffix in ('-wal', '-shm'):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    os.replace(src, db_path)
+
+def _restore_from_full_copies(db_path):
     for i in range(1, MAX_BACKUPS+1):
         backup = os.path.join(BACKUP_DIR, f"db_{i}.sqlite")
         if os.path.exists(backup):
-            shutil.copy2(backup, db_path)
+            tmp_path = db_path + '.restore'
+            shutil.copy2(backup, tmp_path)
+            replace_db_file(tmp_path, db_path)
             log_info(f"Restored DB from backup: {backup}")
             return True
+    return False
+
+def _restore_from_manifests(db_path):
+    for i in range(1, MAX_BACKUPS+1):
+        manifest = load_manifest(os.path.join(BACKUP_DIR, f"manifest_{i}.json"))
+        if manifest and restore_from_manifest(manifest, db_path):
+            log_info(f"Restored DB from incremental backup manifest_{i}.json")
+            return True
+    return False
+
+def restore_from_backup(db_path):
+    # Try to restore from the most recent backup, preferring the format currently being written
+    restorers = [_restore_from_full_copies, _restore_from_manifests]
+    if BACKUP_MODE == 'incremental':
+        restorers.reverse()
+    for restore in restorers:
+        if restore(db_path):
+            return True
     log_error("No valid backup found to restore.")
     return False
 
+def checkpoint_wal(db_path):
+    """Fold the -wal file into the main file so reading the file directly sees every commit."""
+    conn = sqlite3.connect(db_path, timeout=10)
+    try:
+        busy, _, _ = conn.execute('PRAGMA wal_checkpoint(FULL);').fetchone()
+        if busy:
+            log_error("WAL checkpoint could not complete, backup may miss the latest commits.")
+    finally:
+        conn.close()
+
+def chunk_path(chunk_hash):
+    return os.path.join(CHUNK_DIR, chunk_hash)
+
+def store_chunks(db_path, chunk_size=CHUNK_SIZE):
+    """Split the database into chunks, store the ones not seen before and return the manifest.
+
+    The caller must keep writers out (read_lock) so the chunks line up with one state of the file.
+    """
+    os.makedirs(CHUNK_DIR, exist_ok=True)
+    checkpoint_wal(db_path)
+    file_hash = hashlib.sha256()
+    chunks = []
+    new_chunks = 0
+    size = 0
+    with open(db_path, 'rb') as f:
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            file_hash.update(data)
+            size += len(data)
+            h = hashlib.sha256(data).hexdigest()
+            chunks.append(h)
+            path = chunk_path(h)
+            if not os.path.exists(path):
+                with open(path + '.tmp', 'wb') as out:
+                    out.write(data)
+                os.replace(path + '.tmp', path)
+                new_chunks += 1
+    log_info(f"Stored {new_chunks} new of {len(chunks)} chunks.")
+    return {
+        'version': 1,
+        'chunk_size': chunk_size,
+        'size': size,
+        'sha256': file_hash.hexdigest(),
+        'created': time.time(),
+        'chunks': chunks,
+    }
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        log_error(f"Unreadable backup manifest {path}: {e}")
+        return None
+
+def rotate_local_manifests(manifest):
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    # Manifests are small, so renaming them is enough; the chunks they share are stored once.
+    for i in reversed(range(1, MAX_BACKUPS)):
+        src = os.path.join(BACKUP_DIR, f"manifest_{i}.json")
+        if os.path.exists(src):
+            os.replace(src, os.path.join(BACKUP_DIR, f"manifest_{i+1}.json"))
+    tmp_path = os.path.join(BACKUP_DIR, "manifest_1.json.tmp")
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, os.path.join(BACKUP_DIR, "manifest_1.json"))
+    prune_chunks()
+    log_info("Local incremental backup rotation complete.")
+
+def referenced_chunks():
+    referenced = set()
+    for i in range(1, MAX_BACKUPS+1):
+        manifest = load_manifest(os.path.join(BACKUP_DIR, f"manifest_{i}.json"))
+        if manifest:
+            referenced.update(manifest['chunks'])
+    return referenced
+
+def prune_chunks():
+    if not os.path.isdir(CHUNK_DIR):
+        return
+    referenced = referenced_chunks()
+    for name in os.listdir(CHUNK_DIR):
+        if name not in referenced:
+            os.remove(os.path.join(CHUNK_DIR, name))
+
+def restore_from_manifest(manifest, db_path, chunk_dir=CHUNK_DIR):
+    """Rebuild the database file from its chunks, verifying every chunk and the whole file."""
+    tmp_path = db_path + '.restore'
+    file_hash = hashlib.sha256()
+    try:
+        with open(tmp_path, 'wb') as out:
+            for h in manifest['chunks']:
+                with open(os.path.join(chunk_dir, h), 'rb') as f:
+                    data = f.read()
+                if hashlib.sha256(data).hexdigest() != h:
+                    raise ValueError(f"chunk {h} is corrupt")
+                file_hash.update(data)
+                out.write(data)
+        if file_hash.hexdigest() != manifest['sha256']:
+            raise ValueError("rebuilt file does not match the manifest hash")
+    except (OSError, ValueError) as e:
+        log_error(f"Failed to rebuild DB from manifest: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+    replace_db_file(tmp_path, db_path)
+    return True
+
 def create_empty_db(db_path, schema_sql=None):
     conn = sqlite3.connect(db_path)
     if schema_sql:
@@ -80,3 +287,66 @@ def calculate_db_hash(db_path):
                 break
             sha256.update(data)
     return sha256.hexdigest()
+
+class ChangeWatcher:
+    """Tells whether a database was committed to since it was last marked, without reading it.
+
+    PRAGMA data_version on a private read-only connection changes whenever any other
+    connection, in this process or another, commits to the file; a replaced file counts as
+    a change too. At most max_open files are watched; one dropped reads as changed.
+    """
+
+    def __init__(self, max_open=64):
+        self.max_open = max(1, max_open)
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._opened = 0
+        # db_path -> (connection, inode, when it was opened), least recently used first.
+        self._watched = OrderedDict()
+        self._marked = {}
+
+    def _close(self, db_path):
+        conn = self._watched.pop(db_path, (None,))[0]
+        self._marked.pop(db_path, None)
+        if conn is not None:
+            conn.close()
+
+    def version(self, db_path):
+        """A value that differs after every commit to db_path, or None when it cannot be read."""
+        with self._lock:
+            if self._pid != os.getpid():
+                # Connections do not cross a fork.
+                self._watched.clear()
+                self._marked.clear()
+                self._pid = os.getpid()
+            try:
+                inode = os.stat(db_path).st_ino
+                watched = self._watched.get(db_path)
+                if watched is None or watched[1] != inode:
+                    self._close(db_path)
+                    self._opened += 1
+                    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=10, check_same_thread=False)
+                    watched = self._watched[db_path] = (conn, inode, self._opened)
+                    while len(self._watched) > self.max_open:
+                        self._close(next(iter(self._watched)))
+                self._watched.move_to_end(db_path)
+                return watched[1], watched[2], watched[0].execute('PRAGMA data_version').fetchone()[0]
+            except (OSError, sqlite3.Error):
+                self._close(db_path)
+                return None
+
+    def changed(self, db_path, version):
+        """Whether version, from version(), is not the one last marked for db_path."""
+        with self._lock:
+            return version is None or self._marked.get(db_path) != version
+
+    def mark(self, db_path, version):
+        """Record that db_path was backed up (or found unchanged) as of version."""
+        with self._lock:
+            if version is not None and db_path in self._watched:
+                self._marked[db_path] = version
+
+    def forget(self, db_path):
+        with self._lock:
+            if self._pid == os.getpid():
+                self._close(db_path)
@@ -0,0 +1,267 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from utils import log_info, log_error, get_sqlite_connection, get_readonly_connection
+from tuning import PROFILE
+
+# Readers share a small pool, writes go through a single connection per worker.
+READ_POOL_SIZE = int(os.getenv('DB_READ_POOL_SIZE', str(PROFILE['read_pool_size'])))
+WRITE_POOL_SIZE = 1
+POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))
+# Readers open the file read-only (mode=ro, query_only), so a read can never write or take the
+# write lock, and any number of them run next to the writer under WAL.
+READONLY_READERS = os.getenv('DB_READONLY_READERS', '1').lower() not in ('0', 'false', 'no')
+# Connection factory per pool kind; read replicas always use read-only readers.
+_factories = {'read': get_readonly_connection if READONLY_READERS else get_sqlite_connection,
+              'write': get_sqlite_connection}
+
+# Per-connection settings a statement can change. A write connection whose settings, attached
+# databases or TEMP objects differ from when it was opened is closed instead of reused, so
+# e.g. PRAGMA query_only or ATTACH from one request never reaches the next.
+SESSION_PRAGMAS = ('query_only', 'foreign_keys', 'defer_foreign_keys', 'recursive_triggers', 'cache_size',
+                   'cache_spill', 'temp_store', 'synchronous', 'busy_timeout', 'journal_size_limit',
+                   'locking_mode', 'read_uncommitted', 'automatic_index', 'ignore_check_constraints',
+                   'legacy_alter_table', 'trusted_schema', 'writable_schema', 'reverse_unordered_selects',
+                   'cell_size_check', 'secure_delete', 'threads')
+_SESSION_SQL = ('SELECT ' + ', '.join(f'(SELECT * FROM pragma_{name})' for name in SESSION_PRAGMAS)
+                + ', (SELECT group_concat(name) FROM pragma_database_list), (SELECT count(*) FROM temp.sqlite_master)')
+
+def session_state(conn):
+    """The connection's own settings, attached databases and number of TEMP objects."""
+    return (conn.execute(_SESSION_SQL).fetchone() + conn.execute('PRAGMA mmap_size').fetchone()
+            + conn.execute('PRAGMA wal_autocheckpoint').fetchone())
+
+class PoolTimeout(Exception):
+    pass
+
+class ConnectionPool:
+    """Bounded, thread-safe pool of SQLite connections for one database file."""
+
+    def __init__(self, db_path, size, name, timeout=POOL_TIMEOUT, factory=get_sqlite_connection, check_session=False):
+        self.db_path = db_path
+        self.size = size
+        self.name = name
+        self.timeout = timeout
+        self._factory = factory
+        self.check_session = check_session
+        # session_state() of each connection when it was opened, when check_session is set.
+        self._sessions = {}
+        # LIFO so the most recently used (warmest cache) connection is handed out first.
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        # Inode each connection was opened against, so a restored (replaced) file is noticed.
+        self._inodes = {}
+        self._open = 0
+        self._in_use = 0
+        self._closed = False
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._timeouts = 0
+        self._replaced = 0
+
+    def _file_id(self):
+        try:
+            return os.stat(self.db_path).st_ino
+        except OSError:
+            return None
+
+    def _connect(self):
+        conn = self._factory(self.db_path)
+        self._inodes[id(conn)] = self._file_id()
+        if self.check_session:
+            self._sessions[id(conn)] = session_state(conn)
+        return conn
+
+    def _healthy(self, conn):
+        if self._inodes.get(id(conn)) != self._file_id():
+            return False
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _discard(self, conn):
+        self._inodes.pop(id(conn), None)
+        self._sessions.pop(id(conn), None)
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._open -= 1
+
+    def acquire(self):
+        start = time.perf_counter()
+        conn = None
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._open < self.size
+                if create:
+                    self._open += 1
+            if create:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._open -= 1
+                    raise
+            else:
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    with self._lock:
+                        self._timeouts += 1
+                    raise PoolTimeout(f"Timed out waiting for a {self.name} connection to {self.db_path}")
+        waited = time.perf_counter() - start
+        if not self._healthy(conn):
+            log_error(f"Replacing unhealthy {self.name} connection to {self.db_path}")
+            self._discard(conn)
+            with self._lock:
+                self._open += 1
+                self._replaced += 1
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._lock:
+                    self._open -= 1
+                raise
+        with self._lock:
+            self._in_use += 1
+            self._checkouts += 1
+            if waited > 0.001:
+                self._waits += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        return conn
+
+    def release(self, conn, discard=False):
+        with self._lock:
+            self._in_use -= 1
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            if not discard and self.check_session and session_state(conn) != self._sessions.get(id(conn)):
+                log_info(f"Closing {self.name} connection to {self.db_path}: a statement changed its settings")
+                discard = True
+        except sqlite3.Error:
+            discard = True
+        if discard or self._closed:
+            self._discard(conn)
+        else:
+            self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def warm(self, count=None):
+        """Open up to count connections (default: the pool size) ahead of the first request.
+
+        Each one reads the schema once, which SQLite otherwise does on a connection's first query.
+        """
+        conns = []
+        try:
+            for _ in range(min(count or self.size, self.size)):
+                conn = self.acquire()
+                conns.append(conn)
+                conn.execute('SELECT count(*) FROM sqlite_master').fetchone()
+        finally:
+            for conn in conns:
+                self.release(conn)
+        return len(conns)
+
+    def close(self):
+        """Close idle connections; connections still checked out are closed on release."""
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+    def stats(self):
+        with self._lock:
+            checkouts = self._checkouts
+            return {
+                'size': self.size,
+                'open': self._open,
+                'in_use': self._in_use,
+                'idle': self._idle.qsize(),
+                'utilization': round(self._in_use / self.size, 3) if self.size else 0,
+                'checkouts': checkouts,
+                'waits': self._waits,
+                'wait_avg_ms': round(self._wait_total / checkouts * 1000, 3) if checkouts else 0,
+                'wait_max_ms': round(self._wait_max * 1000, 3),
+                'timeouts': self._timeouts,
+                'replaced': self._replaced,
+            }
+
+# Pools are per process: gunicorn forks workers, and SQLite connections must not cross a fork.
+_pools = {}
+_pools_pid = os.getpid()
+_pools_lock = threading.Lock()
+
+def _get_pool(db_path, kind):
+    global _pools, _pools_pid
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            _pools = {}
+            _pools_pid = os.getpid()
+        pool = _pools.get((db_path, kind))
+        if pool is None:
+            size = WRITE_POOL_SIZE if kind == 'write' else READ_POOL_SIZE
+            # Reads cannot change connection settings; see sql_classify.is_write.
+            pool = ConnectionPool(db_path, size, kind, factory=_factories[kind], check_session=kind == 'write')
+            _pools[(db_path, kind)] = pool
+        return pool
+
+def set_connection_factory(kind, factory):
+    """Use factory(db_path) for new pools of this kind ('read' or 'write')."""
+    _factories[kind] = factory
+
+def get_read_pool(db_path):
+    return _get_pool(db_path, 'read')
+
+def get_write_pool(db_path):
+    return _get_pool(db_path, 'write')
+
+def read_connection(db_path):
+    return get_read_pool(db_path).connection()
+
+def write_connection(db_path):
+    return get_write_pool(db_path).connection()
+
+def warm_pools(db_path, kinds=('read', 'write')):
+    """Fill this process's pools for db_path. Returns the number of connections opened."""
+    return sum(_get_pool(db_path, kind).warm() for kind in kinds)
+
+def close_pools(db_path=None):
+    """Drop pooled connections, e.g. before the database file is replaced."""
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            return
+        for key in list(_pools):
+            if db_path is None or key[0] == db_path:
+                _pools.pop(key).close()
+    log_info(f"Closed connection pools for {db_path or 'all databases'}")
+
+def pool_stats():
+    with _pools_lock:
+        pools = dict(_pools) if _pools_pid == os.getpid() else {}
+    stats = {}
+    for (db_path, kind), pool in pools.items():
+        stats.setdefault(db_path, {})[kind] = pool.stats()
+    return stats
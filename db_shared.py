@@ -1,7 +1,7 @@
 import os
 import platform
 
-RUNTIME_DIR = os.path.join(os.path.dirname(__file__), 'temp') if platform.system() == 'Windows' else '/tmp/Drive_temp'
+RUNTIME_DIR = os.getenv('RUNTIME_DIR') or (os.path.join(os.path.dirname(__file__), 'temp') if platform.system() == 'Windows' else '/tmp/Drive_temp')
 
 # Ensure the runtime directory exists
 os.makedirs(RUNTIME_DIR, exist_ok=True)
@@ -16,22 +16,23 @@ DB_TIMESTAMP_PATH = DB_PATH + '.ts'
 DB_LOCK_PATH = os.path.join(RUNTIME_DIR, 'db.lock')
 APP_LOG_PATH = os.path.join(RUNTIME_DIR, 'app.log')
 
-def get_last_hash():
-    if os.path.exists(DB_HASH_PATH):
-        with open(DB_HASH_PATH, 'r') as f:
+# The path arguments let tenant databases keep their own state next to their files.
+def get_last_hash(path=DB_HASH_PATH):
+    if os.path.exists(path):
+        with open(path, 'r') as f:
             return f.read().strip()
     return None
 
-def set_last_hash(h):
-    with open(DB_HASH_PATH, 'w') as f:
+def set_last_hash(h, path=DB_HASH_PATH):
+    with open(path, 'w') as f:
         f.write(h)
 
-def get_last_timestamp():
-    if os.path.exists(DB_TIMESTAMP_PATH):
-        with open(DB_TIMESTAMP_PATH, 'r') as f:
+def get_last_timestamp(path=DB_TIMESTAMP_PATH):
+    if os.path.exists(path):
+        with open(path, 'r') as f:
             return float(f.read().strip())
     return 0
 
-def set_last_timestamp(ts):
-    with open(DB_TIMESTAMP_PATH, 'w') as f:
+def set_last_timestamp(ts, path=DB_TIMESTAMP_PATH):
+    with open(path, 'w') as f:
         f.write(str(ts))
@@ -0,0 +1,66 @@
+"""Drive media classes that subclass googleapiclient's.
+
+Kept out of drive_utils so importing it (and app) does not load the Google client;
+drive_utils imports this on the first upload.
+"""
+from googleapiclient.http import MediaUpload
+from drive_utils import DRIVE_CHUNK_SIZE, DRIVE_COMPRESSION, READ_SIZE, _compressor
+
+class CompressedFileUpload(MediaUpload):
+    """Resumable upload that compresses the file as it is read, without a temporary file.
+
+    The compressed size is not known up front. Reading runs two chunks ahead so the total is
+    known (size()) before the last chunk is sent; otherwise a stream ending exactly on a chunk
+    boundary would finish with an empty request. Bytes the server has not acknowledged stay
+    buffered, so a chunk can be re-sent after an interrupted request.
+    """
+
+    def __init__(self, file_path, codec=DRIVE_COMPRESSION, chunksize=DRIVE_CHUNK_SIZE):
+        self._file = open(file_path, 'rb')
+        self._compressobj = _compressor(codec)
+        self._chunksize = chunksize
+        self._buffer = bytearray()
+        self._buffer_start = 0
+        self._eof = False
+        self.raw_bytes = 0
+        self.wire_bytes = 0
+        self._read_ahead(0)
+
+    def chunksize(self):
+        return self._chunksize
+
+    def mimetype(self):
+        return 'application/octet-stream'
+
+    def size(self):
+        return self._buffer_start + len(self._buffer) if self._eof else None
+
+    def resumable(self):
+        return True
+
+    def has_stream(self):
+        return False
+
+    def _fill(self):
+        data = self._file.read(READ_SIZE)
+        if data:
+            self.raw_bytes += len(data)
+            out = self._compressobj.compress(data) if self._compressobj else data
+        else:
+            out = self._compressobj.flush() if self._compressobj else b''
+            self._eof = True
+            self._file.close()
+        self.wire_bytes += len(out)
+        self._buffer += out
+
+    def _read_ahead(self, begin):
+        if begin < self._buffer_start:
+            raise ValueError(f"Upload asked for byte {begin}, which was already acknowledged")
+        del self._buffer[:begin - self._buffer_start]
+        self._buffer_start = begin
+        while len(self._buffer) <= 2 * self._chunksize and not self._eof:
+            self._fill()
+
+    def getbytes(self, begin, length):
+        self._read_ahead(begin)
+        return bytes(self._buffer[:length])
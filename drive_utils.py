@@ -1,15 +1,116 @@
 # This file will contain all Google Drive related functions, refactored from app.py
 import os
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload, MediaFileUpload
+import io
+import json
+import threading
+import time
+import zlib
 import platform
-from utils import log_info, log_error, exponential_backoff
+from utils import log_info, log_error, exponential_backoff, read_lock
+import metrics
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 SCOPES = ['https://www.googleapis.com/auth/drive.file']
-BACKUP_DIR = os.path.join(os.path.dirname(__file__), 'temp/backups') if platform.system() == 'Windows' else '/tmp/Drive_temp/backups'
+BACKUP_DIR = os.path.join(os.getenv('RUNTIME_DIR'), 'backups') if os.getenv('RUNTIME_DIR') else (os.path.join(os.path.dirname(__file__), 'temp/backups') if platform.system() == 'Windows' else '/tmp/Drive_temp/backups')
 MAX_BACKUPS = 3
 folder_id = os.getenv('FOLDER_ID')
+_credentials = None
+_credentials_lock = threading.Lock()
+_local = threading.local()
+# Resumable uploads send this much per request; Drive wants a multiple of 256 KiB.
+DRIVE_CHUNK_SIZE = max(1, int(os.getenv('DRIVE_CHUNK_SIZE', str(8 * 1024 * 1024))) // (256 * 1024)) * 256 * 1024
+# 'zstd', 'gzip' or 'none'. Downloads detect the codec from the data, so old uncompressed backups still load.
+DRIVE_COMPRESSION = os.getenv('DRIVE_COMPRESSION', 'zstd' if zstandard else 'gzip')
+READ_SIZE = 1024 * 1024
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+_transfer_stats = {
+    'upload': {'files': 0, 'raw_bytes': 0, 'wire_bytes': 0, 'seconds': 0.0},
+    'download': {'files': 0, 'raw_bytes': 0, 'wire_bytes': 0, 'seconds': 0.0},
+}
+_transfer_stats_lock = threading.Lock()
+
+metrics.describe('drivesync_drive_transfer_bytes_total', 'counter', 'Bytes moved to and from Drive, before (raw) and after (wire) compression')
+metrics.describe('drivesync_drive_transfer_seconds', 'histogram', 'Time to transfer one file to or from Drive')
+
+def _record_transfer(direction, raw_bytes, wire_bytes, seconds):
+    metrics.inc('drivesync_drive_transfer_bytes_total', raw_bytes, direction=direction, stage='raw')
+    metrics.inc('drivesync_drive_transfer_bytes_total', wire_bytes, direction=direction, stage='wire')
+    metrics.observe('drivesync_drive_transfer_seconds', seconds, direction=direction)
+    with _transfer_stats_lock:
+        stats = _transfer_stats[direction]
+        stats['files'] += 1
+        stats['raw_bytes'] += raw_bytes
+        stats['wire_bytes'] += wire_bytes
+        stats['seconds'] += seconds
+
+def transfer_stats():
+    """Bytes before/after compression and wire throughput for Drive uploads and downloads."""
+    with _transfer_stats_lock:
+        snapshot = {k: dict(v) for k, v in _transfer_stats.items()}
+    for stats in snapshot.values():
+        stats['seconds'] = round(stats['seconds'], 3)
+        stats['compression_ratio'] = round(stats['raw_bytes'] / stats['wire_bytes'], 3) if stats['wire_bytes'] else None
+        stats['wire_mb_per_s'] = round(stats['wire_bytes'] / stats['seconds'] / 1e6, 3) if stats['seconds'] else None
+    snapshot['codec'] = DRIVE_COMPRESSION
+    snapshot['chunk_size'] = DRIVE_CHUNK_SIZE
+    return snapshot
+
+def _compressor(codec):
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=3).compressobj()
+    if codec == 'gzip':
+        return zlib.compressobj(6, zlib.DEFLATED, 31)
+    return None
+
+class _DecompressingWriter:
+    """File-like sink for MediaIoBaseDownload that decompresses as the chunks arrive."""
+
+    def __init__(self, fd):
+        self._fd = fd
+        self._head = b''
+        self._decompressobj = None
+        self._started = False
+        self.raw_bytes = 0
+        self.wire_bytes = 0
+
+    def _start(self):
+        if self._head.startswith(GZIP_MAGIC):
+            self._decompressobj = zlib.decompressobj(31)
+        elif self._head.startswith(ZSTD_MAGIC):
+            if zstandard is None:
+                raise RuntimeError("Backup is zstd-compressed but the zstandard package is not installed.")
+            self._decompressobj = zstandard.ZstdDecompressor().decompressobj()
+        self._started = True
+        data, self._head = self._head, b''
+        self._emit(data)
+
+    def _emit(self, data):
+        out = self._decompressobj.decompress(data) if self._decompressobj else data
+        self.raw_bytes += len(out)
+        self._fd.write(out)
+
+    def write(self, data):
+        self.wire_bytes += len(data)
+        if self._started:
+            self._emit(data)
+            return
+        self._head += data
+        if len(self._head) >= len(ZSTD_MAGIC):
+            self._start()
+
+    def finish(self):
+        if not self._started:
+            self._start()
+        if self._decompressobj is not None and hasattr(self._decompressobj, 'flush'):
+            out = self._decompressobj.flush()
+            self.raw_bytes += len(out)
+            self._fd.write(out)
 
 def get_service_account_info_from_env():
     private_key = os.environ.get("GOOGLE_PRIVATE_KEY")
@@ -29,80 +130,347 @@ def get_service_account_info_from_env():
         "universe_domain": os.environ.get("GOOGLE_UNIVERSE_DOMAIN"),
     }
 
+def _get_credentials():
+    global _credentials
+    with _credentials_lock:
+        if _credentials is None:
+            from google.oauth2 import service_account
+            _credentials = service_account.Credentials.from_service_account_info(
+                get_service_account_info_from_env(), scopes=SCOPES)
+        return _credentials
+
 def build_drive_service():
-    service_account_info = get_service_account_info_from_env()
-    credentials = service_account.Credentials.from_service_account_info(
-        service_account_info, scopes=SCOPES)
-    return build("drive", "v3", credentials=credentials)
+    # The Google client is imported on first use, so workers that never reach Drive skip it.
+    from googleapiclient.discovery import build
+    # Discovery for drive v3 ships with the client, so nothing is fetched here.
+    return build("drive", "v3", credentials=_get_credentials(), cache_discovery=False)
 
-def find_drive_file(service, name):
-    query = f"name='{name}' and trashed=false"
+def get_drive_service():
+    """Long-lived Drive client for the calling thread.
+
+    httplib2 connections are not thread-safe, so each thread keeps its own client. They share
+    one set of credentials, whose access token google-auth refreshes when it expires.
+    """
+    service = getattr(_local, 'service', None)
+    if service is None or _local.pid != os.getpid():
+        service = build_drive_service()
+        _local.service = service
+        _local.pid = os.getpid()
+    return service
+
+# Drive name -> file ID (None when known to be absent). Other workers and hosts rename and
+# delete backups too, so anything that changes names on Drive lists them afresh first and the
+# cache only saves repeated lookups within that run; it is also dropped whenever a call fails.
+_file_ids = {}
+_listed_prefixes = set()
+# Manifest contents by file ID; a file's content never changes, only its name.
+_json_by_id = {}
+_file_ids_lock = threading.Lock()
+
+def invalidate_drive_cache():
+    with _file_ids_lock:
+        _file_ids.clear()
+        _listed_prefixes.clear()
+
+def _cache_file_id(name, file_id):
+    with _file_ids_lock:
+        _file_ids[name] = file_id
+
+def _drive_query(clauses):
+    query = ' and '.join(clauses + ["trashed=false"])
     if folder_id:
         query += f" and '{folder_id}' in parents"
-    results = service.files().list(q=query, spaces='drive', fields="files(id, name)").execute()
-    items = results.get('files', [])
-    return items[0] if items else None
+    return query
+
+def _list_names(service, names):
+    """{name: [file IDs, newest first]} for the names on Drive, in a single list call."""
+    name_filter = '(' + ' or '.join(f"name='{n}'" for n in names) + ')'
+    results = service.files().list(
+        q=_drive_query([name_filter]), spaces='drive', fields="files(id, name, createdTime)",
+        pageSize=1000).execute()
+    found = {}
+    for item in sorted(results.get('files', []), key=lambda f: f.get('createdTime', ''), reverse=True):
+        found.setdefault(item['name'], []).append(item['id'])
+    return found
+
+def lookup_drive_files(service, names, fresh=False):
+    """Return {name: file ID or None}, fetching every uncached name (all of them when fresh)
+    in a single list call. Of several files with one name, the newest wins."""
+    with _file_ids_lock:
+        missing = list(names) if fresh else [n for n in names if n not in _file_ids]
+    if missing:
+        found = _list_names(service, missing)
+        with _file_ids_lock:
+            for n in missing:
+                _file_ids[n] = found[n][0] if n in found else None
+    with _file_ids_lock:
+        return {n: _file_ids.get(n) for n in names}
+
+def find_drive_file(service, name):
+    file_id = lookup_drive_files(service, [name])[name]
+    return {'id': file_id, 'name': name} if file_id else None
 
 def delete_drive_file(service, filename):
     file = find_drive_file(service, filename)
     if file:
         service.files().delete(fileId=file['id']).execute()
+        _cache_file_id(filename, None)
         log_info(f"🗑️ Deleted Drive file: {filename}")
 
 def rename_drive_file(service, old_name, new_name):
     file = find_drive_file(service, old_name)
     if file:
         service.files().update(fileId=file['id'], body={"name": new_name}).execute()
+        _cache_file_id(old_name, None)
+        _cache_file_id(new_name, file['id'])
         log_info(f"🔄 Renamed Drive file: {old_name} → {new_name}")
 
-def upload_to_drive(service, file_path, filename):
+def execute_batch(service, requests):
+    """Run Drive requests through one batch HTTP call, raising the first failure."""
+    if not requests:
+        return
+    errors = []
+
+    def callback(request_id, response, exception):
+        if exception is not None:
+            errors.append(exception)
+
+    # Drive accepts up to 100 calls per batch.
+    for start in range(0, len(requests), 100):
+        batch = service.new_batch_http_request(callback=callback)
+        for request in requests[start:start + 100]:
+            batch.add(request)
+        batch.execute()
+    if errors:
+        raise errors[0]
+
+def rotate_drive_names(service, names):
+    """Shift names[0] -> names[1] -> ... and delete the file at names[-1], in one batch.
+
+    Renames go by file ID, so the order inside the batch does not matter. The names are
+    listed afresh, since another worker may have rotated them since this one last looked, and
+    older copies of a name left behind by such a race are deleted.
+    """
+    found = _list_names(service, names)
+    ids = {n: found[n][0] if n in found else None for n in names}
+    requests = [service.files().delete(fileId=file_id) for n in names for file_id in found.get(n, [])[1:]]
+    if requests:
+        log_info(f"🗑️ Deleting {len(requests)} duplicate Drive backups.")
+    if ids[names[-1]]:
+        requests.append(service.files().delete(fileId=ids[names[-1]]))
+    for i in reversed(range(len(names) - 1)):
+        if ids[names[i]]:
+            requests.append(service.files().update(fileId=ids[names[i]], body={"name": names[i+1]}))
+    execute_batch(service, requests)
+    with _file_ids_lock:
+        for i in reversed(range(1, len(names))):
+            _file_ids[names[i]] = ids[names[i-1]]
+        _file_ids[names[0]] = None
+    log_info(f"🔄 Rotated Drive backups: {', '.join(names)}")
+
+def upload_to_drive(service, file_path, filename, properties=None):
     file_metadata = {
         'name': filename,
-        'parents': [folder_id] if folder_id else []
+        'parents': [folder_id] if folder_id else [],
+        'appProperties': dict(properties or {}, codec=DRIVE_COMPRESSION),
     }
-    media = MediaFileUpload(file_path, resumable=False)
+    from drive_media import CompressedFileUpload
+    media = CompressedFileUpload(file_path)
+    start = time.perf_counter()
     file = service.files().create(
         body=file_metadata,
         media_body=media,
         fields='id'
-    ).execute()
-    log_info(f"☁️ Uploaded to Drive: {filename} (ID: {file['id']})")
+    ).execute(num_retries=3)
+    _record_transfer('upload', media.raw_bytes, media.wire_bytes, time.perf_counter() - start)
+    _cache_file_id(filename, file['id'])
+    log_info(f"☁️ Uploaded to Drive: {filename} (ID: {file['id']}, {media.raw_bytes} bytes, {media.wire_bytes} on the wire)")
 
-def rotate_drive_backups(latest_local_backup_path):
-    service = build_drive_service()
-    delete_drive_file(service, "db_3.sqlite")
-    rename_drive_file(service, "db_2.sqlite", "db_3.sqlite")
-    rename_drive_file(service, "db_1.sqlite", "db_2.sqlite")
-    upload_to_drive(service, latest_local_backup_path, "db_1.sqlite")
+def list_drive_files(service, name_prefix, fresh=False):
+    """All files whose name starts with name_prefix. Listed once (or when fresh), then served
+    from the ID cache."""
+    with _file_ids_lock:
+        if name_prefix in _listed_prefixes and not fresh:
+            return [{'id': i, 'name': n} for n, i in _file_ids.items() if i and n.startswith(name_prefix)]
+    query = _drive_query([f"name contains '{name_prefix}'"])
+    files = []
+    page_token = None
+    while True:
+        results = service.files().list(
+            q=query, spaces='drive', fields="nextPageToken, files(id, name)",
+            pageSize=1000, pageToken=page_token).execute()
+        files.extend(f for f in results.get('files', []) if f['name'].startswith(name_prefix))
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            break
+    with _file_ids_lock:
+        for name in [n for n in _file_ids if n.startswith(name_prefix)]:
+            _file_ids[name] = None
+        for f in files:
+            _file_ids[f['name']] = f['id']
+        _listed_prefixes.add(name_prefix)
+    return files
 
-def download_latest_db_from_drive(destination_path='db_1.sqlite'):
+def download_drive_file(service, file_id, fd):
+    from googleapiclient.http import MediaIoBaseDownload
+    request = service.files().get_media(fileId=file_id)
+    writer = _DecompressingWriter(fd)
+    downloader = MediaIoBaseDownload(writer, request, chunksize=DRIVE_CHUNK_SIZE)
+    start = time.perf_counter()
+    done = False
+    while not done:
+        _, done = downloader.next_chunk(num_retries=3)
+    writer.finish()
+    _record_transfer('download', writer.raw_bytes, writer.wire_bytes, time.perf_counter() - start)
+
+def download_drive_json(service, name):
+    file = find_drive_file(service, name)
+    if not file:
+        return None
+    with _file_ids_lock:
+        cached = _json_by_id.get(file['id'])
+    if cached is not None:
+        return cached
+    buf = io.BytesIO()
+    download_drive_file(service, file['id'], buf)
+    content = json.loads(buf.getvalue().decode('utf-8'))
+    with _file_ids_lock:
+        _json_by_id[file['id']] = content
+    return content
+
+def rotate_drive_backups(latest_local_backup_path, properties=None, prefix=''):
+    """Rotate the full copies on Drive. A prefix keeps another database's copies apart."""
+    service = get_drive_service()
     try:
-        service = build_drive_service()
-        query = f"name='db_1.sqlite' and trashed=false"
-        if folder_id:
-            query += f" and '{folder_id}' in parents"
-        result = service.files().list(q=query, fields="files(id, name)", pageSize=1).execute()
-        items = result.get('files', [])
-        print(items)
-        if not items:
-            log_error("❌ No db_1.sqlite found on Drive.")
+        rotate_drive_names(service, [f"{prefix}db_{i}.sqlite" for i in range(1, MAX_BACKUPS+1)])
+        upload_to_drive(service, latest_local_backup_path, f"{prefix}db_1.sqlite", properties)
+    except Exception:
+        invalidate_drive_cache()
+        raise
+
+def rotate_drive_manifests(manifest, properties=None):
+    from db_manager import BACKUP_DIR as LOCAL_BACKUP_DIR, chunk_path
+    service = get_drive_service()
+    try:
+        # Another worker may have uploaded or dropped chunks since this one last listed them.
+        chunk_files = {f['name']: f['id'] for f in list_drive_files(service, 'chunk_', fresh=True)}
+        uploaded = 0
+        for h in dict.fromkeys(manifest['chunks']):
+            if f"chunk_{h}" not in chunk_files:
+                upload_to_drive(service, chunk_path(h), f"chunk_{h}")
+                uploaded += 1
+        log_info(f"☁️ Uploaded {uploaded} changed chunks of {len(manifest['chunks'])}.")
+        manifest_names = [f"manifest_{i}.json" for i in range(1, MAX_BACKUPS+1)]
+        rotate_drive_names(service, manifest_names)
+        upload_to_drive(service, os.path.join(LOCAL_BACKUP_DIR, "manifest_1.json"), "manifest_1.json", properties)
+        # Drop chunks no Drive manifest refers to any more. The Drive manifests are read back
+        # (once per file, then cached) rather than trusting local ones, which may be missing
+        # on a freshly started host.
+        referenced = set(manifest['chunks'])
+        for name in manifest_names[1:]:
+            older = download_drive_json(service, name)
+            if older:
+                referenced.update(older['chunks'])
+        stale = [name for name in chunk_files if name[len('chunk_'):] not in referenced]
+        execute_batch(service, [service.files().delete(fileId=chunk_files[name]) for name in stale])
+        with _file_ids_lock:
+            for name in stale:
+                _file_ids[name] = None
+    except Exception:
+        invalidate_drive_cache()
+        raise
+
+def download_latest_manifest_from_drive(service, destination_path):
+    from db_manager import CHUNK_DIR, chunk_path, restore_from_manifest
+    manifest = download_drive_json(service, "manifest_1.json")
+    if not manifest:
+        return None
+    os.makedirs(CHUNK_DIR, exist_ok=True)
+    chunk_files = {f['name']: f['id'] for f in list_drive_files(service, 'chunk_')}
+    # Chunks already in the local store are reused, only missing ones are fetched.
+    for h in dict.fromkeys(manifest['chunks']):
+        if os.path.exists(chunk_path(h)):
+            continue
+        if f"chunk_{h}" not in chunk_files:
+            log_error(f"❌ Chunk {h} referenced by manifest_1.json is missing on Drive.")
             return None
-        file_id = items[0]['id']
-        request = service.files().get_media(fileId=file_id)
+        with open(chunk_path(h) + '.tmp', 'wb') as f:
+            download_drive_file(service, chunk_files[f"chunk_{h}"], f)
+        os.replace(chunk_path(h) + '.tmp', chunk_path(h))
+    if not restore_from_manifest(manifest, destination_path):
+        return None
+    log_info(f"✅ Rebuilt DB from Drive manifest to: {destination_path}")
+    return destination_path
+
+def latest_published_backup(service):
+    """The newest backup on Drive as {'name', 'id', 'hash', 'timestamp'}, or None.
+
+    Always asks Drive rather than the ID cache, since another host may have uploaded it.
+    """
+    name_filter = "(name='manifest_1.json' or name='db_1.sqlite')"
+    results = service.files().list(
+        q=_drive_query([name_filter]), spaces='drive',
+        fields="files(id, name, appProperties)", pageSize=10).execute()
+    latest = None
+    for item in results.get('files', []):
+        props = item.get('appProperties') or {}
+        if 'db_hash' not in props:
+            continue
+        candidate = {
+            'name': item['name'], 'id': item['id'],
+            'hash': props['db_hash'], 'timestamp': float(props.get('db_timestamp', 0)),
+        }
+        if latest is None or candidate['timestamp'] > latest['timestamp']:
+            latest = candidate
+    return latest
+
+def download_latest_db_from_drive(destination_path='db_1.sqlite', prefix=''):
+    """Fetch the latest backup. Prefixed backup sets (tenant databases) only have full copies."""
+    try:
+        service = get_drive_service()
         os.makedirs(os.path.dirname(destination_path) or '.', exist_ok=True)
+        # One list call tells us which backup format is on Drive.
+        db_name = f"{prefix}db_1.sqlite"
+        ids = lookup_drive_files(service, [db_name] if prefix else ["manifest_1.json", db_name], fresh=True)
+        if not prefix and ids["manifest_1.json"] and download_latest_manifest_from_drive(service, destination_path):
+            return destination_path
+        file_id = ids[db_name]
+        if not file_id:
+            log_error(f"❌ No {db_name} found on Drive.")
+            return None
         with open(destination_path, "wb") as f:
-            downloader = MediaIoBaseDownload(f, request)
-            done = False
-            while not done:
-                status, done = downloader.next_chunk()
-                log_info(f"⬇️ Downloading: {int(status.progress() * 100)}%")
+            download_drive_file(service, file_id, f)
         log_info(f"✅ Downloaded DB to: {destination_path}")
         return destination_path
     except Exception as e:
         log_error(f"❌ Failed to download DB: {e}")
         return None
 
-def perform_backup(db_path='db_1.sqlite'):
-    from db_manager import rotate_local_backups
-    rotate_local_backups(db_path)
-    rotate_drive_backups(os.path.join(BACKUP_DIR, "db_1.sqlite"))
+metrics.describe('drivesync_backup_phase_seconds', 'histogram', 'Time spent in each phase of a backup')
+
+def perform_backup(db_path='db_1.sqlite', manifest=None, snapshot_path=None, db_hash=None):
+    """Back up locally and to Drive.
+
+    The latest backup on Drive carries the database hash and the time it was taken as
+    appProperties, which read replicas poll (see latest_published_backup).
+    """
+    from db_manager import BACKUP_MODE, calculate_db_hash, rotate_local_backups, rotate_local_manifests, store_chunks
+    if BACKUP_MODE == 'incremental':
+        if manifest is None:
+            with read_lock(), metrics.timed('drivesync_backup_phase_seconds', phase='chunk'):
+                manifest = store_chunks(db_path)
+        with metrics.timed('drivesync_backup_phase_seconds', phase='local_rotate'):
+            rotate_local_manifests(manifest)
+        with metrics.timed('drivesync_backup_phase_seconds', phase='drive'):
+            rotate_drive_manifests(manifest, {'db_hash': manifest['sha256'], 'db_timestamp': str(manifest['created'])})
+        return
+    # The snapshot is consistent on its own, and the upload works from it.
+    taken = time.time()
+    with metrics.timed('drivesync_backup_phase_seconds', phase='local_rotate'):
+        rotate_local_backups(db_path, snapshot_path)
+    latest = os.path.join(BACKUP_DIR, "db_1.sqlite")
+    if db_hash is None:
+        with metrics.timed('drivesync_backup_phase_seconds', phase='hash'):
+            db_hash = calculate_db_hash(latest)
+    with metrics.timed('drivesync_backup_phase_seconds', phase='drive'):
+        rotate_drive_backups(latest, {'db_hash': db_hash, 'db_timestamp': str(taken)})
@@ -0,0 +1,182 @@
+import json
+import os
+import threading
+import time
+import portalocker
+from db_pool import read_connection
+from utils import log_info, log_error, get_readonly_connection, tmp_PATH
+
+# Readiness is re-checked in the background this often; probes get the cached result.
+HEALTH_READY_TTL = float(os.getenv('HEALTH_READY_TTL', '5'))
+# How often the deep check runs on the host (0 turns it off), and whether it is
+# PRAGMA quick_check ('quick') or the slower integrity_check ('full').
+HEALTH_DEEP_INTERVAL = float(os.getenv('HEALTH_DEEP_INTERVAL', '3600'))
+HEALTH_DEEP_MODE = os.getenv('HEALTH_DEEP_MODE', 'quick')
+# Problems the deep check reports at most.
+HEALTH_DEEP_MAX_ERRORS = 100
+# One worker per host runs the deep check; the others read its result from here.
+HEALTH_DEEP_RESULT = os.path.join(tmp_PATH, 'health_deep.json')
+HEALTH_DEEP_LOCK = os.path.join(tmp_PATH, 'health_deep.lock')
+
+def _elapsed_ms(start):
+    return round((time.perf_counter() - start) * 1000, 3)
+
+class HealthChecker:
+    """Three tiers of health for one database.
+
+    live() costs nothing and only says the process answers. ready() returns the result of
+    a check that a background thread repeats every ready_ttl seconds on a pooled connection:
+    the file exists and has the required tables. deep() returns the latest PRAGMA
+    quick_check (or integrity_check), run every deep_interval seconds by one worker per host
+    on its own read-only connection. Each result carries how long its check took and how
+    old it is.
+    """
+
+    def __init__(self, db_path, required_tables, ready_ttl=HEALTH_READY_TTL,
+                 deep_interval=HEALTH_DEEP_INTERVAL, deep_mode=HEALTH_DEEP_MODE):
+        self.db_path = db_path
+        self.required_tables = set(required_tables or ())
+        self.ready_ttl = ready_ttl
+        self.deep_interval = deep_interval
+        self.deep_mode = deep_mode
+        self._lock = threading.Lock()
+        self._pid = None
+        self._threads = []
+        self._ready = None
+        self._deep = None
+
+    def _ensure_threads(self):
+        # Threads do not survive a fork, so a gunicorn worker starts its own on first use.
+        with self._lock:
+            if self._pid == os.getpid() and all(t.is_alive() for t in self._threads):
+                return
+            self._pid = os.getpid()
+            self._threads = [threading.Thread(target=self._run_ready, name='health-ready', daemon=True)]
+            if self.deep_interval > 0:
+                self._threads.append(threading.Thread(target=self._run_deep, name='health-deep', daemon=True))
+            for thread in self._threads:
+                thread.start()
+
+    def _run_ready(self):
+        while True:
+            time.sleep(self.ready_ttl)
+            self._check_ready()
+
+    def _run_deep(self):
+        while True:
+            self._check_deep()
+            time.sleep(min(self.deep_interval, 60))
+
+    def live(self):
+        return {'status': 'ok', 'pid': os.getpid()}
+
+    def _check_ready(self):
+        start = time.perf_counter()
+        problems = []
+        try:
+            if not os.path.exists(self.db_path):
+                problems.append('database file is missing')
+            else:
+                with read_connection(self.db_path) as conn:
+                    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+                missing = self.required_tables - tables
+                if missing:
+                    problems.append(f"missing required tables: {', '.join(sorted(missing))}")
+        except Exception as e:
+            problems.append(f"{type(e).__name__}: {e}")
+        result = {
+            'status': 'error' if problems else 'ok',
+            'problems': problems,
+            'checked_at': time.time(),
+            'check_ms': _elapsed_ms(start),
+        }
+        with self._lock:
+            previous = self._ready
+            self._ready = result
+        # Only changes are logged, not every probe.
+        if previous is None or previous['status'] != result['status']:
+            if problems:
+                log_error(f"Health: not ready: {'; '.join(problems)}")
+            elif previous is not None:
+                log_info("Health: ready again.")
+        return result
+
+    def ready(self):
+        """The cached readiness result; checked now only if there is none yet."""
+        self._ensure_threads()
+        with self._lock:
+            result = self._ready
+        if result is None:
+            result = self._check_ready()
+        result = dict(result, age_seconds=round(time.time() - result['checked_at'], 3))
+        # A result the background thread has stopped refreshing no longer says anything.
+        if result['age_seconds'] > 3 * self.ready_ttl + 1:
+            result['status'] = 'error'
+            result['problems'] = result['problems'] + ['readiness check is not being refreshed']
+        return result
+
+    def _read_deep(self):
+        try:
+            with open(HEALTH_DEEP_RESULT) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _check_deep(self):
+        shared = self._read_deep()
+        if shared is None or time.time() - shared['checked_at'] >= self.deep_interval:
+            with open(HEALTH_DEEP_LOCK, 'a') as lock_fd:
+                try:
+                    portalocker.lock(lock_fd, portalocker.LOCK_EX | portalocker.LOCK_NB)
+                except portalocker.exceptions.LockException:
+                    # Another worker is running it; its result shows up next time.
+                    return
+                try:
+                    shared = self._read_deep()
+                    if shared is None or time.time() - shared['checked_at'] >= self.deep_interval:
+                        shared = self._run_integrity_check()
+                        tmp = HEALTH_DEEP_RESULT + '.tmp'
+                        with open(tmp, 'w') as f:
+                            json.dump(shared, f)
+                        os.replace(tmp, HEALTH_DEEP_RESULT)
+                finally:
+                    portalocker.unlock(lock_fd)
+        with self._lock:
+            self._deep = shared
+
+    def _run_integrity_check(self):
+        pragma = 'integrity_check' if self.deep_mode == 'full' else 'quick_check'
+        start = time.perf_counter()
+        try:
+            conn = get_readonly_connection(self.db_path)
+            try:
+                rows = [row[0] for row in conn.execute(f'PRAGMA {pragma}({HEALTH_DEEP_MAX_ERRORS})')]
+            finally:
+                conn.close()
+            problems = [] if rows == ['ok'] else rows
+        except Exception as e:
+            problems = [f"{type(e).__name__}: {e}"]
+        result = {
+            'status': 'error' if problems else 'ok',
+            'check': pragma,
+            'problems': problems,
+            'checked_at': time.time(),
+            'check_ms': _elapsed_ms(start),
+            'pid': os.getpid(),
+        }
+        if problems:
+            log_error(f"Health: {pragma} found problems: {'; '.join(problems[:5])}")
+        else:
+            log_info(f"Health: {pragma} ok in {result['check_ms']} ms.")
+        return result
+
+    def deep(self):
+        """The latest deep check on this host, or status 'pending' before the first one."""
+        self._ensure_threads()
+        with self._lock:
+            result = self._deep
+        if result is None:
+            result = self._read_deep()
+        if result is None:
+            return {'status': 'pending' if self.deep_interval > 0 else 'disabled'}
+        return dict(result, age_seconds=round(time.time() - result['checked_at'], 3))
@@ -0,0 +1,171 @@
+"""Prometheus-style metrics, kept per process.
+
+Under gunicorn every worker has its own registry, so a scrape of /metrics reports the worker
+that served it (drivesync_process_info carries its pid). Counters and histograms are updated
+where the work happens; the stats the other modules already keep are turned into gauges by
+collectors at scrape time.
+"""
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+import psutil
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+# How often the background collector samples host CPU, memory and disk.
+HOST_SAMPLE_SECONDS = float(os.getenv('HOST_SAMPLE_SECONDS', '5'))
+
+_lock = threading.Lock()
+_metrics = {}
+_collectors = []
+
+def describe(name, kind, help_text, buckets=DEFAULT_BUCKETS):
+    """Declare a metric ('counter', 'gauge' or 'histogram') before it is used."""
+    with _lock:
+        if name not in _metrics:
+            _metrics[name] = {'kind': kind, 'help': help_text, 'buckets': tuple(buckets), 'series': {}}
+
+def _series(name, labels):
+    key = tuple(sorted(labels.items()))
+    metric = _metrics[name]
+    series = metric['series'].get(key)
+    if series is None:
+        series = metric['series'][key] = [[0] * len(metric['buckets']), 0.0, 0] if metric['kind'] == 'histogram' else [0]
+    return metric, series
+
+def inc(name, value=1, **labels):
+    with _lock:
+        _, series = _series(name, labels)
+        series[0] += value
+
+def set_gauge(name, value, **labels):
+    with _lock:
+        _, series = _series(name, labels)
+        series[0] = value
+
+def observe(name, value, **labels):
+    with _lock:
+        metric, series = _series(name, labels)
+        index = bisect.bisect_left(metric['buckets'], value)
+        if index < len(metric['buckets']):
+            series[0][index] += 1
+        series[1] += value
+        series[2] += 1
+
+@contextmanager
+def timed(name, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+def register_collector(fn):
+    """fn() returns (name, kind, help, labels, value) samples, read at every scrape."""
+    _collectors.append(fn)
+    return fn
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(pairs):
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}' if pairs else ''
+
+def _number(value):
+    if value is None:
+        return 'NaN'
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def _copy(series):
+    return [list(series[0]), series[1], series[2]] if len(series) == 3 else [series[0]]
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        snapshot = {name: dict(m, series={k: _copy(v) for k, v in m['series'].items()}) for name, m in _metrics.items()}
+    for name, metric in sorted(snapshot.items()):
+        if not metric['series']:
+            continue
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['kind']}")
+        for key, series in sorted(metric['series'].items()):
+            if metric['kind'] != 'histogram':
+                lines.append(f"{name}{_labels(key)} {_number(series[0])}")
+                continue
+            buckets, total, count = series
+            cumulative = 0
+            for bound, n in zip(metric['buckets'], buckets):
+                cumulative += n
+                lines.append(f"{name}_bucket{_labels(key + (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_bucket{_labels(key + (('le', '+Inf'),))} {count}")
+            lines.append(f"{name}_sum{_labels(key)} {_number(total)}")
+            lines.append(f"{name}_count{_labels(key)} {count}")
+    collected = {}
+    for collector in list(_collectors):
+        try:
+            samples = collector()
+        except Exception as e:
+            samples = [('drivesync_collector_errors', 'gauge', 'Collectors that failed at this scrape', {'collector': collector.__name__, 'error': type(e).__name__}, 1)]
+        for name, kind, help_text, labels, value in samples:
+            entry = collected.setdefault(name, {'kind': kind, 'help': help_text, 'samples': []})
+            entry['samples'].append((tuple(sorted(labels.items())), value))
+    for name, entry in sorted(collected.items()):
+        lines.append(f"# HELP {name} {entry['help']}")
+        lines.append(f"# TYPE {name} {entry['kind']}")
+        for key, value in entry['samples']:
+            lines.append(f"{name}{_labels(key)} {_number(value)}")
+    return '\n'.join(lines) + '\n'
+
+class HostSampler:
+    """Samples host CPU, memory and disk on a background thread, so requests never wait on psutil."""
+
+    def __init__(self, disk_path, interval=HOST_SAMPLE_SECONDS):
+        self.disk_path = disk_path
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._sample = None
+
+    def _take(self):
+        sample = {
+            # Percent since the previous call; the sampler's own calls set the window.
+            'cpu': psutil.cpu_percent(interval=None),
+            'mem': psutil.virtual_memory(),
+            'disk': psutil.disk_usage(self.disk_path),
+            'sampled_at': time.time(),
+        }
+        with self._lock:
+            self._sample = sample
+        return sample
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self._take()
+            except Exception:
+                pass
+
+    def _ensure_thread(self):
+        # Threads do not survive a fork, so a gunicorn worker starts its own sampler on first use.
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='host-sampler', daemon=True)
+            self._thread.start()
+
+    def latest(self):
+        self._ensure_thread()
+        with self._lock:
+            sample = self._sample
+        return sample if sample is not None else self._take()
+
+@register_collector
+def _process_samples():
+    return [('drivesync_process_info', 'gauge', 'Process serving this scrape', {'pid': os.getpid()}, 1)]
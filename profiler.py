@@ -0,0 +1,191 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from utils import log_info
+
+# Per-statement profiling of /query is off unless QUERY_PROFILE is set. Statements slower
+# than SLOW_QUERY_MS go to the slow-query log with their query plan.
+QUERY_PROFILE = os.getenv('QUERY_PROFILE', '').lower() in ('1', 'true', 'yes')
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '100'))
+# Slow statements kept (the oldest are dropped first), and distinct statements profiled.
+SLOW_QUERY_LOG_SIZE = int(os.getenv('SLOW_QUERY_LOG_SIZE', '500'))
+QUERY_PROFILE_MAX_STATEMENTS = int(os.getenv('QUERY_PROFILE_MAX_STATEMENTS', '1000'))
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?(?:e[+-]?\d+)?\b")
+_VALUE_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_TABLE_REF = re.compile(r"\b(?:from|join|update|into)\s+([\w\"\[\]`]+)(?:\s+(?:as\s+)?(?!where\b|join\b|on\b|set\b|inner\b|left\b|cross\b|natural\b|order\b|group\b|limit\b|using\b)(\w+))?")
+_CLAUSE = re.compile(r"\b(?:where|on)\b(.*?)(?=\b(?:group\s+by|order\s+by|limit|having|window|union|except|intersect|join|inner|left|cross|natural|returning)\b|\)\s*$|$)", re.S)
+_PREDICATE = re.compile(r"(?:(\w+)\.)?(\w+)\s*(==|=|<=|>=|<|>|\bis\b|\bin\b|\bbetween\b|\blike\b|\bglob\b)")
+_SCAN = re.compile(r"^SCAN (\w+)(.*)$")
+_AUTOMATIC_INDEX = re.compile(r"^SEARCH (\w+) USING AUTOMATIC")
+_EQUALITY = {'=', '==', 'is', 'in'}
+
+def fingerprint_sql(sql):
+    """SQL with literal values replaced by ?, so statements differing only in values group together."""
+    sql = ' '.join(_STRING.sub('?', sql.strip().rstrip(';')).split()).lower()
+    return _VALUE_LIST.sub('(...)', _NUMBER.sub('?', sql))
+
+def params_hash(params):
+    return hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+
+def _unquote(name):
+    return name.strip('"[]`')
+
+def explain(conn, sql, params):
+    """Detail lines of EXPLAIN QUERY PLAN, or None when the statement has no plan to show."""
+    try:
+        return [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+    except (sqlite3.Error, ValueError):
+        return None
+
+def full_scans(plan):
+    """Tables (as named in the plan, so possibly aliases) that the plan reads without an index.
+
+    SQLite building an automatic index for a join counts too: it does that when an index is missing.
+    """
+    scanned = []
+    for detail in plan or ():
+        match = _SCAN.match(detail)
+        if match and 'INDEX' not in match.group(2) and match.group(1) != 'CONSTANT':
+            scanned.append(match.group(1))
+        match = _AUTOMATIC_INDEX.match(detail)
+        if match:
+            scanned.append(match.group(1))
+    return scanned
+
+def suggest_indexes(conn, fingerprint, scanned):
+    """CREATE INDEX statements for the columns the statement filters the scanned tables on.
+
+    Equality columns come first, then at most one range column, as SQLite can use no more.
+    Only columns the table really has are suggested.
+    """
+    tables = {}
+    for table, alias in _TABLE_REF.findall(fingerprint):
+        table = _unquote(table)
+        tables[table] = table
+        if alias:
+            tables[alias] = table
+    suggestions = []
+    for name in scanned:
+        table = tables.get(name.lower())
+        if table is None:
+            continue
+        try:
+            columns = {row[1].lower() for row in conn.execute(f'PRAGMA table_info("{table}")')}
+        except sqlite3.Error:
+            continue
+        equality, ranged = [], []
+        for clause in _CLAUSE.findall(fingerprint):
+            for qualifier, column, op in _PREDICATE.findall(clause):
+                if qualifier and tables.get(qualifier) != table or column not in columns:
+                    continue
+                target = equality if op in _EQUALITY else ranged
+                if column not in equality and column not in ranged:
+                    target.append(column)
+        index_columns = (equality + ranged[:1])[:4]
+        if index_columns:
+            suggestions.append(f"CREATE INDEX idx_{table}_{'_'.join(index_columns)} ON {table} ({', '.join(index_columns)})")
+    return suggestions
+
+class QueryProfiler:
+    """Times the statements /query runs, keeps a bounded slow-query log and totals per statement.
+
+    Statements are grouped by fingerprint (SQL with literal values replaced). For every slow
+    statement the plan is taken on the connection that ran it, full table scans are flagged and
+    indexes that would avoid them are suggested. Like the other stats, this is per process.
+    """
+
+    def __init__(self, enabled=QUERY_PROFILE, slow_ms=SLOW_QUERY_MS, log_size=SLOW_QUERY_LOG_SIZE,
+                 max_statements=QUERY_PROFILE_MAX_STATEMENTS):
+        self.enabled = enabled
+        self.slow_seconds = slow_ms / 1000.0
+        self.max_statements = max(1, max_statements)
+        self._lock = threading.Lock()
+        self._slow = deque(maxlen=max(1, log_size))
+        self._statements = OrderedDict()
+
+    def record(self, conn, sql, params, seconds, rows, lock_wait=0.0, kind='read'):
+        """Account one statement. conn must still be the connection that ran it."""
+        fingerprint = fingerprint_sql(sql)
+        slow = seconds >= self.slow_seconds
+        entry = None
+        if slow:
+            plan = explain(conn, sql, params)
+            scanned = full_scans(plan)
+            entry = {
+                'at': time.time(),
+                'sql': fingerprint,
+                'params_hash': params_hash(params),
+                'kind': kind,
+                'ms': round(seconds * 1000, 3),
+                'rows': rows,
+                'lock_wait_ms': round(lock_wait * 1000, 3),
+                'plan': plan,
+                'full_scans': scanned,
+                'suggested_indexes': suggest_indexes(conn, fingerprint, scanned) if scanned else [],
+            }
+        with self._lock:
+            stats = self._statements.get(fingerprint)
+            if stats is None:
+                stats = self._statements[fingerprint] = {
+                    'sql': fingerprint, 'kind': kind, 'calls': 0, 'slow_calls': 0, 'total_seconds': 0.0,
+                    'max_seconds': 0.0, 'rows': 0, 'lock_wait_seconds': 0.0,
+                    'plan': None, 'full_scans': [], 'suggested_indexes': [],
+                }
+                while len(self._statements) > self.max_statements:
+                    self._statements.popitem(last=False)
+            else:
+                self._statements.move_to_end(fingerprint)
+            stats['calls'] += 1
+            stats['total_seconds'] += seconds
+            stats['max_seconds'] = max(stats['max_seconds'], seconds)
+            stats['rows'] += max(rows or 0, 0)
+            stats['lock_wait_seconds'] += lock_wait
+            if entry is not None:
+                stats['slow_calls'] += 1
+                # The latest plan wins, so an index added since shows up.
+                stats['plan'] = entry['plan']
+                stats['full_scans'] = entry['full_scans']
+                stats['suggested_indexes'] = entry['suggested_indexes']
+                self._slow.append(entry)
+        if entry is not None:
+            scans = f", full scan of {', '.join(entry['full_scans'])}" if entry['full_scans'] else ''
+            log_info(f"Slow query ({entry['ms']} ms, {rows} rows{scans}): {fingerprint}")
+
+    def top(self, limit=20, order='total'):
+        """The statements with the most total (or avg, max, calls) time, with their latest plan."""
+        keys = {
+            'total': lambda s: s['total_seconds'],
+            'avg': lambda s: s['total_seconds'] / s['calls'],
+            'max': lambda s: s['max_seconds'],
+            'calls': lambda s: s['calls'],
+        }
+        if order not in keys:
+            raise ValueError(f"order must be one of {', '.join(keys)}")
+        with self._lock:
+            statements = [dict(s) for s in self._statements.values()]
+        statements.sort(key=keys[order], reverse=True)
+        result = []
+        for s in statements[:limit]:
+            s['total_ms'] = round(s.pop('total_seconds') * 1000, 3)
+            s['avg_ms'] = round(s['total_ms'] / s['calls'], 3)
+            s['max_ms'] = round(s.pop('max_seconds') * 1000, 3)
+            s['lock_wait_ms'] = round(s.pop('lock_wait_seconds') * 1000, 3)
+            result.append(s)
+        return result
+
+    def slow(self, limit=50):
+        """The most recent slow statements, newest first."""
+        with self._lock:
+            return list(self._slow)[::-1][:limit]
+
+    def reset(self):
+        with self._lock:
+            self._slow.clear()
+            self._statements.clear()
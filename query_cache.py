@@ -0,0 +1,312 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Total size of cached result sets (0 disables the cache), and how long an entry may live.
+QUERY_CACHE_MAX_BYTES = int(os.getenv('QUERY_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+QUERY_CACHE_ENTRY_MAX_BYTES = int(os.getenv('QUERY_CACHE_ENTRY_MAX_BYTES', str(1024 * 1024)))
+QUERY_CACHE_TTL = float(os.getenv('QUERY_CACHE_TTL', '60'))
+# Statements whose analysis is kept; every statement is analyzed, so this bounds memory.
+ANALYZER_MAX_STATEMENTS = int(os.getenv('ANALYZER_MAX_STATEMENTS', '10000'))
+
+# Results that depend on these are not repeatable, so they are never cached.
+NONDETERMINISTIC_FUNCTIONS = {
+    'random', 'randomblob', 'changes', 'total_changes', 'last_insert_rowid',
+    'date', 'time', 'datetime', 'julianday', 'strftime', 'unixepoch', 'timediff',
+}
+_WRITE_ACTIONS_ARG1 = {
+    sqlite3.SQLITE_INSERT, sqlite3.SQLITE_UPDATE, sqlite3.SQLITE_DELETE,
+    sqlite3.SQLITE_CREATE_TABLE, sqlite3.SQLITE_CREATE_TEMP_TABLE,
+    sqlite3.SQLITE_DROP_TABLE, sqlite3.SQLITE_DROP_TEMP_TABLE,
+    sqlite3.SQLITE_CREATE_VIEW, sqlite3.SQLITE_DROP_VIEW,
+}
+_WRITE_ACTIONS_ARG2 = {
+    sqlite3.SQLITE_ALTER_TABLE, sqlite3.SQLITE_CREATE_INDEX, sqlite3.SQLITE_DROP_INDEX,
+    sqlite3.SQLITE_CREATE_TRIGGER, sqlite3.SQLITE_DROP_TRIGGER,
+}
+_SCHEMA_ACTIONS = {
+    sqlite3.SQLITE_CREATE_TABLE, sqlite3.SQLITE_CREATE_TEMP_TABLE, sqlite3.SQLITE_DROP_TABLE,
+    sqlite3.SQLITE_DROP_TEMP_TABLE, sqlite3.SQLITE_CREATE_VIEW, sqlite3.SQLITE_DROP_VIEW,
+} | _WRITE_ACTIONS_ARG2
+_UNCACHEABLE_ACTIONS = {sqlite3.SQLITE_PRAGMA, sqlite3.SQLITE_ATTACH, sqlite3.SQLITE_DETACH, sqlite3.SQLITE_TRANSACTION}
+# Table-valued pragmas report an UPDATE of the schema table while they are set up.
+_SCHEMA_TABLES = {'sqlite_master', 'sqlite_temp_master', 'sqlite_schema', 'sqlite_temp_schema'}
+# Anything that writes the database or changes the connection; PRAGMA is judged by sql_classify.py.
+_NOT_READONLY_ACTIONS = _WRITE_ACTIONS_ARG1 | _WRITE_ACTIONS_ARG2 | {
+    sqlite3.SQLITE_ANALYZE, sqlite3.SQLITE_ATTACH, sqlite3.SQLITE_DETACH, sqlite3.SQLITE_TRANSACTION,
+    sqlite3.SQLITE_SAVEPOINT, sqlite3.SQLITE_CREATE_VTABLE, sqlite3.SQLITE_DROP_VTABLE,
+    sqlite3.SQLITE_CREATE_TEMP_INDEX, sqlite3.SQLITE_DROP_TEMP_INDEX, sqlite3.SQLITE_CREATE_TEMP_TRIGGER,
+    sqlite3.SQLITE_DROP_TEMP_TRIGGER, sqlite3.SQLITE_CREATE_TEMP_VIEW, sqlite3.SQLITE_DROP_TEMP_VIEW,
+}
+
+_LITERAL = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")")
+
+def normalize_sql(sql):
+    """Collapse whitespace and case outside string literals, so trivially different SQL shares a key."""
+    parts = _LITERAL.split(sql.strip().rstrip(';').strip())
+    return ''.join(p if i % 2 else ' '.join(p.split()).lower() for i, p in enumerate(parts))
+
+class StatementInfo:
+    def __init__(self):
+        self.reads = set()
+        self.writes = set()
+        self.schema_change = False
+        self.cacheable = True
+        self.readonly = True
+        # (name, argument) of each PRAGMA; the argument is None when the pragma is only queried.
+        self.pragmas = []
+
+class StatementAnalyzer:
+    """Finds the tables a statement reads and writes by compiling it under an authorizer.
+
+    The statement is only compiled (via EXPLAIN), never run, on a private read-only connection.
+    Results are kept per SQL text until the schema changes.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._current = None
+        self._infos = {}
+
+    def _authorize(self, action, arg1, arg2, db_name, trigger):
+        info = self._current
+        if action == sqlite3.SQLITE_READ and arg1:
+            info.reads.add(arg1.lower())
+        elif action in _WRITE_ACTIONS_ARG1 and arg1:
+            info.writes.add(arg1.lower())
+        elif action in _WRITE_ACTIONS_ARG2 and arg2:
+            info.writes.add(arg2.lower())
+        elif action == sqlite3.SQLITE_FUNCTION and arg2 and arg2.lower() in NONDETERMINISTIC_FUNCTIONS:
+            info.cacheable = False
+        elif action in _UNCACHEABLE_ACTIONS:
+            info.cacheable = False
+        if action in _SCHEMA_ACTIONS:
+            info.schema_change = True
+        if action in _NOT_READONLY_ACTIONS and not (action == sqlite3.SQLITE_UPDATE and arg1 in _SCHEMA_TABLES):
+            info.readonly = False
+        elif action == sqlite3.SQLITE_PRAGMA and arg1:
+            info.pragmas.append((arg1.lower(), arg2))
+        return sqlite3.SQLITE_OK
+
+    def _connection(self):
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+            self._conn.set_authorizer(self._authorize)
+            self._pid = os.getpid()
+        return self._conn
+
+    def analyze(self, sql, params=()):
+        """StatementInfo for sql, or None when it cannot be compiled against the current schema.
+
+        params are only bound to satisfy the placeholders; EXPLAIN does not run the statement.
+        """
+        with self._lock:
+            info = self._infos.get(sql)
+            if info is not None:
+                return info
+            info = self._current = StatementInfo()
+            try:
+                self._connection().execute('EXPLAIN ' + sql, params).fetchall()
+            except sqlite3.Error:
+                return None
+            finally:
+                self._current = None
+            if 'current_' in normalize_sql(sql):
+                info.cacheable = False
+            if len(self._infos) >= ANALYZER_MAX_STATEMENTS:
+                self._infos.clear()
+            self._infos[sql] = info
+            return info
+
+    def reset(self):
+        with self._lock:
+            self._infos.clear()
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.close()
+            self._conn = None
+
+class ResultCache:
+    """LRU cache of read results, bounded by bytes and TTL, invalidated per table by writes.
+
+    Writes from this process invalidate just the tables they touch. Writes from other
+    processes are noticed through the database and WAL file stats and clear everything.
+    """
+
+    def __init__(self, db_path, max_bytes=QUERY_CACHE_MAX_BYTES, entry_max_bytes=QUERY_CACHE_ENTRY_MAX_BYTES, ttl=QUERY_CACHE_TTL):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.entry_max_bytes = entry_max_bytes
+        self.ttl = ttl
+        self.analyzer = StatementAnalyzer(db_path)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._by_table = {}
+        self._bytes = 0
+        self._generation = 0
+        self._known_version = None
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expired = 0
+        self._invalidations = 0
+        self._uncacheable = 0
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _file_version(self):
+        version = []
+        for path in (self.db_path, self.db_path + '-wal'):
+            try:
+                st = os.stat(path)
+                version.append((st.st_ino, st.st_mtime_ns, st.st_size))
+            except OSError:
+                version.append(None)
+        return tuple(version)
+
+    def _key(self, sql, params):
+        return normalize_sql(sql) + '\x00' + json.dumps(params, sort_keys=True, default=str)
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._bytes -= entry['size']
+        for table in entry['tables']:
+            keys = self._by_table.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_table[table]
+
+    def _clear(self):
+        self._entries.clear()
+        self._by_table.clear()
+        self._bytes = 0
+        self._generation += 1
+
+    def _check_version(self):
+        version = self._file_version()
+        if version != self._known_version:
+            if self._known_version is not None:
+                self._clear()
+                self.analyzer.reset()
+            self._known_version = version
+
+    def generation(self):
+        with self._lock:
+            return self._generation
+
+    def get(self, sql, params):
+        """(rows, columns) for a cached read, or None."""
+        if not self.enabled:
+            return None
+        key = self._key(sql, params)
+        with self._lock:
+            self._check_version()
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+            if entry['expires'] < time.monotonic():
+                self._drop(key)
+                self._expired += 1
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry['rows'], entry['columns']
+
+    def put(self, sql, params, rows, columns, generation):
+        """Cache a read result, unless a write invalidated anything since `generation` was taken."""
+        if not self.enabled:
+            return
+        info = self.analyzer.analyze(sql, params)
+        if info is None or not info.cacheable or info.writes:
+            with self._lock:
+                self._uncacheable += 1
+            return
+        size = len(json.dumps(rows, default=str)) + len(sql)
+        if size > self.entry_max_bytes:
+            with self._lock:
+                self._uncacheable += 1
+            return
+        key = self._key(sql, params)
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._drop(key)
+            self._entries[key] = {
+                'rows': rows, 'columns': columns, 'tables': frozenset(info.reads),
+                'expires': time.monotonic() + self.ttl, 'size': size,
+            }
+            self._bytes += size
+            for table in info.reads:
+                self._by_table.setdefault(table, set()).add(key)
+            while self._bytes > self.max_bytes and self._entries:
+                self._drop(next(iter(self._entries)))
+                self._evictions += 1
+
+    def tables_written(self, statements):
+        """Tables the given (sql, params) pairs write, or None if that cannot be determined.
+
+        Call before running the writes, so e.g. a DROP TABLE still compiles.
+        """
+        tables = set()
+        for sql, params in statements:
+            info = self.analyzer.analyze(sql, params)
+            if info is None or info.schema_change:
+                return None
+            tables |= info.writes
+        return tables
+
+    def before_write(self):
+        """Call once the write lock is held, before writing: a change to the file since it was
+        last looked at came from another process, and clears everything."""
+        with self._lock:
+            self._check_version()
+
+    def invalidate(self, tables):
+        """Drop results that read any of `tables` (None means everything).
+
+        Call after before_write() and while still holding the write lock, so the file stats
+        recorded here include this process's write but no other process's.
+        """
+        if tables is None:
+            self.analyzer.reset()
+        with self._lock:
+            self._invalidations += 1
+            if tables is None:
+                self._clear()
+            else:
+                self._generation += 1
+                for table in tables:
+                    for key in list(self._by_table.get(table, ())):
+                        self._drop(key)
+            self._known_version = self._file_version()
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'enabled': self.enabled,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / lookups, 3) if lookups else None,
+                'evictions': self._evictions,
+                'expired': self._expired,
+                'invalidations': self._invalidations,
+                'uncacheable': self._uncacheable,
+            }
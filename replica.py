@@ -0,0 +1,137 @@
+import os
+import sqlite3
+import threading
+import time
+from db_manager import calculate_db_hash, replace_db_file, rotate_local_manifests
+from db_shared import get_last_hash, set_last_hash, get_last_timestamp, set_last_timestamp
+from drive_utils import (get_drive_service, invalidate_drive_cache, latest_published_backup,
+                         download_drive_file, download_drive_json, download_latest_manifest_from_drive)
+from utils import log_info, log_error, backup_lock
+
+# A replica serves reads from the latest backup on Drive and refuses writes.
+REPLICA_MODE = os.getenv('REPLICA_MODE', '').lower() in ('1', 'true', 'yes')
+REPLICA_POLL_SECONDS = float(os.getenv('REPLICA_POLL_SECONDS', '30'))
+
+class ReplicaSyncer:
+    """Keeps a read-only copy of the database in step with the latest backup on Drive.
+
+    The primary publishes each backup's hash and timestamp as Drive appProperties. Every
+    worker polls them; the first to see a new backup downloads it (incremental manifests
+    reuse the local chunk store, so only changed chunks are fetched) into a staging file
+    and renames it over the database. Reads already running keep the old file open, new
+    connections get the new one, and the pools replace their connections on the inode change.
+    The applied hash and timestamp are kept with db_shared, so workers on a host agree.
+    """
+
+    def __init__(self, db_path, poll_seconds=REPLICA_POLL_SECONDS):
+        self.db_path = db_path
+        self.poll_seconds = poll_seconds
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pid = None
+        self._remote = None
+        self._last_poll = None
+        self._last_poll_ok = None
+        self._polls_failed = 0
+        self._refreshes = 0
+        self._refreshes_failed = 0
+        self._last_refresh_seconds = None
+
+    def ensure_thread(self):
+        # Threads do not survive a fork, so a gunicorn worker starts its own poller on first use.
+        with self._cond:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='replica-sync', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                log_error(f"Replica refresh failed: {e}")
+            with self._cond:
+                self._cond.wait(self.poll_seconds)
+
+    def refresh(self):
+        """Apply the latest published backup if it is newer than ours. Returns True if it swapped."""
+        try:
+            latest = latest_published_backup(get_drive_service())
+        except Exception:
+            with self._cond:
+                self._polls_failed += 1
+                self._last_poll = time.time()
+            raise
+        with self._cond:
+            self._remote = latest
+            self._last_poll = self._last_poll_ok = time.time()
+        if latest is None or latest['hash'] == get_last_hash():
+            return False
+        with backup_lock():
+            # Another worker on this host may have applied it while we waited.
+            if latest['hash'] == get_last_hash():
+                return False
+            start = time.perf_counter()
+            try:
+                self._apply(latest)
+            except Exception:
+                with self._cond:
+                    self._refreshes_failed += 1
+                raise
+            set_last_hash(latest['hash'])
+            set_last_timestamp(latest['timestamp'])
+        with self._cond:
+            self._refreshes += 1
+            self._last_refresh_seconds = round(time.perf_counter() - start, 3)
+        log_info(f"Replica refreshed to {latest['name']} from {time.ctime(latest['timestamp'])} "
+                 f"in {self._last_refresh_seconds}s.")
+        return True
+
+    def _apply(self, latest):
+        service = get_drive_service()
+        staging = self.db_path + '.replica'
+        # File IDs and chunk listings change with every upload from the primary.
+        invalidate_drive_cache()
+        if latest['name'] == 'manifest_1.json':
+            if not download_latest_manifest_from_drive(service, staging):
+                raise RuntimeError("could not rebuild the database from manifest_1.json")
+            # Keeping the manifest locally lets the next refresh prune chunks nothing refers to.
+            rotate_local_manifests(download_drive_json(service, 'manifest_1.json'))
+        else:
+            with open(staging, 'wb') as f:
+                download_drive_file(service, latest['id'], f)
+            if calculate_db_hash(staging) != latest['hash']:
+                os.remove(staging)
+                raise RuntimeError("downloaded db_1.sqlite does not match its published hash")
+        # Readers open the file read-only, which needs a rollback journal rather than WAL.
+        conn = sqlite3.connect(staging)
+        try:
+            conn.execute('PRAGMA journal_mode=DELETE')
+        finally:
+            conn.close()
+        replace_db_file(staging, self.db_path)
+
+    def stats(self):
+        applied_hash = get_last_hash()
+        applied_ts = get_last_timestamp()
+        with self._cond:
+            remote = self._remote
+            now = time.time()
+            behind = remote is not None and remote['hash'] != applied_hash
+            return {
+                'applied_hash': applied_hash,
+                'applied_timestamp': applied_ts or None,
+                'remote_hash': remote['hash'] if remote else None,
+                'remote_timestamp': remote['timestamp'] if remote else None,
+                'behind': behind,
+                # How long the newest backup has been waiting to be applied (0 when caught up).
+                'lag_seconds': round(max(0.0, now - remote['timestamp']), 3) if behind else 0.0,
+                'seconds_since_poll': round(now - self._last_poll_ok, 3) if self._last_poll_ok else None,
+                'poll_seconds': self.poll_seconds,
+                'polls_failed': self._polls_failed,
+                'refreshes': self._refreshes,
+                'refreshes_failed': self._refreshes_failed,
+                'last_refresh_seconds': self._last_refresh_seconds,
+            }
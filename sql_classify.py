@@ -0,0 +1,103 @@
+import re
+
+# Statements that start with these only ever read. EXPLAIN compiles its statement without running it.
+READ_VERBS = {'select', 'values', 'explain'}
+# These cannot run inside a transaction (VACUUM, ATTACH) or only change the connection.
+ALONE_VERBS = {'vacuum', 'attach', 'detach'}
+# Row changes; total_changes tells whether they changed anything.
+DML_VERBS = {'insert', 'update', 'delete', 'replace'}
+# Transaction control. Writes run in transactions the server manages, so requests cannot send these.
+TRANSACTION_VERBS = {'begin', 'commit', 'end', 'rollback', 'savepoint', 'release'}
+# These write or change the connection, and some never reach the authorizer (VACUUM, REINDEX).
+WRITE_VERBS = {'vacuum', 'reindex', 'analyze', 'attach', 'detach'} | TRANSACTION_VERBS
+# Pragmas that take an argument and still only report.
+READ_PRAGMAS = {
+    'table_info', 'table_xinfo', 'table_list', 'index_info', 'index_xinfo', 'index_list',
+    'foreign_key_list', 'foreign_key_check', 'integrity_check', 'quick_check', 'database_list',
+    'collation_list', 'function_list', 'module_list', 'pragma_list', 'compile_options',
+}
+# Pragmas that write without an argument.
+WRITE_PRAGMAS = {'optimize', 'wal_checkpoint', 'incremental_vacuum', 'shrink_memory'}
+
+# Comments, literals and quoted names are skipped; words and single characters are kept.
+_TOKEN = re.compile(r"""\s+|--[^\n]*|/\*.*?(?:\*/|\Z)|'(?:[^']|'')*'?|"(?:[^"]|"")*"?|`(?:[^`]|``)*`?|\[[^\]]*\]?"""
+                    r"""|([A-Za-z_][A-Za-z0-9_$]*)|(.)""", re.S)
+
+def _tokens(sql):
+    """(token, paren depth) for the words (lowercased) and symbols of sql."""
+    depth = 0
+    for match in _TOKEN.finditer(sql):
+        word, symbol = match.groups()
+        if word:
+            yield word.lower(), depth
+        elif symbol == '(':
+            yield symbol, depth
+            depth += 1
+        elif symbol == ')':
+            depth = max(0, depth - 1)
+            yield symbol, depth
+        elif symbol:
+            yield symbol, depth
+
+def main_verb(sql):
+    """First keyword of sql after any comments; for WITH, the statement the CTEs lead into."""
+    tokens = _tokens(sql)
+    first = next((token for token, _ in tokens), None)
+    if first != 'with':
+        return first
+    for token, depth in tokens:
+        if depth == 0 and (token in DML_VERBS or token in ('select', 'values')):
+            return token
+    return first
+
+def _pragma_writes(name, argument):
+    return name in WRITE_PRAGMAS or (argument is not None and name not in READ_PRAGMAS)
+
+def _lexical_pragma_writes(sql):
+    tokens = [token for token, _ in _tokens(sql)][1:]
+    # PRAGMA [schema.]name [= value | (value)]
+    if len(tokens) > 2 and tokens[1] == '.':
+        tokens = tokens[2:]
+    if not tokens:
+        return False
+    argument = tokens[2] if len(tokens) > 2 and tokens[1] in ('=', '(') else None
+    return _pragma_writes(tokens[0], argument)
+
+def is_write(sql, params=(), analyzer=None):
+    """True unless sql can only read, so writes never run on a reader or outside the write lock.
+
+    The statement is compiled under the analyzer's authorizer (see query_cache.StatementAnalyzer)
+    when one is given. When it does not compile, e.g. its table is created earlier in the same
+    batch, the leading keyword decides and anything not known to read counts as a write.
+    """
+    verb = main_verb(sql)
+    if verb in WRITE_VERBS or verb in DML_VERBS:
+        return True
+    if verb == 'explain':
+        return False
+    info = analyzer.analyze(sql, params) if analyzer is not None else None
+    if info is not None:
+        return not info.readonly or any(_pragma_writes(name, arg) for name, arg in info.pragmas)
+    if verb == 'pragma':
+        return _lexical_pragma_writes(sql)
+    return verb not in READ_VERBS
+
+def runs_alone(sql):
+    """Whether sql has to run by itself rather than in a write batch: VACUUM, ATTACH, DETACH,
+    CREATE TEMP and PRAGMA assignments, which either fail inside a transaction or change the
+    connection that runs them."""
+    tokens = [token for token, _ in _tokens(sql)]
+    if not tokens:
+        return False
+    if tokens[0] in ALONE_VERBS:
+        return True
+    if tokens[0] == 'create':
+        return len(tokens) > 1 and tokens[1] in ('temp', 'temporary')
+    return tokens[0] == 'pragma' and _lexical_pragma_writes(sql)
+
+def controls_transaction(sql):
+    return main_verb(sql) in TRANSACTION_VERBS
+
+def only_changes_rows(statements):
+    """Whether every sql in statements is an INSERT, UPDATE, DELETE or REPLACE (WITH included)."""
+    return all(main_verb(sql) in DML_VERBS for sql in statements)
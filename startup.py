@@ -0,0 +1,66 @@
+import json
+import os
+import time
+import psutil
+from utils import log_info, log_error, startup_lock, tmp_PATH
+
+# Written by the worker that initialized the database, so its siblings can skip that work.
+STARTUP_MARKER = os.path.join(tmp_PATH, 'startup.json')
+
+def _server_id():
+    """The process that started the workers (the gunicorn master), as pid and start time.
+
+    The start time tells a reused pid apart from the process that wrote the marker.
+    """
+    ppid = os.getppid()
+    try:
+        return [ppid, psutil.Process(ppid).create_time()]
+    except psutil.Error:
+        return [ppid, None]
+
+def _db_id(db_path):
+    try:
+        st = os.stat(db_path)
+        return [st.st_dev, st.st_ino]
+    except OSError:
+        return None
+
+def _read_marker():
+    try:
+        with open(STARTUP_MARKER) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _write_marker(marker):
+    tmp = STARTUP_MARKER + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(marker, f)
+    os.replace(tmp, STARTUP_MARKER)
+
+def run_once_per_server(db_path, settings, init):
+    """Run init() in the first worker of a server only. Returns True if it ran in this process.
+
+    Every worker of one gunicorn master has that master as its parent. The first worker to take
+    the startup lock runs init() and records the master, the database file init() left behind
+    and the settings it depends on. The other workers wait on the lock, find the record matching
+    and skip init(), as do workers the master respawns later. A new server, a replaced or
+    missing database file, or changed settings run init() again.
+    """
+    expected = json.loads(json.dumps({'server': _server_id(), 'settings': settings}))
+    with startup_lock():
+        marker = _read_marker()
+        db_id = _db_id(db_path)
+        if (marker is not None and db_id is not None and marker.get('db') == db_id
+                and {k: marker.get(k) for k in expected} == expected):
+            log_info(f"Startup: database already initialized by worker {marker.get('pid')}, skipping.")
+            return False
+        start = time.perf_counter()
+        init()
+        db_id = _db_id(db_path)
+        if db_id is None:
+            log_error("Startup: no database after initialization; the next worker will try again.")
+            return True
+        _write_marker(dict(expected, db=db_id, pid=os.getpid(), at=time.time()))
+        log_info(f"Startup: database initialized in {time.perf_counter() - start:.3f}s.")
+        return True
@@ -0,0 +1,221 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from db_manager import db_exists, validate_sqlite_db, snapshot_db, calculate_db_hash, rotate_local_backups, ChangeWatcher, JWT_LOGIN_DDL
+from db_pool import close_pools
+from db_shared import get_last_hash, set_last_hash, set_last_timestamp
+from query_cache import StatementAnalyzer
+from utils import log_info, log_error, file_lock, tmp_PATH
+
+# Tenant databases are off unless MULTI_TENANT is set; the default database is always served.
+MULTI_TENANT = os.getenv('MULTI_TENANT', '').lower() in ('1', 'true', 'yes')
+TENANT_DIR = os.getenv('TENANT_DIR') or os.path.join(tmp_PATH, 'tenants')
+# Tenants whose connection pools stay open in a process; the least recently used are closed first.
+TENANT_MAX_OPEN = int(os.getenv('TENANT_MAX_OPEN', '64'))
+# How long the list of tenants with a backup on Drive is reused before Drive is asked again.
+# A name neither on disk nor in that list is unknown, without a Drive call of its own.
+TENANT_MISS_TTL = float(os.getenv('TENANT_MISS_TTL', '60'))
+
+TENANT_NAME = re.compile(r'^[a-z0-9][a-z0-9_-]{0,62}$')
+DRIVE_BACKUP_NAME = re.compile(r'^tenant_([a-z0-9][a-z0-9_-]{0,62})__db_\d+\.sqlite$')
+
+class UnknownTenant(Exception):
+    pass
+
+class Tenant:
+    """Files of one tenant database, all kept in its own directory under TENANT_DIR."""
+
+    def __init__(self, name, root=TENANT_DIR):
+        self.name = name
+        self.dir = os.path.join(root, name)
+        self.db_path = os.path.join(self.dir, 'db.sqlite')
+        self.backup_dir = os.path.join(self.dir, 'backups')
+        # The lock file names are the same for every tenant, so lock metrics stay a few series.
+        self.lock_file = os.path.join(self.dir, 'tenant.lock')
+        self.backup_lock_file = os.path.join(self.dir, 'tenant_backup.lock')
+        self.hash_path = os.path.join(self.dir, 'db_hash.txt')
+        self.timestamp_path = os.path.join(self.dir, 'db_timestamp.txt')
+        # Drive has no folders here; the prefix keeps each tenant's backup set apart.
+        self.drive_prefix = f"tenant_{name}__"
+        # Compiles statements against this tenant's schema, to tell its reads from its writes.
+        self.analyzer = StatementAnalyzer(self.db_path)
+
+    def write_lock(self):
+        return file_lock(self.lock_file)
+
+    def backup_lock(self):
+        return file_lock(self.backup_lock_file)
+
+def check_name(name):
+    if not isinstance(name, str) or not TENANT_NAME.match(name):
+        raise ValueError('tenant names are 1-63 lowercase letters, digits, "_" or "-"')
+    return name
+
+class TenantRegistry:
+    """Tenants this process has open, with at most max_open connection pools kept.
+
+    A tenant that is not on disk is restored from its Drive backup on first use. Which tenants
+    have one is learned from a single listing of Drive, refreshed at most every TENANT_MISS_TTL,
+    so requests naming tenants that were never created cost no Drive calls and leave nothing
+    behind. Evicting a tenant only closes its pools; its files stay and it is reopened on the
+    next request.
+    """
+
+    def __init__(self, root=TENANT_DIR, max_open=TENANT_MAX_OPEN, required_tables=('jwt_login',)):
+        self.root = root
+        self.max_open = max(1, max_open)
+        self.required_tables = list(required_tables)
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._open = OrderedDict()
+        # Tenants with a backup on Drive, and when that was last listed.
+        self._on_drive = set()
+        self._on_drive_listed = None
+        self._opened = 0
+        self._evicted = 0
+        self._restored = 0
+        # Backups of a tenant nobody wrote to since its last one skip the snapshot and hash.
+        self._changes = ChangeWatcher(self.max_open)
+
+    def _touch(self, tenant):
+        evicted = []
+        with self._lock:
+            if self._pid != os.getpid():
+                # Pools do not cross a fork, so neither does the list of open tenants.
+                self._open.clear()
+                self._pid = os.getpid()
+            if tenant.name in self._open:
+                self._open.move_to_end(tenant.name)
+                return self._open[tenant.name]
+            self._open[tenant.name] = tenant
+            self._opened += 1
+            while len(self._open) > self.max_open:
+                evicted.append(self._open.popitem(last=False)[1])
+                self._evicted += 1
+        for old in evicted:
+            close_pools(old.db_path)
+            old.analyzer.reset()
+        return tenant
+
+    def get(self, name):
+        """The tenant called name, restored from Drive if need be. Raises UnknownTenant."""
+        tenant = Tenant(check_name(name), self.root)
+        with self._lock:
+            if name in self._open and self._pid == os.getpid():
+                self._open.move_to_end(name)
+                return self._open[name]
+        if not db_exists(tenant.db_path):
+            if not self._backed_up_on_drive(name) or not self._restore(tenant):
+                raise UnknownTenant(name)
+        return self._touch(tenant)
+
+    def _backed_up_on_drive(self, name):
+        with self._lock:
+            listed = self._on_drive_listed
+            if listed is not None and time.monotonic() - listed < TENANT_MISS_TTL:
+                return name in self._on_drive
+            # Claimed before listing, so concurrent requests use the previous list meanwhile.
+            self._on_drive_listed = time.monotonic()
+        from drive_utils import get_drive_service, list_drive_files
+        names = set()
+        try:
+            for f in list_drive_files(get_drive_service(), 'tenant_', fresh=True):
+                match = DRIVE_BACKUP_NAME.match(f['name'])
+                if match:
+                    names.add(match.group(1))
+        except Exception as e:
+            log_error(f"Listing tenant backups on Drive failed: {e}")
+            with self._lock:
+                return name in self._on_drive
+        with self._lock:
+            self._on_drive = names
+        return name in names
+
+    def _restore(self, tenant):
+        from drive_utils import download_latest_db_from_drive
+        os.makedirs(tenant.dir, exist_ok=True)
+        with tenant.write_lock():
+            if db_exists(tenant.db_path):
+                return True
+            tmp_path = tenant.db_path + '.download'
+            if download_latest_db_from_drive(tmp_path, prefix=tenant.drive_prefix) and validate_sqlite_db(tmp_path, self.required_tables):
+                os.replace(tmp_path, tenant.db_path)
+                with self._lock:
+                    self._restored += 1
+                log_info(f"Tenant {tenant.name}: restored from Drive.")
+                return True
+        # Names nobody created leave nothing behind.
+        for path in (tenant.db_path + '.download', tenant.lock_file):
+            if os.path.exists(path):
+                os.remove(path)
+        try:
+            os.rmdir(tenant.dir)
+        except OSError:
+            pass
+        return False
+
+    def create(self, name, username, password_hash):
+        """Create a tenant database with its first user. Raises FileExistsError if it exists."""
+        tenant = Tenant(check_name(name), self.root)
+        os.makedirs(tenant.dir, exist_ok=True)
+        with tenant.write_lock():
+            if db_exists(tenant.db_path):
+                raise FileExistsError(f"tenant {name} already exists")
+            conn = sqlite3.connect(tenant.db_path)
+            try:
+                conn.execute('PRAGMA journal_mode=WAL;')
+                conn.execute(JWT_LOGIN_DDL)
+                conn.execute('INSERT INTO jwt_login (username, password) VALUES (?,?)', (username, password_hash))
+                conn.commit()
+            finally:
+                conn.close()
+        log_info(f"Tenant {name}: created.")
+        return self._touch(tenant)
+
+    def names(self):
+        """Tenants on disk on this host."""
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root)
+                      if TENANT_NAME.match(name) and db_exists(os.path.join(self.root, name, 'db.sqlite')))
+
+    def backup(self, name):
+        """Back up one tenant: a full copy kept locally and on Drive. False when nothing changed."""
+        from drive_utils import rotate_drive_backups
+        tenant = Tenant(check_name(name), self.root)
+        with tenant.backup_lock():
+            version = self._changes.version(tenant.db_path)
+            if not self._changes.changed(tenant.db_path, version):
+                return False
+            snapshot_path = snapshot_db(tenant.db_path, os.path.join(tenant.dir, 'db_pending.sqlite'))
+            new_hash = calculate_db_hash(snapshot_path)
+            if new_hash == get_last_hash(tenant.hash_path):
+                os.remove(snapshot_path)
+                self._changes.mark(tenant.db_path, version)
+                return False
+            taken = time.time()
+            rotate_local_backups(tenant.db_path, snapshot_path, tenant.backup_dir)
+            # The hash is recorded only once Drive has the copy, so a failed upload is retried.
+            rotate_drive_backups(os.path.join(tenant.backup_dir, 'db_1.sqlite'),
+                                 {'db_hash': new_hash, 'db_timestamp': str(taken)}, tenant.drive_prefix)
+            set_last_hash(new_hash, tenant.hash_path)
+            set_last_timestamp(taken, tenant.timestamp_path)
+            self._changes.mark(tenant.db_path, version)
+            log_info(f"Tenant {name}: backed up.")
+            return True
+
+    def stats(self):
+        with self._lock:
+            open_names = list(self._open) if self._pid == os.getpid() else []
+            return {
+                'open': len(open_names),
+                'max_open': self.max_open,
+                'opened': self._opened,
+                'evicted': self._evicted,
+                'restored_from_drive': self._restored,
+                'backed_up_on_drive': len(self._on_drive),
+                'recently_used': open_names[::-1][:10],
+            }
@@ -0,0 +1,75 @@
+import os
+
+MB = 1024 * 1024
+
+# SQLite settings per host size; SQLITE_PROFILE picks one and the SQLITE_* variables below
+# override single values. Memory is per gunicorn worker: multiply by the worker count.
+#   cache_kb            page cache of each connection (PRAGMA cache_size, in KiB)
+#   mmap_bytes          how much of the file reads map instead of copying into the cache
+#   wal_autocheckpoint  WAL pages after which a committing connection checkpoints
+#   journal_size_limit  bytes the -wal file is cut back to after a checkpoint resets it
+#   busy_timeout_ms     how long a connection waits on a lock before failing
+#   heap_limit_bytes    soft limit on all SQLite memory in the worker; caches shrink to fit
+#   read_pool_size      pooled read connections per database
+#   wal_checkpoint_bytes  -wal size at which the checkpoint manager steps in
+PROFILES = {
+    # Small hosts and many workers: little cache, no mmap, WAL kept short.
+    'low-memory': {
+        'cache_kb': 4 * 1024,
+        'mmap_bytes': 0,
+        'wal_autocheckpoint': 500,
+        'journal_size_limit': 8 * MB,
+        'busy_timeout_ms': 10000,
+        'heap_limit_bytes': 48 * MB,
+        'read_pool_size': 2,
+        'wal_checkpoint_bytes': 16 * MB,
+    },
+    # The previous fixed settings (64 MB cache per connection), with mmap and a worker-wide cap.
+    'balanced': {
+        'cache_kb': 64000,
+        'mmap_bytes': 256 * MB,
+        'wal_autocheckpoint': 1000,
+        'journal_size_limit': 32 * MB,
+        'busy_timeout_ms': 10000,
+        'heap_limit_bytes': 512 * MB,
+        'read_pool_size': 4,
+        'wal_checkpoint_bytes': 64 * MB,
+    },
+    # Large hosts serving mostly reads: the file mapped whole, more readers, checkpoints batched.
+    'read-heavy': {
+        'cache_kb': 128 * 1024,
+        'mmap_bytes': 4096 * MB,
+        'wal_autocheckpoint': 4000,
+        'journal_size_limit': 64 * MB,
+        'busy_timeout_ms': 10000,
+        'heap_limit_bytes': 2048 * MB,
+        'read_pool_size': 8,
+        'wal_checkpoint_bytes': 256 * MB,
+    },
+}
+DEFAULT_PROFILE = 'balanced'
+
+def load_profile(name=None, env=os.environ):
+    """Settings of the named profile (SQLITE_PROFILE by default) with SQLITE_* overrides applied."""
+    name = (name or env.get('SQLITE_PROFILE') or DEFAULT_PROFILE).lower()
+    if name not in PROFILES:
+        raise ValueError(f"Unknown SQLITE_PROFILE {name!r}; expected one of {', '.join(PROFILES)}")
+    settings = dict(PROFILES[name], name=name)
+    for key in PROFILES[name]:
+        value = env.get('SQLITE_' + key.upper())
+        if value:
+            settings[key] = int(value)
+    return settings
+
+PROFILE = load_profile()
+
+def connection_pragmas(settings=PROFILE):
+    """PRAGMA statements that apply settings to a new connection."""
+    return [
+        f"PRAGMA cache_size = {-abs(settings['cache_kb'])};",
+        f"PRAGMA mmap_size = {settings['mmap_bytes']};",
+        f"PRAGMA wal_autocheckpoint = {settings['wal_autocheckpoint']};",
+        f"PRAGMA journal_size_limit = {settings['journal_size_limit']};",
+        # Process-wide in SQLite; repeating it per connection is harmless.
+        f"PRAGMA soft_heap_limit = {settings['heap_limit_bytes']};",
+    ]
@@ -1,61 +1,277 @@
 import os
+import sys
+import atexit
 import logging
+import logging.handlers
+import queue
 import portalocker
 import platform
 from contextlib import contextmanager
 import sqlite3
+import threading
 import time
+from collections import deque
+import metrics
+from tuning import PROFILE, connection_pragmas
 
-tmp_PATH = os.path.join(os.path.dirname(__file__), 'temp') if platform.system() == 'Windows' else '/tmp/Drive_temp'
+tmp_PATH = os.getenv('RUNTIME_DIR') or (os.path.join(os.path.dirname(__file__), 'temp') if platform.system() == 'Windows' else '/tmp/Drive_temp')
 
 LOCK_FILE = os.path.join(tmp_PATH,'db.lock')
+BACKUP_LOCK_FILE = os.path.join(tmp_PATH,'backup.lock')
+STARTUP_LOCK_FILE = os.path.join(tmp_PATH,'startup.lock')
 LOG_FILE = os.path.join(tmp_PATH,'app.log')
 
 os.makedirs(os.path.dirname(LOCK_FILE),exist_ok=True)
 os.makedirs(os.path.dirname(LOG_FILE),exist_ok=True)
 
-# Setup logging
-logging.basicConfig(
-    filename=LOG_FILE,
-    level=logging.INFO,
-    format='%(asctime)s %(levelname)s %(message)s'
-)
+# app.log is rotated at LOG_MAX_BYTES, keeping LOG_BACKUP_COUNT old files.
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', '5'))
+
+class SharedRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """RotatingFileHandler for a file every gunicorn worker appends to.
+
+    Rollover happens under a file lock, and a process that finds the file was rotated
+    by another one reopens it rather than writing on into the renamed file.
+    """
+
+    def _rotated(self):
+        try:
+            return os.stat(self.baseFilename).st_ino != os.fstat(self.stream.fileno()).st_ino
+        except FileNotFoundError:
+            return True
+
+    def emit(self, record):
+        try:
+            if self.stream is not None and self._rotated():
+                self.stream.close()
+                self.stream = None
+            if self.stream is None:
+                self.stream = self._open()
+            if self.shouldRollover(record):
+                with open(self.baseFilename + '.lock', 'a') as lock_file:
+                    portalocker.lock(lock_file, portalocker.LOCK_EX)
+                    # Another process may have rolled it over while we waited.
+                    if self._rotated():
+                        self.stream.close()
+                        self.stream = self._open()
+                    if self.shouldRollover(record):
+                        self.doRollover()
+            logging.FileHandler.emit(self, record)
+        except Exception:
+            self.handleError(record)
+
+_log_queue = queue.Queue()
+_log_listener = None
+
+def _start_log_listener():
+    """Write queued records to app.log and stdout on a background thread."""
+    global _log_queue, _log_listener
+    file_handler = SharedRotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT,
+                                             encoding='utf-8', delay=True)
+    file_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+    # Stands in for the print() log_info and log_error used to do; other loggers stay out of it.
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setFormatter(logging.Formatter('%(message)s'))
+    console_handler.addFilter(lambda record: record.name == 'root')
+    _log_listener = logging.handlers.QueueListener(_log_queue, file_handler, console_handler)
+    _log_listener.start()
+
+def _restart_log_listener():
+    # The listener thread does not survive a fork, and the queue's lock may have been held
+    # at the time, so a forked child starts over with a fresh queue and listener.
+    global _log_queue
+    _log_queue = queue.Queue()
+    _queue_handler.queue = _log_queue
+    _start_log_listener()
+
+def _stop_log_listener():
+    if _log_listener is not None:
+        _log_listener.stop()
+
+# Request threads only put records on a queue; file writes, rotation and console output
+# happen on the listener thread.
+_queue_handler = logging.handlers.QueueHandler(_log_queue)
+logging.getLogger().addHandler(_queue_handler)
+logging.getLogger().setLevel(logging.INFO)
+_start_log_listener()
+os.register_at_fork(after_in_child=_restart_log_listener)
+atexit.register(_stop_log_listener)
 
 def log_info(msg):
-    print(msg)
     logging.info(msg)
 
 def log_error(msg):
-    print(msg)
     logging.error(msg)
 
+# Read from app.log per step when tailing it, and the most one /logs response returns.
+LOG_TAIL_BLOCK = 64 * 1024
+LOG_TAIL_MAX_BYTES = int(os.getenv('LOG_TAIL_MAX_BYTES', str(1024 * 1024)))
+
+def tail_log(path, lines=None, max_bytes=LOG_TAIL_MAX_BYTES):
+    """The end of a log file: its last `lines` lines, or last `max_bytes` bytes.
+
+    Reads backwards from the end a block at a time, so only the tail is ever in memory.
+    Returns (text, offset of the text in the file, file size, file id). The file id changes
+    when the log is rotated; pass it back to read_log along with the size as offset.
+    """
+    with open(path, 'rb') as f:
+        file_id = os.fstat(f.fileno()).st_ino
+        size = f.seek(0, os.SEEK_END)
+        start = size
+        data = b''
+        while start > 0 and len(data) < max_bytes:
+            step = min(LOG_TAIL_BLOCK, start, max_bytes - len(data))
+            start -= step
+            f.seek(start)
+            data = f.read(step) + data
+            # One more newline than lines wanted, as the file ends with one.
+            if lines is not None and data.count(b'\n') > lines:
+                break
+    if lines is not None and start > 0:
+        # Drop the partial line the first block began in.
+        cut = data.find(b'\n') + 1
+        data = data[cut:]
+        start += cut
+    if lines is not None:
+        kept = data.split(b'\n')[-(lines + 1):]
+        start += len(data) - len(b'\n'.join(kept))
+        data = b'\n'.join(kept)
+    return data.decode('utf-8', errors='ignore'), start, size, file_id
+
+def read_log(path, offset, max_bytes=LOG_TAIL_MAX_BYTES, file_id=None):
+    """Log text written since offset, up to max_bytes, for incremental tailing.
+
+    Returns (text, next offset, rotated, file id). If the file is no longer the one file_id
+    names, or is shorter than offset, it was rotated and reading starts over from the
+    beginning of the new file.
+    """
+    with open(path, 'rb') as f:
+        current_id = os.fstat(f.fileno()).st_ino
+        size = f.seek(0, os.SEEK_END)
+        rotated = offset > size or (file_id is not None and file_id != current_id)
+        if rotated:
+            offset = 0
+        f.seek(offset)
+        data = f.read(min(max_bytes, size - offset))
+    # Stop at the last complete line, so the next call starts at the start of one.
+    if len(data) == max_bytes and b'\n' in data:
+        data = data[:data.rindex(b'\n') + 1]
+    return data.decode('utf-8', errors='ignore'), offset + len(data), rotated, current_id
+
+# Wait/hold times per lock, kept per process. Recent samples are used for percentiles.
+LOCK_SAMPLES = 1024
+_lock_stats = {}
+_lock_stats_mutex = threading.Lock()
+
+metrics.describe('drivesync_lock_wait_seconds', 'histogram', 'Time spent waiting for a file lock')
+metrics.describe('drivesync_lock_hold_seconds', 'histogram', 'Time a file lock was held')
+
+def _record_lock(name, waited, held):
+    metrics.observe('drivesync_lock_wait_seconds', waited, lock=name)
+    metrics.observe('drivesync_lock_hold_seconds', held, lock=name)
+    with _lock_stats_mutex:
+        stats = _lock_stats.get(name)
+        if stats is None:
+            stats = _lock_stats[name] = {
+                'count': 0, 'wait_total': 0.0, 'wait_max': 0.0, 'hold_total': 0.0, 'hold_max': 0.0,
+                'waits': deque(maxlen=LOCK_SAMPLES),
+            }
+        stats['count'] += 1
+        stats['wait_total'] += waited
+        stats['wait_max'] = max(stats['wait_max'], waited)
+        stats['hold_total'] += held
+        stats['hold_max'] = max(stats['hold_max'], held)
+        stats['waits'].append(waited)
+
+def _percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+def lock_stats():
+    """Lock wait and hold times in milliseconds, keyed by '<lock file>:<mode>'."""
+    with _lock_stats_mutex:
+        snapshot = {name: dict(stats, waits=list(stats['waits'])) for name, stats in _lock_stats.items()}
+    result = {}
+    for name, stats in snapshot.items():
+        count = stats['count']
+        result[name] = {
+            'count': count,
+            'wait_avg_ms': round(stats['wait_total'] / count * 1000, 3),
+            'wait_p50_ms': round(_percentile(stats['waits'], 50) * 1000, 3),
+            'wait_p99_ms': round(_percentile(stats['waits'], 99) * 1000, 3),
+            'wait_max_ms': round(stats['wait_max'] * 1000, 3),
+            'hold_avg_ms': round(stats['hold_total'] / count * 1000, 3),
+            'hold_max_ms': round(stats['hold_max'] * 1000, 3),
+        }
+    return result
+
 @contextmanager
-def file_lock(lock_file=LOCK_FILE):
-    """Context manager for file-based locking."""
-    with open(lock_file, 'w') as lock_fd:
-        portalocker.lock(lock_fd, portalocker.LOCK_EX)
+def file_lock(lock_file=LOCK_FILE, shared=False):
+    """Context manager for file-based locking. Shared locks can be held by many readers at once."""
+    name = f"{os.path.basename(lock_file)}:{'shared' if shared else 'exclusive'}"
+    with open(lock_file, 'a') as lock_fd:
+        start = time.perf_counter()
+        portalocker.lock(lock_fd, portalocker.LOCK_SH if shared else portalocker.LOCK_EX)
+        acquired = time.perf_counter()
         try:
             yield
         finally:
             portalocker.unlock(lock_fd)
+            _record_lock(name, acquired - start, time.perf_counter() - acquired)
+
+def read_lock():
+    """Shared lock for readers. WAL lets them run alongside each other; only writers exclude them."""
+    return file_lock(shared=True)
+
+def write_lock():
+    """Exclusive lock for anything that modifies the database file."""
+    return file_lock()
+
+def backup_lock():
+    """Serializes backups across the host without holding the database lock for the whole upload."""
+    return file_lock(BACKUP_LOCK_FILE)
+
+def startup_lock():
+    """Held by the worker initializing the database at boot; the others wait for it."""
+    return file_lock(STARTUP_LOCK_FILE)
 
 def exponential_backoff(retries):
     delay = min(2 ** retries, 60)
     log_info(f'Waiting {delay}s before retry...')
     time.sleep(delay)
 
+# Prepared statements kept per connection; pooled connections keep them across requests.
+SQLITE_STATEMENT_CACHE = int(os.getenv('SQLITE_STATEMENT_CACHE', '256'))
+
+# Seconds a connection waits on a lock held by another connection.
+SQLITE_BUSY_TIMEOUT = PROFILE['busy_timeout_ms'] / 1000
+
 def get_sqlite_connection(db_path):
     """Get a SQLite connection with optimized PRAGMA settings."""
-    conn = sqlite3.connect(db_path, timeout=10, check_same_thread=False)
+    conn = sqlite3.connect(db_path, timeout=SQLITE_BUSY_TIMEOUT, check_same_thread=False, cached_statements=SQLITE_STATEMENT_CACHE)
     try:
         # WAL mode allows concurrent reads during a write.
         conn.execute('PRAGMA journal_mode=WAL;')
         # Normal sync is faster. The OS will still handle commits. Less durable in a power failure.
         conn.execute('PRAGMA synchronous=NORMAL;')
-        # Increase cache size (e.g., 64MB). -64000 means 64000 KiloBytes.
-        conn.execute('PRAGMA cache_size = -64000;')
+        # Cache, mmap, checkpoint and memory limits come from the tuning profile (SQLITE_PROFILE).
+        for pragma in connection_pragmas():
+            conn.execute(pragma)
         # Use more memory for temporary storage before writing to disk.
         conn.execute('PRAGMA temp_store = MEMORY;')
     except Exception as e:
         log_error(f"Failed to set PRAGMA modes: {e}")
-    return conn
\ No newline at end of file
+    return conn
+
+def get_readonly_connection(db_path):
+    """Read-only SQLite connection; it never creates -wal/-shm files or changes the journal mode."""
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=SQLITE_BUSY_TIMEOUT, check_same_thread=False,
+                           cached_statements=SQLITE_STATEMENT_CACHE)
+    conn.execute('PRAGMA query_only = ON;')
+    for pragma in connection_pragmas():
+        conn.execute(pragma)
+    conn.execute('PRAGMA temp_store = MEMORY;')
+    return conn
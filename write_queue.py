@@ -0,0 +1,203 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from db_pool import write_connection
+from utils import log_error, write_lock
+
+# Most write requests one transaction may carry, and how long the writer waits for more
+# requests to join a batch once it has one (0 takes only what is already queued).
+WRITE_BATCH_SIZE = int(os.getenv('WRITE_BATCH_SIZE', '64'))
+WRITE_BATCH_MAX_WAIT = float(os.getenv('WRITE_BATCH_MAX_WAIT', '0.002'))
+# How long a request waits for the writer to pick it up before giving up.
+WRITE_QUEUE_TIMEOUT = float(os.getenv('WRITE_QUEUE_TIMEOUT', '30'))
+
+class WriteQueueTimeout(Exception):
+    pass
+
+class StatementError(Exception):
+    """Raised by a write job to report which of its statements failed."""
+
+    def __init__(self, message, index):
+        super().__init__(message)
+        self.index = index
+
+class BatchRolledBack(Exception):
+    """Raised for a job that succeeded but was rolled back with the batch by another job's error."""
+
+def _refuse_transaction_control(action, *args):
+    # A job's own COMMIT or ROLLBACK would end the batch transaction under the other jobs.
+    if action in (sqlite3.SQLITE_TRANSACTION, sqlite3.SQLITE_SAVEPOINT):
+        return sqlite3.SQLITE_DENY
+    return sqlite3.SQLITE_OK
+
+@contextmanager
+def no_transaction_control(conn):
+    """Statements run on conn inside this block cannot begin, end or name a transaction."""
+    conn.set_authorizer(_refuse_transaction_control)
+    try:
+        yield conn
+    finally:
+        conn.set_authorizer(None)
+
+class _Job:
+    def __init__(self, fn):
+        self.fn = fn
+        self.done = threading.Event()
+        self.started = False
+        self.cancelled = False
+        self.result = None
+        self.error = None
+
+class WriteQueue:
+    """Single writer thread per process that applies queued writes in group commits.
+
+    Each submitted job is a function of the writer connection. The writer takes the
+    host-wide write lock once per batch, runs every job inside its own SAVEPOINT, so a
+    failing job is rolled back alone, and commits the batch once. Jobs cannot BEGIN, COMMIT
+    or ROLLBACK themselves, which would end the batch under the others. after_commit(results)
+    is called with the results of the jobs that committed, still under the write lock, and
+    before_batch() once the lock is taken, before the batch runs.
+    """
+
+    def __init__(self, db_path, batch_size=WRITE_BATCH_SIZE, max_wait=WRITE_BATCH_MAX_WAIT, after_commit=None,
+                 before_batch=None):
+        self.db_path = db_path
+        self.batch_size = max(1, batch_size)
+        self.max_wait = max_wait
+        self.after_commit = after_commit
+        self.before_batch = before_batch
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stats_lock = threading.Lock()
+        self._jobs = 0
+        self._jobs_failed = 0
+        self._batches = 0
+        self._batches_failed = 0
+        self._largest_batch = 0
+        self._timeouts = 0
+
+    def _ensure_thread(self):
+        # Threads do not survive a fork, so a gunicorn worker starts its own writer on first use.
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+            self._thread.start()
+
+    def submit(self, fn, timeout=WRITE_QUEUE_TIMEOUT):
+        """Run fn(conn) on the writer and return its result, or raise what it raised."""
+        job = _Job(fn)
+        self._ensure_thread()
+        self._queue.put(job)
+        if not job.done.wait(timeout):
+            with self._lock:
+                if not job.started:
+                    job.cancelled = True
+            if job.cancelled:
+                with self._stats_lock:
+                    self._timeouts += 1
+                raise WriteQueueTimeout(f"Write not started within {timeout}s")
+            job.done.wait()
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def _take_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        with self._lock:
+            batch = [job for job in batch if not job.cancelled]
+            for job in batch:
+                job.started = True
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                continue
+            try:
+                self._apply(batch)
+            except Exception as e:
+                log_error(f"Write batch failed: {e}")
+                for job in batch:
+                    if job.error is None:
+                        job.error = e
+                with self._stats_lock:
+                    self._batches_failed += 1
+            finally:
+                with self._stats_lock:
+                    self._jobs += len(batch)
+                    self._jobs_failed += sum(1 for job in batch if job.error is not None)
+                    self._batches += 1
+                    self._largest_batch = max(self._largest_batch, len(batch))
+                for job in batch:
+                    job.done.set()
+
+    def _apply(self, batch):
+        with write_lock(), write_connection(self.db_path) as conn:
+            if self.before_batch is not None:
+                self.before_batch()
+            conn.execute('BEGIN')
+            applied = []
+            try:
+                for job in batch:
+                    conn.execute('SAVEPOINT write_job')
+                    try:
+                        with no_transaction_control(conn):
+                            job.result = job.fn(conn)
+                        conn.execute('RELEASE write_job')
+                    except Exception as e:
+                        job.error = e
+                        if conn.in_transaction:
+                            conn.execute('ROLLBACK TO write_job')
+                            conn.execute('RELEASE write_job')
+                        else:
+                            # Some errors (e.g. SQLITE_FULL) roll back the whole transaction,
+                            # taking the jobs applied so far with it. Those did nothing wrong
+                            # and can be sent again.
+                            for earlier in applied:
+                                earlier.error = BatchRolledBack(
+                                    f"Rolled back with the rest of its batch after another write failed: {e}")
+                            applied = []
+                            conn.execute('BEGIN')
+                        continue
+                    applied.append(job)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            if applied and self.after_commit is not None:
+                try:
+                    self.after_commit([job.result for job in applied])
+                except Exception as e:
+                    log_error(f"after_commit failed: {e}")
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'queued': self._queue.qsize(),
+                'jobs': self._jobs,
+                'jobs_failed': self._jobs_failed,
+                'batches': self._batches,
+                'batches_failed': self._batches_failed,
+                'avg_batch': round(self._jobs / self._batches, 2) if self._batches else None,
+                'largest_batch': self._largest_batch,
+                'timeouts': self._timeouts,
+                'batch_size': self.batch_size,
+                'max_wait_seconds': self.max_wait,
+            }